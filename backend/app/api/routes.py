@@ -1,58 +1,82 @@
-from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
-import json
+from fastapi import APIRouter, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+import csv
+import io
+import time
 import asyncio
 import logging
-from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional
+from pydantic import ValidationError
 from app.models.device import Device
 from app.core.gateway import gateway
+from app.core.registry import validate_devices
+from app.core.layout import layout_stats, mapping_report, plan_layout
+from app.core.planner import MAX_READ_REGISTERS
+from app.core.startup import store, timer
+from app.core.snapshot import dumps
+from app.core.trace import profiler, tracer
+from app.core import config
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-DEVICES_FILE = Path("devices.json")
-
-DEVICE_SIZES = {"oee": 4, "pm": 26, "scale": 1}
-
-def calculate_offset(devices, device_type):
-    if not devices:
-        return 0
-    max_offset = max(d.offset for d in devices)
-    last_device = next((d for d in devices if d.offset == max_offset), None)
-    if last_device:
-        return max_offset + DEVICE_SIZES[last_device.type]
-    return 0
 
 @router.get("/pm-defaults")
 async def get_pm_defaults():
     from app.models.device import DEFAULT_PM_PARAMS
     return {"params": DEFAULT_PM_PARAMS}
 
+def snapshot_response(snapshot, request):
+    """Serves a cached snapshot: 304 when the client has it, gzip when it asks for it"""
+    snap = snapshot.current()
+    headers = {"ETag": snap.etag, "Last-Modified": snap.last_modified, "Cache-Control": "no-cache",
+               "Vary": "Accept-Encoding"}
+    if snap.not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since")):
+        return Response(status_code=304, headers=headers)
+    body = snap.body
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        compressed = snap.gzipped()
+        if compressed is not None:
+            body = compressed
+            headers.update({"Content-Encoding": "gzip", "ETag": snap.gzip_etag})
+    return Response(body, media_type="application/json", headers=headers)
+
 @router.get("/devices")
-async def get_devices():
-    return gateway.devices
+async def get_devices(request: Request):
+    return snapshot_response(gateway.devices_snapshot, request)
+
+async def apply_devices(devices):
+    """Validates and applies a whole new device list, then persists it once"""
+    errors = validate_devices(devices, config.UNIFIED_REG_COUNT)
+    if errors:
+        raise HTTPException(422, {"errors": errors})
+    changes = await gateway.reconciler.apply(devices)
+    store.save()
+    return changes
 
 @router.post("/devices")
 async def add_device(device: Device):
+    if gateway.registry.get(device.name):
+        raise HTTPException(409, f"Device {device.name} already exists")
     try:
-        device.offset = calculate_offset(gateway.devices, device.type)
-        gateway.devices.append(device)
-        save_devices()
+        device.offset = gateway.registry.next_offset()
+        await apply_devices(gateway.devices + [device])
         logger.info(f"Added device: {device.name}")
         return device
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error adding device: {e}", exc_info=True)
         raise HTTPException(500, str(e))
 
 @router.put("/devices/{name}")
 async def update_device(name: str, device: Device):
-    try:
-        for i, d in enumerate(gateway.devices):
-            if d.name == name:
-                gateway.devices[i] = device
-                save_devices()
-                logger.info(f"Updated device: {name}")
-                return device
+    if not gateway.registry.get(name):
         raise HTTPException(404, "Device not found")
+    try:
+        await apply_devices([device if d.name == name else d for d in gateway.devices])
+        logger.info(f"Updated device: {name}")
+        return device
     except HTTPException:
         raise
     except Exception as e:
@@ -62,47 +86,191 @@ async def update_device(name: str, device: Device):
 @router.delete("/devices/{name}")
 async def delete_device(name: str):
     try:
-        gateway.devices = [d for d in gateway.devices if d.name != name]
-        save_devices()
+        await apply_devices([d for d in gateway.devices if d.name != name])
         logger.info(f"Deleted device: {name}")
         return {"ok": True}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error deleting device: {e}", exc_info=True)
         raise HTTPException(500, str(e))
 
+@router.get("/devices/export")
+async def export_devices():
+    return [d.model_dump(exclude={"status", "last_error"}) for d in gateway.devices]
+
+@router.post("/devices/import")
+async def import_devices(items: List[Dict[str, Any]], mode: Literal["merge", "replace"] = "merge",
+                         dry_run: bool = False):
+    """Adds or replaces many devices in one all-or-nothing step.
+
+    `merge` updates devices with matching names and appends the rest; `replace` makes
+    the import the whole configuration. Entries without an offset keep their current
+    one or are packed after the last device. Nothing changes unless every entry is valid.
+    """
+    base = [] if mode == "replace" else gateway.devices
+    current = {d.name: d for d in base}
+    next_offset = max((d.offset + d.register_count() for d in base), default=0)
+    imported, errors = [], []
+    for i, item in enumerate(items):
+        try:
+            dev = Device(**{"offset": -1, **item})
+        except ValidationError as e:
+            errors.append(f"#{i} {item.get('name', '?')}: {e.errors()[0]['loc']} {e.errors()[0]['msg']}")
+            continue
+        if dev.offset < 0:
+            prev = current.get(dev.name)
+            # An updated device keeps its place in the image if it still fits there
+            if prev is not None and prev.register_count() == dev.register_count():
+                dev.offset = prev.offset
+            else:
+                dev.offset = next_offset
+        next_offset = max(next_offset, dev.offset + dev.register_count())
+        imported.append(dev)
+    if errors:
+        raise HTTPException(422, {"errors": errors})
+
+    names = {dev.name for dev in imported}
+    if len(names) != len(imported):
+        raise HTTPException(422, {"errors": validate_devices(imported, config.UNIFIED_REG_COUNT)})
+    incoming = {dev.name: dev for dev in imported}
+    devices = [incoming.pop(d.name, d) for d in base] + list(incoming.values())
+    if dry_run:
+        errors = validate_devices(devices, config.UNIFIED_REG_COUNT)
+        if errors:
+            raise HTTPException(422, {"errors": errors})
+        _, _, changes = gateway.reconciler.diff(gateway.devices, devices)
+    else:
+        changes = await apply_devices(devices)
+        logger.info(f"Imported {len(imported)} devices ({mode}), {len(changes)} changed")
+    return {"devices": len(devices), "imported": len(imported),
+            "changes": {name: sorted(fields) for name, fields in changes.items()}}
+
+def layout_preview(block, group_by_type):
+    plan = plan_layout(gateway.devices, block, group_by_type)
+    offsets = {dev.name: offset for dev, offset in plan}
+    return plan, [d.model_copy(update={"offset": offsets[d.name]}) for d in gateway.devices]
+
+@router.get("/layout/preview")
+async def preview_layout(block: int = MAX_READ_REGISTERS, group_by_type: bool = False,
+                         format: Literal["json", "csv"] = "json"):
+    """Proposes a compacted layout; `format=csv` returns the signal mapping report alone"""
+    plan, devices = layout_preview(block, group_by_type)
+    signals = mapping_report(plan)
+    if format == "csv":
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=["device", "type", "signal", "data_type", "old_offset", "new_offset"])
+        writer.writeheader()
+        writer.writerows(signals)
+        return PlainTextResponse(out.getvalue(), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=layout_mapping.csv"})
+    return {"before": layout_stats(gateway.devices, block), "after": layout_stats(devices, block),
+            "moved": sum(1 for dev, offset in plan if dev.offset != offset),
+            "devices": [{"name": dev.name, "type": dev.type, "count": dev.register_count(),
+                         "old_offset": dev.offset, "new_offset": offset} for dev, offset in plan],
+            "signals": signals}
+
+@router.post("/layout/apply")
+async def apply_layout(block: int = MAX_READ_REGISTERS, group_by_type: bool = False):
+    """Moves every device to the previewed layout in one reconciliation"""
+    before = layout_stats(gateway.devices, block)
+    plan, devices = layout_preview(block, group_by_type)
+    changes = await apply_devices(devices)
+    logger.info(f"Applied compacted layout: {len(changes)} devices moved")
+    return {"before": before, "after": layout_stats(devices, block), "moved": len(changes),
+            "signals": mapping_report(plan)}
+
 @router.get("/data")
-async def get_data():
-    return gateway.device_data
+async def get_data(request: Request):
+    return snapshot_response(gateway.data_snapshot, request)
+
+@router.get("/history")
+async def get_history_signals():
+    return gateway.history.signals()
+
+@router.get("/history/{name}/{signal}")
+async def get_history(name: str, signal: str, start: Optional[float] = None, end: Optional[float] = None,
+                      points: int = 500):
+    result = gateway.history.query(name, signal, start, end, points)
+    if result is None:
+        raise HTTPException(404, "No history for this signal")
+    return result
+
+@router.get("/historian/stats")
+async def get_historian_stats():
+    if not gateway.historian:
+        raise HTTPException(404, "Historian disabled")
+    return gateway.historian.stats()
+
+@router.get("/historian/{name}/{signal}")
+async def get_historian(name: str, signal: str, start: Optional[float] = None, end: Optional[float] = None,
+                        points: int = 500):
+    if not gateway.historian:
+        raise HTTPException(404, "Historian disabled")
+    end = end if end is not None else time.time()
+    start = start if start is not None else end - 86400
+    return await asyncio.to_thread(gateway.historian.query, name, signal, start, end, max(1, points))
+
+@router.get("/export/stats")
+async def get_export_stats():
+    if not gateway.exporter:
+        raise HTTPException(404, "Export is disabled")
+    return gateway.exporter.stats()
+
+@router.get("/scheduler")
+async def get_scheduler():
+    return gateway.scheduler_stats()
+
+@router.get("/status")
+async def get_status():
+    """Per-device health state and round-trip time estimate (smoothed RTT, deviation, current timeout)"""
+    rtt = gateway.rtt_stats()
+    return {d.name: {"status": gateway.device_data.get(d.name, {}).get("status"), "rtt": rtt.get(d.name)}
+            for d in gateway.devices}
+
+@router.get("/startup")
+async def get_startup():
+    """Seconds spent in each startup phase"""
+    return timer.stats()
+
+@router.get("/debug/trace")
+async def get_trace(seconds: float = 5):
+    """Poll spans of the next `seconds` (the last ones with TRACE_ENABLED) as Chrome/Perfetto trace JSON"""
+    seconds = min(max(seconds, 0.1), config.DEBUG_MAX_SEC)
+    now = time.perf_counter()
+    if tracer.always:
+        doc = tracer.export(now - seconds, now)
+    else:
+        tracer.enable(seconds)
+        await asyncio.sleep(seconds)
+        doc = tracer.export(now)
+    return Response(dumps(doc), media_type="application/json",
+                    headers={"Content-Disposition": "attachment; filename=gateway_trace.json"})
+
+@router.get("/debug/profile")
+async def get_profile(seconds: float = 5, interval_ms: float = 5):
+    """Samples the event loop thread for `seconds`; returns folded stacks for flame graph tools"""
+    try:
+        stacks = await profiler.profile(min(max(seconds, 0.1), config.DEBUG_MAX_SEC), max(interval_ms, 1) / 1000)
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+    return PlainTextResponse(stacks)
+
+@router.get("/writes")
+async def get_writes(device: Optional[str] = None, limit: int = 100):
+    """Recent SCADA write-through requests, newest first, and registers still queued per device"""
+    records = [r.as_dict() for r in reversed(gateway.writer.log) if device is None or r.device == device]
+    return {"queues": gateway.write_stats(), "writes": records[:limit]}
 
 @router.websocket("/ws")
-async def websocket_endpoint(ws: WebSocket):
+async def websocket_endpoint(ws: WebSocket, devices: Optional[str] = None):
     await ws.accept()
     logger.info("WebSocket client connected")
     try:
-        while True:
-            await ws.send_json(gateway.device_data)
-            await asyncio.sleep(1)
+        await gateway.hub.serve(ws, devices.split(",") if devices else None)
     except WebSocketDisconnect:
         logger.info("WebSocket client disconnected")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
 
-def save_devices():
-    try:
-        data = [d.model_dump(exclude={"status", "last_error"}) for d in gateway.devices]
-        DEVICES_FILE.write_text(json.dumps(data, indent=2))
-        logger.info(f"Saved {len(gateway.devices)} devices")
-    except Exception as e:
-        logger.error(f"Error saving devices: {e}", exc_info=True)
-        raise
 
-def load_devices():
-    try:
-        if DEVICES_FILE.exists():
-            gateway.devices = [Device(**d) for d in json.loads(DEVICES_FILE.read_text())]
-            logger.info(f"Loaded {len(gateway.devices)} devices from {DEVICES_FILE}")
-        else:
-            logger.warning(f"No devices file found at {DEVICES_FILE}")
-    except Exception as e:
-        logger.error(f"Error loading devices: {e}", exc_info=True)
-        gateway.devices = []
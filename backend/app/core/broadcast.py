@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+from app.core import config
+
+logger = logging.getLogger(__name__)
+
+def diff_entry(old, new):
+    """Returns the keys of a device_data entry that changed, or None if nothing but the timestamp did"""
+    delta = {}
+    for key, val in new.items():
+        if key == "values" and isinstance(old.get("values"), dict) and isinstance(val, dict):
+            changed = {k: v for k, v in val.items() if old["values"].get(k) != v}
+            if changed:
+                delta["values"] = changed
+        elif key != "timestamp" and old.get(key) != val:
+            delta[key] = val
+    for key in old:
+        if key not in new:
+            delta[key] = None
+    if not delta:
+        return None
+    delta["timestamp"] = new.get("timestamp")
+    return delta
+
+class Subscriber:
+    def __init__(self, ws, devices=None, maxsize=config.WS_QUEUE_SIZE):
+        self.ws = ws
+        self.devices = set(devices) if devices else None
+        self.queue = asyncio.Queue(maxsize)
+        self.resync = False
+        self.dropped = 0
+        self.seen = None  # entries its last snapshot carried, until the next flush
+
+    def wants(self, name):
+        return self.devices is None or name in self.devices
+
+class BroadcastHub:
+    """Fans device updates out to WebSocket clients.
+
+    Updates are coalesced for `interval` seconds. Each changed device is serialized
+    once per flush and the fragments are joined into one message per distinct
+    subscription, so N clients watching everything cost one serialization. A client
+    whose send queue is full loses its backlog and gets a fresh snapshot instead. The
+    first flush after a snapshot leaves out entries that snapshot already carried.
+    """
+
+    def __init__(self, source, interval=config.WS_FLUSH_INTERVAL_SEC):
+        self.source = source
+        self.interval = interval
+        self.clients = set()
+        self.sent = {}
+        self.pending = {}
+        self._flush_handle = None
+
+    def publish(self, name, entry):
+        # Only marks the device dirty: the flush diffs its full latest entry, so reports that
+        # carry just the changed values can arrive several times per flush without loss
+        self.pending[name] = True
+        if self._flush_handle is None and self.clients:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.interval, self._flush)
+
+    def forget(self, name):
+        self.pending[name] = None
+
+    def snapshot(self, sub):
+        data = {name: entry for name, entry in self.source().items() if sub.wants(name)}
+        sub.seen = data
+        return json.dumps({"type": "snapshot", "data": data})
+
+    def _flush(self):
+        self._flush_handle = None
+        fragments = {}
+        entries = {}
+        source = self.source()
+        for name, dirty in self.pending.items():
+            entry = entries[name] = source.get(name) if dirty else None
+            if entry is None:
+                self.sent.pop(name, None)
+                fragments[name] = "null"
+                continue
+            delta = diff_entry(self.sent.get(name, {}), entry)
+            self.sent[name] = entry
+            if delta is not None:
+                fragments[name] = json.dumps(delta)
+        self.pending.clear()
+        messages = {}
+        for sub in self.clients:
+            if sub.seen is not None:
+                msg = self._catch_up(sub, entries)
+                if msg is not None:
+                    self._enqueue(sub, msg)
+                continue
+            key = None if sub.devices is None else frozenset(sub.devices & fragments.keys())
+            if not fragments or key is not None and not key:
+                continue
+            msg = messages.get(key)
+            if msg is None:
+                names = fragments.keys() if key is None else key
+                body = ",".join(f"{json.dumps(n)}:{fragments[n]}" for n in names)
+                msg = messages[key] = f'{{"type":"delta","data":{{{body}}}}}'
+            self._enqueue(sub, msg)
+
+    def _catch_up(self, sub, entries):
+        """First delta after a snapshot: diffed against what that snapshot carried, not the last flush"""
+        seen, sub.seen = sub.seen, None
+        fragments = []
+        for name, entry in entries.items():
+            if not sub.wants(name) or seen.get(name) is entry:
+                continue  # entries are replaced, never mutated, so this one is already there
+            if entry is None:
+                if name in seen:
+                    fragments.append(f"{json.dumps(name)}:null")
+                continue
+            delta = diff_entry(seen.get(name, {}), entry)
+            if delta is not None:
+                fragments.append(f"{json.dumps(name)}:{json.dumps(delta)}")
+        if not fragments:
+            return None
+        return f'{{"type":"delta","data":{{{",".join(fragments)}}}}}'
+
+    def _enqueue(self, sub, msg):
+        if sub.resync:
+            return
+        try:
+            sub.queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            # Slow consumer: drop its backlog and catch it up with a snapshot when it drains
+            sub.dropped += sub.queue.qsize()
+            self._resync(sub)
+
+    async def serve(self, ws, devices=None):
+        """Streams to one accepted WebSocket until it disconnects"""
+        sub = Subscriber(ws, devices)
+        self.clients.add(sub)
+        self._resync(sub)
+        sender = asyncio.create_task(self._send_loop(sub))
+        try:
+            while True:
+                msg = await ws.receive_json()
+                if isinstance(msg, dict) and "subscribe" in msg:
+                    sub.devices = set(msg["subscribe"]) if msg["subscribe"] else None
+                    self._resync(sub)
+        finally:
+            self.clients.discard(sub)
+            sender.cancel()
+
+    def _resync(self, sub):
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.seen = None
+        sub.resync = True
+        sub.queue.put_nowait(None)
+
+    async def _send_loop(self, sub):
+        try:
+            while True:
+                msg = await sub.queue.get()
+                if msg is None:
+                    sub.resync = False
+                    msg = self.snapshot(sub)
+                await sub.ws.send_text(msg)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"WebSocket send stopped: {e}")
+
+    def stats(self):
+        return {"clients": len(self.clients),
+                "queued": sum(sub.queue.qsize() for sub in self.clients),
+                "dropped": sum(sub.dropped for sub in self.clients)}
@@ -0,0 +1,127 @@
+import os
+
+def env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+def env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return int(default)
+
+def env_bool(name, default=False):
+    val = os.getenv(name)
+    if val is None:
+        return default
+    return val.strip().lower() in ("1", "true", "yes", "on")
+
+# Size of the holding-register image served on port 502
+UNIFIED_REG_COUNT = env_int("UNIFIED_REG_COUNT", 30000)
+
+# Default per-device poll interval, overridable with Device.poll_interval
+SCAN_INTERVAL_SEC = env_float("SCAN_INTERVAL_SEC", 1.0)
+
+# How often devices.json is checked for external edits (0 disables the watcher)
+CONFIG_WATCH_SEC = env_float("CONFIG_WATCH_SEC", 2.0)
+# devices.json saves: how long edits are collected into one write, and rotated backups kept
+CONFIG_SAVE_DELAY_SEC = env_float("CONFIG_SAVE_DELAY_SEC", 0.5)
+CONFIG_BACKUPS = env_int("CONFIG_BACKUPS", 5)
+
+# Startup: endpoints connected concurrently, how long the first poll waits for those connects, and
+# the register image saved at shutdown and served again at startup until devices answer (skipped
+# when older than the max age; an empty path disables it)
+STARTUP_CONNECT_CONCURRENCY = env_int("STARTUP_CONNECT_CONCURRENCY", 64)
+STARTUP_CONNECT_WAIT_SEC = env_float("STARTUP_CONNECT_WAIT_SEC", 1.0)
+IMAGE_SNAPSHOT_PATH = os.getenv("IMAGE_SNAPSHOT_PATH", "image_snapshot.bin")
+IMAGE_SNAPSHOT_MAX_AGE_SEC = env_float("IMAGE_SNAPSHOT_MAX_AGE_SEC", 3600.0)
+
+# Field-side Modbus client settings
+MODBUS_TIMEOUT_SEC = env_float("MODBUS_TIMEOUT_SEC", 5)
+MODBUS_RETRIES = env_int("MODBUS_RETRIES", 1)
+
+# Adaptive timeouts: per-device RTT estimate (TCP RTO style) sets each request's timeout, between
+# RTT_MIN_TIMEOUT_SEC and MODBUS_TIMEOUT_SEC, and up to RTT_MAX_RETRIES retries within the time
+# the fixed MODBUS_TIMEOUT_SEC/MODBUS_RETRIES would take
+RTT_ADAPTIVE = env_bool("RTT_ADAPTIVE", True)
+RTT_MIN_TIMEOUT_SEC = env_float("RTT_MIN_TIMEOUT_SEC", 0.05)
+RTT_MAX_RETRIES = env_int("RTT_MAX_RETRIES", 3)
+
+# Connection pool
+POOL_BACKOFF_MIN_SEC = env_float("POOL_BACKOFF_MIN_SEC", 1.0)
+POOL_BACKOFF_MAX_SEC = env_float("POOL_BACKOFF_MAX_SEC", 30.0)
+POOL_IDLE_TIMEOUT_SEC = env_float("POOL_IDLE_TIMEOUT_SEC", 60.0)
+POOL_HEALTH_INTERVAL_SEC = env_float("POOL_HEALTH_INTERVAL_SEC", 10.0)
+# Requests in flight per endpoint; above 1 enables transaction-ID pipelining
+PIPELINE_WINDOW = env_int("PIPELINE_WINDOW", 1)
+
+# Sharded polling: worker processes (0 polls on the main event loop), how often workers send
+# poll results back, and how often they report scheduler and pool stats
+SHARD_WORKERS = env_int("SHARD_WORKERS", 0)
+SHARD_FLUSH_SEC = env_float("SHARD_FLUSH_SEC", 0.05)
+SHARD_STATS_SEC = env_float("SHARD_STATS_SEC", 2.0)
+
+# Report-by-exception: longest a signal goes unreported when it stays within its deadband
+# (0 reports every poll)
+RBE_HEARTBEAT_SEC = env_float("RBE_HEARTBEAT_SEC", 60.0)
+
+# SCADA write-through: forward port-502 writes in a device's registers to the device (devices can
+# override with `writable`), pending registers per device before writes are refused as busy, and
+# how many write results /api/writes keeps
+WRITE_THROUGH = env_bool("WRITE_THROUGH", False)
+WRITE_QUEUE_MAX = env_int("WRITE_QUEUE_MAX", 1000)
+WRITE_LOG_SIZE = env_int("WRITE_LOG_SIZE", 500)
+
+# Derived signals: per-type defaults for devices without a `derived` list, local times at which
+# shift totals restart, and the longest poll gap still counted towards durations and rates
+DERIVED_DEFAULTS = env_bool("DERIVED_DEFAULTS", True)
+SHIFT_STARTS = os.getenv("SHIFT_STARTS", "06:00,14:00,22:00")
+DERIVED_MAX_GAP_SEC = env_float("DERIVED_MAX_GAP_SEC", 300.0)
+
+# Device circuit breaker
+HEALTH_FAIL_THRESHOLD = env_int("HEALTH_FAIL_THRESHOLD", 3)
+HEALTH_BACKOFF_MIN_SEC = env_float("HEALTH_BACKOFF_MIN_SEC", 2.0)
+HEALTH_BACKOFF_MAX_SEC = env_float("HEALTH_BACKOFF_MAX_SEC", 60.0)
+
+# Poll tracing: record spans all the time (otherwise only while /api/debug/trace asks), spans kept,
+# event-loop delays recorded as stalls, and the longest trace or profile one request may take
+TRACE_ENABLED = env_bool("TRACE_ENABLED", False)
+TRACE_BUFFER_SPANS = env_int("TRACE_BUFFER_SPANS", 200000)
+TRACE_STALL_MS = env_float("TRACE_STALL_MS", 50.0)
+DEBUG_MAX_SEC = env_float("DEBUG_MAX_SEC", 60.0)
+
+# /api/data snapshot: shortest time between re-serializations (/api/devices follows every edit)
+SNAPSHOT_INTERVAL_SEC = env_float("SNAPSHOT_INTERVAL_SEC", 1.0)
+
+# WebSocket broadcast
+WS_FLUSH_INTERVAL_SEC = env_float("WS_FLUSH_INTERVAL_SEC", 0.2)
+WS_QUEUE_SIZE = env_int("WS_QUEUE_SIZE", 32)
+
+# Northbound export: http(s)://host/path or mqtt://[user:password@]host[:port]/topic (empty disables).
+# Batches close every EXPORT_INTERVAL_SEC or at EXPORT_BATCH_SIZE samples; EXPORT_WINDOW batches may
+# await acknowledgement; past EXPORT_QUEUE_BATCHES in memory, or while the sink is down, batches are
+# spooled to EXPORT_SPOOL_DIR (oldest dropped beyond EXPORT_SPOOL_MAX_MB)
+EXPORT_URL = os.getenv("EXPORT_URL", "")
+EXPORT_INTERVAL_SEC = env_float("EXPORT_INTERVAL_SEC", 1.0)
+EXPORT_BATCH_SIZE = env_int("EXPORT_BATCH_SIZE", 10000)
+EXPORT_GZIP = env_bool("EXPORT_GZIP", True)
+EXPORT_WINDOW = env_int("EXPORT_WINDOW", 4)
+EXPORT_QUEUE_BATCHES = env_int("EXPORT_QUEUE_BATCHES", 30)
+EXPORT_TIMEOUT_SEC = env_float("EXPORT_TIMEOUT_SEC", 10.0)
+EXPORT_SPOOL_DIR = os.getenv("EXPORT_SPOOL_DIR", "export_spool")
+EXPORT_SPOOL_MAX_MB = env_float("EXPORT_SPOOL_MAX_MB", 256)
+
+# In-memory time series: samples kept per signal, and how far back queries may reach.
+# Each sample takes 12 bytes, so the default is 42 KB per signal, about 42 MB for 1000 signals.
+TS_CAPACITY = env_int("TS_CAPACITY", 3600)
+TS_RETENTION_SEC = env_float("TS_RETENTION_SEC", 3600)
+
+# On-disk historian (SQLite, WAL mode)
+HISTORIAN_ENABLED = env_bool("HISTORIAN_ENABLED", True)
+HISTORIAN_PATH = os.getenv("HISTORIAN_PATH", "history.db")
+HISTORIAN_BATCH_SIZE = env_int("HISTORIAN_BATCH_SIZE", 5000)
+HISTORIAN_FLUSH_SEC = env_float("HISTORIAN_FLUSH_SEC", 1.0)
+HISTORIAN_RETENTION_DAYS = env_float("HISTORIAN_RETENTION_DAYS", 30)
+HISTORIAN_QUEUE_SIZE = env_int("HISTORIAN_QUEUE_SIZE", 10000)
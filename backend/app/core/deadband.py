@@ -0,0 +1,55 @@
+import math
+from app.core import config
+
+def parse_deadband(spec):
+    """Returns (absolute, percent) for a deadband given as 0.5 (absolute) or "2%" (of the last value)"""
+    if isinstance(spec, str) and spec.strip().endswith("%"):
+        return 0.0, float(spec.strip()[:-1])
+    return float(spec or 0), 0.0
+
+class ChangeFilter:
+    """Report-by-exception state for one device.
+
+    A value is reported when it moves past its deadband relative to the last
+    reported value, or when it has not been reported for `heartbeat` seconds.
+    `values` always holds the last reported value of every signal; it is replaced,
+    never mutated, so earlier entries that share it stay valid.
+    """
+
+    def __init__(self, deadband=0, deadbands=None, heartbeat=config.RBE_HEARTBEAT_SEC):
+        self.default = parse_deadband(deadband)
+        self.deadbands = {name: parse_deadband(spec) for name, spec in (deadbands or {}).items()}
+        self.heartbeat = heartbeat
+        self.values = {}
+        self.reported_at = {}
+
+    @classmethod
+    def for_device(cls, dev, previous=None):
+        rbe = cls(dev.deadband, dev.deadbands,
+                  dev.heartbeat if dev.heartbeat is not None else config.RBE_HEARTBEAT_SEC)
+        if previous is not None:
+            rbe.values, rbe.reported_at = previous.values, previous.reported_at
+        return rbe
+
+    def exceeds(self, name, old, new):
+        if isinstance(new, bool) or not isinstance(new, (int, float)) or not isinstance(old, (int, float)):
+            return new != old
+        if isinstance(new, float) and not math.isfinite(new):
+            return new != old
+        absolute, percent = self.deadbands.get(name, self.default)
+        band = max(absolute, abs(old) * percent / 100)
+        return abs(new - old) > band if band else new != old
+
+    def update(self, values, now):
+        """Returns the subset of `values` to report and records it as reported"""
+        changed = {}
+        for name, val in values.items():
+            if name not in self.values:
+                changed[name] = val
+            elif self.exceeds(name, self.values[name], val) or now - self.reported_at[name] >= self.heartbeat:
+                changed[name] = val
+        if changed:
+            self.values = {**self.values, **changed}
+            for name in changed:
+                self.reported_at[name] = now
+        return changed
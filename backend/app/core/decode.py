@@ -0,0 +1,84 @@
+import math
+import struct
+from app.core.planner import ReadBlock, plan_reads
+
+# struct code and register width per supported data type
+DATA_TYPES = {
+    "int16": ("h", 1), "uint16": ("H", 1),
+    "int32": ("i", 2), "uint32": ("I", 2),
+    "float32": ("f", 2), "float64": ("d", 4),
+}
+
+# Byte order as the bytes of a 32-bit value ABCD appear on the wire. Every variant is a
+# struct endianness plus, for the word-swapped ones, reversing the value's registers.
+BYTE_ORDERS = {
+    "ABCD": (">", False),  # big-endian
+    "CDAB": (">", True),   # word swap
+    "BADC": ("<", True),   # byte swap
+    "DCBA": ("<", False),  # little-endian
+}
+
+def encode_value(value, data_type, byte_order="ABCD"):
+    """Registers holding `value` the way the device stores it; the inverse of DecodeBlock.decode"""
+    endian, swap_words = BYTE_ORDERS[byte_order]
+    code, width = DATA_TYPES[data_type]
+    if code not in "fd":
+        value = int(round(value))
+    regs = list(struct.unpack(f">{width}H", struct.pack(endian + code, value)))
+    return regs[::-1] if swap_words else regs
+
+class DecodeBlock:
+    """One block read plus the precompiled Structs that turn its registers into values"""
+
+    def __init__(self, block, types, byte_order):
+        self.start = block.start
+        self.count = block.count
+        self.params = block.params
+        self.types = {name: types[name] for name, *_ in block.params}
+        self.byte_order = byte_order
+        endian, swap_words = BYTE_ORDERS[byte_order]
+        self._names = [(name, rel) for name, _, _, rel in block.params]
+        self._pack = struct.Struct(f">{block.count}H")
+        self._order = None
+        self._each = None
+        fmt, pos = [], 0
+        for name, idx, width, _ in block.params:
+            if idx < pos:
+                # Parameters sharing registers cannot be one format string; decode each on its own
+                self._unpack = None
+                self._each = [(idx, width, swap_words, struct.Struct(f"{endian}{DATA_TYPES[types[name]][0]}"))
+                              for name, idx, width, _ in block.params]
+                return
+            fmt.append("x" * (2 * (idx - pos)) + DATA_TYPES[types[name]][0])
+            pos = idx + width
+        self._unpack = struct.Struct(endian + "".join(fmt) + "x" * (2 * (block.count - pos)))
+        if swap_words:
+            order = list(range(block.count))
+            for _, idx, width, _ in block.params:
+                order[idx:idx + width] = reversed(order[idx:idx + width])
+            self._order = order
+
+    def decode(self, regs):
+        """Returns [(name, relative image offset, value)], skipping NaN and infinities"""
+        if self._each is not None:
+            values = [st.unpack(struct.pack(f">{width}H", *(regs[idx:idx + width][::-1] if swap
+                                                            else regs[idx:idx + width])))[0]
+                      for idx, width, swap, st in self._each]
+        else:
+            if self._order is not None:
+                regs = [regs[i] for i in self._order]
+            values = self._unpack.unpack(self._pack.pack(*regs))
+        return [(name, rel, val) for (name, rel), val in zip(self._names, values)
+                if not isinstance(val, float) or math.isfinite(val)]
+
+    def split(self):
+        """Single-parameter blocks, for meters that reject reads spanning undefined registers"""
+        return [DecodeBlock(ReadBlock(self.start + idx, width, [(name, 0, width, rel)]), self.types, self.byte_order)
+                for name, idx, width, rel in self.params]
+
+def build_decode_plan(specs, byte_order="ABCD", max_gap=0):
+    """Compiles (name, addr, rel, data_type) specs into merged, ready-to-decode block reads"""
+    types = {name: dtype for name, _, _, dtype in specs}
+    blocks = plan_reads([(name, addr, rel, DATA_TYPES[dtype][1]) for name, addr, rel, dtype in specs],
+                        max_gap=max_gap)
+    return [DecodeBlock(block, types, byte_order) for block in blocks]
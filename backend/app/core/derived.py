@@ -0,0 +1,151 @@
+import time
+from datetime import datetime, timedelta
+from app.core import config
+
+def parse_shift_starts(text):
+    """"06:00,14:00,22:00" -> sorted [(hour, minute)]"""
+    starts = []
+    for part in text.split(","):
+        if part.strip():
+            hour, _, minute = part.strip().partition(":")
+            starts.append((int(hour), int(minute or 0)))
+    return sorted(starts)
+
+class ShiftClock:
+    """Start of the current shift in local time, recomputed only when a boundary passes"""
+
+    def __init__(self, starts=config.SHIFT_STARTS):
+        self.starts = parse_shift_starts(starts)
+        self.start = None
+        self.end = 0.0
+
+    def current(self, now):
+        if not self.starts:
+            return None
+        if self.start is None or not self.start <= now < self.end:
+            day = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+            bounds = [(day + timedelta(days=d, hours=h, minutes=m)).timestamp()
+                      for d in (-1, 0, 1) for h, m in self.starts]
+            self.start = max(b for b in bounds if b <= now)
+            self.end = min(b for b in bounds if b > now)
+        return self.start
+
+shift_clock = ShiftClock()
+
+def increase(old, new, wrap):
+    """Counter increase from `old` to `new`, across one wrap; None when the counter went back"""
+    delta = new - old
+    if delta < 0:
+        # After a rollover the counter appears to go back more than half its range; a smaller step back is a reset
+        if not wrap or delta + wrap > wrap / 2:
+            return None  # meter reset or replaced
+        delta += wrap
+    return delta
+
+def number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+class Delta:
+    """Increase of a counter since the previous poll"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.last = None
+
+    def reset(self):
+        pass
+
+    def update(self, value, now, gap):
+        if not number(value):
+            return None
+        last, self.last = self.last, value
+        if last is None:
+            return None
+        return increase(last, value, self.spec.wrap)
+
+class Rate(Delta):
+    """Counter increase per `per` seconds, averaged over at least `window` seconds"""
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.since = None
+        self.total = 0
+
+    def update(self, value, now, gap):
+        delta = super().update(value, now, gap)
+        if delta is None or gap > config.DERIVED_MAX_GAP_SEC or self.since is None:
+            self.since, self.total = now, 0
+            return None
+        self.total += delta
+        elapsed = now - self.since
+        if elapsed < self.spec.window or elapsed <= 0:
+            return None
+        rate = self.total / elapsed * self.spec.per
+        self.since, self.total = now, 0
+        return round(rate, 3)
+
+class Total(Delta):
+    """Counter increase accumulated since the shift (or the gateway) started"""
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.total = 0
+
+    def reset(self):
+        self.total = 0
+
+    def update(self, value, now, gap):
+        delta = super().update(value, now, gap)
+        if delta is not None:
+            self.total += delta
+        return round(self.total, 3)
+
+class Duration:
+    """Seconds the source spent at `state`, counting each poll interval towards the state it started in"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.active = False
+        self.total = 0.0
+
+    def reset(self):
+        self.total = 0.0
+
+    def update(self, value, now, gap):
+        if self.active and gap <= config.DERIVED_MAX_GAP_SEC:
+            self.total += gap
+        self.active = value == self.spec.state
+        return round(self.total, 1)
+
+KINDS = {"delta": Delta, "rate": Rate, "total": Total, "duration": Duration}
+
+class DerivedEngine:
+    """Computes one device's derived signals from each poll's values, O(1) per signal.
+
+    State survives device edits for signals whose definition did not change.
+    """
+
+    def __init__(self, specs, previous=None, clock=shift_clock):
+        old = {(s.name, s.model_dump_json()): state for s, state in previous.outputs} if previous else {}
+        self.outputs = [(spec, old.get((spec.name, spec.model_dump_json())) or KINDS[spec.kind](spec))
+                        for spec in specs]
+        self.clock = clock
+        self.shift = previous.shift if previous else None
+        self.last = previous.last if previous else None
+
+    def update(self, values, now=None):
+        now = time.time() if now is None else now
+        gap = now - self.last if self.last is not None else 0.0
+        self.last = now
+        shift = self.clock.current(now)
+        new_shift = shift != self.shift
+        self.shift = shift
+        out = {}
+        for spec, state in self.outputs:
+            if new_shift and spec.reset == "shift":
+                state.reset()
+            if spec.source in values:
+                result = state.update(values[spec.source], now, gap)
+                if result is not None:
+                    out[spec.name] = result
+        return out
@@ -0,0 +1,284 @@
+import asyncio
+import bisect
+import gzip
+import logging
+import os
+import socket
+import time
+import urllib.request
+from collections import deque
+from urllib.parse import unquote, urlparse
+from app.core.mqtt import MqttClient
+from app.core.snapshot import dumps
+from app.core import config
+
+logger = logging.getLogger(__name__)
+
+RETRY_MIN_SEC = 1.0
+RETRY_MAX_SEC = 60.0
+
+class HttpSink:
+    """POSTs each batch to `url`; any 2xx answer acknowledges it"""
+
+    def __init__(self, url, timeout=config.EXPORT_TIMEOUT_SEC):
+        self.url = url
+        self.timeout = timeout
+
+    async def send(self, payload, compressed):
+        await asyncio.to_thread(self._post, payload, compressed)
+
+    def _post(self, payload, compressed):
+        headers = {"Content-Type": "application/json"}
+        if compressed:
+            headers["Content-Encoding"] = "gzip"
+        request = urllib.request.Request(self.url, data=payload, headers=headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def close(self):
+        pass
+
+class MqttSink:
+    """Publishes each batch as one QoS 1 message on `topic`; the broker's PUBACK acknowledges it.
+
+    MQTT 3.1.1 has no headers, so consumers recognize gzip payloads by their magic bytes.
+    """
+
+    def __init__(self, host, port, topic, username=None, password=None, timeout=config.EXPORT_TIMEOUT_SEC,
+                 window=config.EXPORT_WINDOW):
+        self.topic = topic
+        self.client = MqttClient(host, port, client_id=f"modbus-gateway-{socket.gethostname()}",
+                                 username=username, password=password, timeout=timeout, window=window)
+        self._connecting = asyncio.Lock()
+
+    async def send(self, payload, compressed):
+        async with self._connecting:
+            if not self.client.connected:
+                await self.client.connect()
+        await self.client.publish(self.topic, payload)
+
+    def close(self):
+        self.client.close()
+
+def make_sink(url):
+    """Sink for http(s)://host/path or mqtt://[user:password@]host[:port]/topic"""
+    parsed = urlparse(url)
+    if parsed.scheme in ("http", "https"):
+        return HttpSink(url)
+    if parsed.scheme == "mqtt":
+        return MqttSink(parsed.hostname, parsed.port or 1883, parsed.path.lstrip("/") or "modbus_gateway/data",
+                        unquote(parsed.username) if parsed.username else None,
+                        unquote(parsed.password) if parsed.password else None)
+    raise ValueError(f"Unsupported export URL: {url}")
+
+class Spool:
+    """Batches waiting on disk, one file each, named by sequence number so replay is oldest first.
+
+    File I/O runs in worker threads; the file list is only touched on the event loop.
+    """
+
+    def __init__(self, path=config.EXPORT_SPOOL_DIR, max_bytes=config.EXPORT_SPOOL_MAX_MB * 2**20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.files = deque()
+        self.sizes = {}
+        self.bytes = 0
+        self.dropped = 0
+
+    def open(self):
+        """Picks up batches left over from a previous run; returns the highest sequence number seen"""
+        os.makedirs(self.path, exist_ok=True)
+        names = sorted(name for name in os.listdir(self.path) if name.endswith((".json", ".json.gz")))
+        for name in names:
+            self.files.append(name)
+            self.sizes[name] = os.path.getsize(os.path.join(self.path, name))
+            self.bytes += self.sizes[name]
+        if names:
+            logger.info(f"Export spool holds {len(names)} batches from a previous run")
+        return int(names[-1].split(".")[0]) if names else 0
+
+    async def put(self, seq, payload, compressed):
+        name = f"{seq:012d}.json" + (".gz" if compressed else "")
+        await asyncio.to_thread(self._write, name, payload)
+        self.files.append(name)
+        self.sizes[name] = len(payload)
+        self.bytes += len(payload)
+        while self.bytes > self.max_bytes and len(self.files) > 1:
+            # Full: the oldest data is the least useful to the MES, drop it first
+            await self.remove(self.files.popleft())
+            self.dropped += 1
+
+    def _write(self, name, payload):
+        tmp = os.path.join(self.path, name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, os.path.join(self.path, name))
+
+    def restore(self, name):
+        """Puts back a batch that was taken for sending, in sequence order"""
+        bisect.insort(self.files, name)
+
+    async def read(self, name):
+        return await asyncio.to_thread(self._read, os.path.join(self.path, name))
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def remove(self, name):
+        self.bytes -= self.sizes.pop(name, 0)
+        try:
+            await asyncio.to_thread(os.remove, os.path.join(self.path, name))
+        except FileNotFoundError:
+            pass
+
+class Exporter:
+    """Northbound export stage fed with the gateway's poll reports.
+
+    `record` only appends to the open batch. A batch closes after `interval` seconds or
+    `batch_size` samples, is serialized and compressed once, and is sent with at most
+    `window` batches awaiting acknowledgement. While the sink fails, or when more than
+    `queue_batches` wait in memory, batches go to the disk spool instead. Spooled
+    batches are sent first once the sink is back, so delivery stays in order apart from
+    retried batches. Delivery is at least once; `seq` lets the receiver drop repeats.
+    """
+
+    def __init__(self, sink, interval=config.EXPORT_INTERVAL_SEC, batch_size=config.EXPORT_BATCH_SIZE,
+                 window=config.EXPORT_WINDOW, queue_batches=config.EXPORT_QUEUE_BATCHES,
+                 compress=config.EXPORT_GZIP, spool=None, stop_timeout=config.EXPORT_TIMEOUT_SEC):
+        self.sink = sink
+        self.interval = interval
+        self.batch_size = batch_size
+        self.window = window
+        self.queue_batches = queue_batches
+        self.compress = compress
+        self.spool = spool or Spool()
+        self.stop_timeout = stop_timeout
+        self.samples = []
+        self.queue = deque()  # (seq, payload) in memory, not yet sent
+        self.inflight = 0
+        self.sending = set()  # _send tasks
+        self.seq = 0
+        self.retry_at = 0.0
+        self.backoff = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.bytes_sent = 0
+        self._full = asyncio.Event()
+        self._task = None
+
+    def record(self, name, report):
+        self.samples.append({"device": name, **report})
+        if len(self.samples) >= self.batch_size:
+            self._full.set()
+
+    def start(self):
+        if self._task is None:
+            self.seq = self.spool.open()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Spools whatever has not been sent, so the next start replays it"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        if self.sending:
+            # Give batches in flight up to stop_timeout; a cancelled send spools its batch
+            _, pending = await asyncio.wait(self.sending, timeout=self.stop_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+        self._close_batch()
+        while self.queue:
+            seq, payload = self.queue.popleft()
+            await self.spool.put(seq, payload, self.compress)
+        self.sink.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                self._close_batch()
+                await self._overflow()
+                self._pump()
+            except Exception as e:
+                logger.error(f"Export error: {e}")
+
+    def _close_batch(self):
+        if not self.samples:
+            return
+        samples, self.samples = self.samples, []
+        self.seq += 1
+        payload = dumps({"seq": self.seq, "gateway": socket.gethostname(), "sent_at": time.time(),
+                         "samples": samples})
+        if self.compress:
+            payload = gzip.compress(payload, compresslevel=5)
+        self.queue.append((self.seq, payload))
+
+    async def _overflow(self):
+        """Moves batches to disk while the sink is down, or behind it, or the memory backlog is full"""
+        while self.queue and (self.spool.files or time.monotonic() < self.retry_at
+                              or len(self.queue) > self.queue_batches):
+            seq, payload = self.queue.popleft()
+            await self.spool.put(seq, payload, self.compress)
+
+    def _pump(self):
+        if self._task is None:
+            return  # stopping
+        while self.inflight < self.window and time.monotonic() >= self.retry_at:
+            if self.spool.files:
+                item = (None, self.spool.files.popleft())
+            elif self.queue:
+                item = self.queue.popleft()
+            else:
+                return
+            self.inflight += 1
+            task = asyncio.create_task(self._send(*item))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    async def _send(self, seq, item):
+        """Sends one batch: `item` is the payload, or with `seq` None the name of a spooled file"""
+        spooled = seq is None
+        compressed = item.endswith(".gz") if spooled else self.compress
+        try:
+            payload = await self.spool.read(item) if spooled else item
+            await self.sink.send(payload, compressed)
+        except asyncio.CancelledError:
+            if spooled:
+                self.spool.restore(item)
+            else:
+                await self.spool.put(seq, item, compressed)
+            raise
+        except Exception as e:
+            self.failed += 1
+            # Batches in flight together fail together; only the first one backs off further
+            if time.monotonic() >= self.retry_at:
+                self.backoff = min(RETRY_MAX_SEC, self.backoff * 2 if self.backoff else RETRY_MIN_SEC)
+                self.retry_at = time.monotonic() + self.backoff
+                logger.warning(f"Export failed ({e or type(e).__name__}), spooling, retry in {self.backoff:.0f}s")
+            if spooled:
+                self.spool.restore(item)
+            else:
+                await self.spool.put(seq, item, compressed)
+        else:
+            self.sent += 1
+            self.bytes_sent += len(payload)
+            self.backoff = 0.0
+            if spooled:
+                await self.spool.remove(item)
+        finally:
+            self.inflight -= 1
+        self._pump()
+
+    def stats(self):
+        return {"sent": self.sent, "failed": self.failed, "bytes_sent": self.bytes_sent, "inflight": self.inflight,
+                "queued": len(self.queue), "open_samples": len(self.samples), "spooled": len(self.spool.files),
+                "spool_bytes": self.spool.bytes, "spool_dropped": self.spool.dropped,
+                "retry_in": max(0.0, self.retry_at - time.monotonic())}
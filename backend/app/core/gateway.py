@@ -2,110 +2,405 @@ import asyncio
 import struct
 import time
 import logging
-from pymodbus.client import AsyncModbusTcpClient
-from pymodbus.server import StartAsyncTcpServer
-from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
+from array import array
+from pymodbus.server import ModbusTcpServer
+from pymodbus.datastore import ModbusServerContext
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+from app.core.registers import ImageContext, RegisterImage
+from app.core.pool import ConnectionPool
+from app.core.scheduler import PollScheduler
+from app.core.deadband import ChangeFilter
+from app.core.derived import DerivedEngine
+from app.core.rtt import RttEstimator
+from app.core.reconciler import Reconciler
+from app.core.writes import WriteThrough
+from app.core.registry import DeviceRegistry
+from app.core.health import DeviceHealth, DEGRADED, OFFLINE
+from app.core.broadcast import BroadcastHub
+from app.core.timeseries import TimeSeriesStore
+from app.core.metrics import Registry
+from app.core.snapshot import Snapshot
+from app.core.trace import tracer
+from app.core import config
 
 logger = logging.getLogger(__name__)
 
+F32 = struct.Struct(">f")
+HH = struct.Struct(">HH")
+
+# Signals in register order, from the device's register 1
+OEE_SIGNALS = ("available_status", "meters_hsc", "new_output_flag", "start_of_production")
+SCALE_SIGNALS = ("weight",)
+
+def error_kind(exc):
+    if isinstance(exc, (ModbusIOException, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(exc, ConnectionException):
+        return "connection"
+    return "exception"
+
 class ModbusGateway:
     def __init__(self):
-        store = ModbusSlaveContext(hr=ModbusSequentialDataBlock(0, [0]*30000))
+        self.shards = None
+        if config.SHARD_WORKERS > 0:
+            from app.core.sharding import ShardManager
+            self.shards = ShardManager(config.SHARD_WORKERS)
+        self.image = self.shards.image if self.shards else RegisterImage(config.UNIFIED_REG_COUNT)
+        store = ImageContext(hr=self.image, zero_mode=True)
         self.context = ModbusServerContext(slaves=store, single=True)
-        self.devices = []
+        self.buffers = {}
+        self.registry = DeviceRegistry()
+        self.paused = set()  # names held out of the schedule while being reconfigured
         self.device_data = {}
+        self.data_snapshot = Snapshot(lambda: self.device_data)
+        # Unthrottled: the device manager refetches right after saving and must see its edit
+        self.devices_snapshot = Snapshot(lambda: [dev.model_dump() for dev in self.devices], min_interval=0)
         self.running = False
+        self.server = None
+        self.pool = ConnectionPool()
+        self.health = {}
+        self.rtt = {}
+        self.filters = {}
+        self.derived = {}
+        self.scheduler = PollScheduler(self.poll_device, hold=self.hold_device)
+        self.hub = BroadcastHub(lambda: self.device_data)
+        self.history = TimeSeriesStore()
+        self.listeners = [self.hub.publish, self.history.record]
+        # Optional stages are imported only when configured, like sharding, to keep startup lean
+        self.historian = None
+        if config.HISTORIAN_ENABLED:
+            from app.core.historian import Historian
+            self.historian = Historian()
+            self.listeners.append(self.historian.record)
+        self.exporter = None
+        if config.EXPORT_URL:
+            from app.core.export import Exporter, make_sink
+            self.exporter = Exporter(make_sink(config.EXPORT_URL))
+            self.listeners.append(self.exporter.record)
+        self.reconciler = Reconciler(self)
+        self.writer = WriteThrough(self)
+        self.image.on_write = self.writer.handle
+        self.metrics = Registry()
+        self.register_metrics()
+
+    @property
+    def devices(self):
+        return self.registry.devices
+
+    @devices.setter
+    def devices(self, devices):
+        self.registry = DeviceRegistry(devices)
+        self.devices_snapshot.touch()
+
+    def schedulable(self):
+        if not self.paused:
+            return self.devices
+        return [dev for dev in self.devices if dev.name not in self.paused]
+
+    def register_metrics(self):
+        m = self.metrics
+        self.poll_latency = m.histogram("gateway_poll_duration_seconds", "Time to poll one device", ("device",))
+        self.poll_requests = m.histogram("gateway_poll_requests", "Modbus requests issued per device poll",
+                                         ("device",), buckets=(1, 2, 4, 8, 16, 32, 64))
+        self.poll_errors = m.counter("gateway_poll_errors_total", "Failed device polls by cause", ("device", "kind"))
+        self.writes_total = m.counter("gateway_writes_total", "FC16 write-through requests sent to devices",
+                                      ("device", "result"))
+        m.gauge("gateway_write_queue_registers", "Registers waiting to be written to the device",
+                lambda: {(name,): n for name, n in self.write_stats().items()}, ("device",))
+        sched = lambda key: lambda: {(name,): s[key] for name, s in self.scheduler_stats().items()
+                                     if s[key] is not None}
+        m.gauge("gateway_poll_last_duration_seconds", "Duration of the device's last poll cycle",
+                sched("last_duration"), ("device",))
+        m.gauge("gateway_poll_overruns_total", "Poll deadlines missed because the previous poll overran",
+                sched("missed"), ("device",), kind="counter")
+        m.gauge("gateway_poll_max_lag_seconds", "Worst delay between a poll's deadline and its start",
+                sched("max_lag"), ("device",))
+        rtt = lambda key: lambda: {(name,): s[key] / 1000 for name, s in self.rtt_stats().items()
+                                   if s[key] is not None}
+        m.gauge("gateway_device_rtt_seconds", "Smoothed request round-trip time", rtt("srtt_ms"), ("device",))
+        m.gauge("gateway_device_timeout_seconds", "Current adaptive request timeout", rtt("timeout_ms"), ("device",))
+        pool = lambda key: lambda: {(ep,): int(s[key]) for ep, s in self.pool_stats().items()}
+        m.gauge("gateway_pool_connected", "Whether the pooled connection is up", pool("connected"), ("endpoint",))
+        m.gauge("gateway_pool_inflight", "Requests awaiting a response", pool("inflight"), ("endpoint",))
+        m.gauge("gateway_pool_failures", "Consecutive connection failures", pool("failures"), ("endpoint",))
+        m.gauge("gateway_pool_connects_total", "Connections opened", pool("connects"), ("endpoint",), kind="counter")
+        m.gauge("gateway_pool_requests_total", "Requests sent", pool("requests"), ("endpoint",), kind="counter")
+        hub = lambda key: lambda: {(): self.hub.stats()[key]}
+        m.gauge("gateway_ws_clients", "Connected WebSocket clients", hub("clients"))
+        m.gauge("gateway_ws_queue_depth", "Messages waiting in WebSocket send queues", hub("queued"))
+        m.gauge("gateway_ws_dropped_total", "WebSocket backlogs dropped for slow consumers", hub("dropped"),
+                kind="counter")
+        if self.exporter:
+            export = lambda key: lambda: {(): self.exporter.stats()[key]}
+            m.gauge("gateway_export_batches_total", "Batches acknowledged by the export sink", export("sent"),
+                    kind="counter")
+            m.gauge("gateway_export_failures_total", "Export batches the sink failed to take", export("failed"),
+                    kind="counter")
+            m.gauge("gateway_export_bytes_total", "Export payload bytes acknowledged", export("bytes_sent"),
+                    kind="counter")
+            m.gauge("gateway_export_spooled_batches", "Export batches waiting on disk", export("spooled"))
+        image = lambda key: lambda: {(): getattr(self.image, key)}
+        m.gauge("gateway_server_reads_total", "Port 502 read requests", image("reads"), kind="counter")
+        m.gauge("gateway_server_registers_read_total", "Registers served on port 502", image("registers_read"),
+                kind="counter")
+        m.gauge("gateway_server_writes_total", "Port 502 write requests", image("writes"), kind="counter")
+        m.gauge("gateway_server_registers_written_total", "Registers written on port 502",
+                image("registers_written"), kind="counter")
+
+    def device_buffer(self, dev, size):
+        """Per-device staging buffer, reused every cycle and committed to the image in one step"""
+        buf = self.buffers.get(dev.name)
+        if buf is None or len(buf) != size:
+            buf = self.buffers[dev.name] = array("H", self.image.regs[dev.offset:dev.offset + size])
+        return buf
+
+    def filter_for(self, dev):
+        cached = self.filters.get(dev.name)
+        if cached is None or cached[0] is not dev:
+            # Device edited: rebuild its deadbands but keep what was already reported
+            cached = self.filters[dev.name] = (dev, ChangeFilter.for_device(dev, cached[1] if cached else None))
+        return cached[1]
+
+    def derived_for(self, dev):
+        cached = self.derived.get(dev.name)
+        if cached is None or cached[0] is not dev:
+            specs = dev.get_derived()
+            cached = self.derived[dev.name] = (dev, DerivedEngine(specs, cached[1] if cached else None)
+                                               if specs else None)
+        return cached[1]
 
-    def decode_float32(self, regs):
-        if len(regs) < 2: return None
-        return struct.unpack(">f", struct.pack(">HH", regs[0], regs[1]))[0]
+    def track(self, dev, values):
+        """Adds the device's derived signals to freshly polled `values` and returns what to report"""
+        with tracer.span("report"):
+            now = time.time()
+            engine = self.derived_for(dev)
+            if engine is not None:
+                values.update(engine.update(values, now))
+            return self.filter_for(dev).update(values, now)
 
-    def write_float32(self, offset, val):
-        hi, lo = struct.unpack(">HH", struct.pack(">f", float(val)))
-        self.context[0x03].setValues(3, offset, [hi, lo])
+    def pack_derived(self, dev, buf, changed):
+        for name, rel in dev.derived_registers():
+            if name in changed:
+                buf[rel], buf[rel + 1] = HH.unpack(F32.pack(changed[name]))
+
+    def commit_registers(self, dev, registers, signals, changed):
+        """Commits the raw registers of the `signals` in `changed`, plus derived float32 registers.
+
+        Signals held back by the deadband keep their last reported value in the image too.
+        """
+        if dev._retired:
+            return  # its range may already be cleared or handed to another device
+        with tracer.span("commit"):
+            buf = self.device_buffer(dev, dev.register_count())
+            for rel, name in enumerate(signals):
+                if name in changed:
+                    buf[rel] = registers[rel]
+            self.pack_derived(dev, buf, changed)
+            self.image.commit(dev.offset, buf)
+
+    def rtt_for(self, dev):
+        est = self.rtt.get(dev.name)
+        if est is None:
+            est = self.rtt[dev.name] = RttEstimator()
+        return est
+
+    async def request(self, dev, method, *args):
+        """One Modbus request to `dev`, under its adaptive timeout unless RTT_ADAPTIVE is off"""
+        with tracer.span(method.__name__, address=args[0]):
+            if not config.RTT_ADAPTIVE:
+                return await method(*args, slave=dev.slave_id)
+            return await self.rtt_for(dev).call(method, *args, slave=dev.slave_id)
 
     async def poll_pm(self, dev):
-        try:
-            client = AsyncModbusTcpClient(dev.ip, port=dev.port, timeout=5, retries=1)
-            await client.connect()
-            
-            pm_params = dev.get_pm_params()
-            data = {}
-            for name, addr, rel in pm_params:
-                rr = await client.read_holding_registers(addr, 2, slave=dev.slave_id)
-                if not rr.isError():
-                    val = self.decode_float32(rr.registers)
-                    if val:
-                        self.write_float32(dev.offset + rel, val)
-                        data[name] = round(val, 2)
-            
-            self.device_data[dev.name] = {"values": data, "timestamp": time.time(), "status": "online"}
-            client.close()
-        except Exception as e:
-            self.device_data[dev.name] = {"error": str(e), "timestamp": time.time(), "status": "offline"}
-            logger.error(f"PM {dev.name} error: {e}")
+        async with self.pool.connection(dev.ip, dev.port, dev.pipeline_window) as client:
+            decoded = []
+            error = None
+            reads = 0
+            for block in dev.get_read_plan():
+                reads += 1
+                rr = await self.request(dev, client.read_holding_registers, block.start, block.count)
+                if rr.isError():
+                    error = rr
+                    if len(block.params) == 1:
+                        continue
+                    # The gap may span registers the meter refuses to serve; read members one by one
+                    logger.warning(f"PM {dev.name} block read at {block.start} failed, falling back: {rr}")
+                    for single in block.split():
+                        reads += 1
+                        rr = await self.request(dev, client.read_holding_registers, single.start, single.count)
+                        if not rr.isError():
+                            decoded.extend(single.decode(rr.registers))
+                    continue
+                with tracer.span("decode", address=block.start):
+                    decoded.extend(block.decode(rr.registers))
+            self.poll_requests.observe(reads, dev.name)
+            if not decoded and error is not None:
+                raise Exception(f"Read error: {error}")
+            values = {name: round(val, 2) if isinstance(val, float) else val for name, _, val in decoded}
+            changed = self.track(dev, values)
+            if changed and not dev._retired:
+                # The image always republishes values as big-endian float32, whatever the source type.
+                # Only changed values are rewritten; the rest keep their last reported value.
+                with tracer.span("commit"):
+                    buf = self.device_buffer(dev, dev.register_count())
+                    for name, rel, val in decoded:
+                        if name in changed:
+                            buf[rel], buf[rel + 1] = HH.unpack(F32.pack(val))
+                    self.pack_derived(dev, buf, changed)
+                    self.image.commit(dev.offset, buf)
+            return changed
 
     async def poll_scale(self, dev):
-        try:
-            client = AsyncModbusTcpClient(dev.ip, port=dev.port, timeout=5, retries=1)
-            await client.connect()
-            
-            rr = await client.read_holding_registers(1, 1, slave=dev.slave_id)
-            if not rr.isError():
-                self.context[0x03].setValues(3, dev.offset, rr.registers)
-                self.device_data[dev.name] = {"values": {"weight": rr.registers[0]},
-                                              "timestamp": time.time(), "status": "online"}
-            else:
+        async with self.pool.connection(dev.ip, dev.port, dev.pipeline_window) as client:
+            rr = await self.request(dev, client.read_holding_registers, 1, 1)
+            self.poll_requests.observe(1, dev.name)
+            if rr.isError():
                 raise Exception(f"Read error: {rr}")
-            client.close()
-        except Exception as e:
-            self.device_data[dev.name] = {"error": str(e), "timestamp": time.time(), "status": "offline"}
-            logger.error(f"Scale {dev.name} error: {e}")
+            changed = self.track(dev, {"weight": rr.registers[0]})
+            if changed:
+                self.commit_registers(dev, rr.registers, SCALE_SIGNALS, changed)
+            return changed
 
     async def poll_oee(self, dev):
+        async with self.pool.connection(dev.ip, dev.port, dev.pipeline_window) as client:
+            rr = await self.request(dev, client.read_holding_registers, 1, 4)
+            self.poll_requests.observe(1, dev.name)
+            if rr.isError():
+                raise Exception(f"Read error: {rr}")
+            changed = self.track(dev, {
+                "available_status": "Start" if rr.registers[0] == 1 else "Stop",
+                "meters_hsc": rr.registers[1],
+                "new_output_flag": rr.registers[2],
+                "start_of_production": rr.registers[3]
+            })
+            if changed:
+                self.commit_registers(dev, rr.registers, OEE_SIGNALS, changed)
+            return changed
+
+    def scheduler_stats(self):
+        return self.shards.scheduler_stats() if self.shards else self.scheduler.stats()
+
+    def pool_stats(self):
+        return self.shards.pool_stats() if self.shards else self.pool.stats()
+
+    def rtt_stats(self):
+        if self.shards:
+            return self.shards.rtt_stats()
+        return {name: est.stats() for name, est in self.rtt.items()}
+
+    def write_stats(self):
+        return self.shards.write_stats() if self.shards else self.writer.stats()
+
+    def health_for(self, dev):
+        health = self.health.get(dev.name)
+        if health is None:
+            health = self.health[dev.name] = DeviceHealth(dev.name)
+        return health
+
+    def hold_device(self, dev):
+        return self.health_for(dev).hold()
+
+    def publish(self, name, entry, report=None):
+        """Stores a device's latest poll result and hands `report` to every downstream listener.
+
+        `report` defaults to the whole entry; an empty one means nothing changed.
+        """
+        self.device_data[name] = entry
+        self.data_snapshot.touch()
+        if report is None:
+            report = entry
+        if not report:
+            return
+        for listener in self.listeners:
+            try:
+                listener(name, report)
+            except Exception as e:
+                logger.error(f"Listener error for {name}: {e}")
+
+    async def poll_device(self, dev):
+        health = self.health_for(dev)
+        start = time.perf_counter()
         try:
-            client = AsyncModbusTcpClient(dev.ip, port=dev.port, timeout=5, retries=1)
-            await client.connect()
-            
-            rr = await client.read_holding_registers(1, 4, slave=dev.slave_id)
-            if not rr.isError():
-                self.context[0x03].setValues(3, dev.offset, rr.registers)
-                status = "Start" if rr.registers[0] == 1 else "Stop"
-                self.device_data[dev.name] = {"values": {
-                    "available_status": status,
-                    "meters_hsc": rr.registers[1],
-                    "new_output_flag": rr.registers[2],
-                    "start_of_production": rr.registers[3]
-                }, "timestamp": time.time(), "status": "online"}
+            if dev.type == "pm":
+                changed = await self.poll_pm(dev)
+            elif dev.type == "scale":
+                changed = await self.poll_scale(dev)
             else:
-                raise Exception(f"Read error: {rr}")
-            client.close()
+                changed = await self.poll_oee(dev)
+            health.success()
+            self.poll_latency.observe(time.perf_counter() - start, dev.name)
+            if dev._retired:
+                return  # reconfigured while this poll was running
+            entry = {"values": self.filter_for(dev).values, "timestamp": time.time(), "status": health.state}
+            previous = self.device_data.get(dev.name)
+            report = {}
+            if changed or not previous or "error" in previous or previous.get("status") != health.state:
+                report = {"values": changed, "timestamp": entry["timestamp"], "status": health.state}
+            with tracer.span("publish", signals=len(report.get("values", ()))):
+                self.publish(dev.name, entry, report)
         except Exception as e:
-            self.device_data[dev.name] = {"error": str(e), "timestamp": time.time(), "status": "offline"}
-            logger.error(f"OEE {dev.name} error: {e}")
+            health.failure()
+            self.poll_latency.observe(time.perf_counter() - start, dev.name)
+            self.poll_errors.inc(dev.name, error_kind(e))
+            if dev._retired:
+                return
+            entry = {"error": str(e), "timestamp": time.time(), "status": health.state}
+            previous = self.device_data.get(dev.name)
+            if health.state == DEGRADED and previous and "values" in previous:
+                entry["values"] = previous["values"]  # keep last good values through a transient fault
+            elif health.state == OFFLINE:
+                entry["retry_in"] = round(health.retry_in(), 1)
+            self.publish(dev.name, entry)
+            logger.error(f"{dev.type.upper()} {dev.name} error: {e}")
 
     async def poll_all(self):
         while self.running:
             try:
-                tasks = []
-                for d in self.devices:
-                    if d.type == "pm":
-                        tasks.append(self.poll_pm(d))
-                    elif d.type == "scale":
-                        tasks.append(self.poll_scale(d))
-                    else:
-                        tasks.append(self.poll_oee(d))
-                await asyncio.gather(*tasks, return_exceptions=True)
-                await asyncio.sleep(1.0)
+                await self.scheduler.run(self.schedulable, lambda: self.running)
             except Exception as e:
                 logger.error(f"Polling error: {e}")
                 await asyncio.sleep(5)
 
+    async def warm_connect(self, wait=config.STARTUP_CONNECT_WAIT_SEC):
+        """Connects to every endpoint ahead of the first poll, waiting at most `wait` seconds.
+
+        Returns the number connected, or None when connects are still running; they
+        carry on in the background and the first polls share them.
+        """
+        endpoints = {(dev.ip, dev.port): dev.pipeline_window for dev in self.devices}
+        task = asyncio.create_task(self.pool.warm([(ip, port, window) for (ip, port), window in endpoints.items()]))
+        done, _ = await asyncio.wait([task], timeout=wait)
+        return task.result() if done else None
+
+    async def listen(self, address=("0.0.0.0", 502)):
+        """Opens the Modbus TCP server; SCADA reads are answered from the image from here on"""
+        self.server = ModbusTcpServer(context=self.context, address=address)
+        if not await self.server.transport_listen():
+            self.server = None
+            raise OSError(f"Unable to listen on {address[0]}:{address[1]}")
+        logger.info(f"Modbus server listening on {address[0]}:{address[1]}")
+
+    def start_polling(self):
+        self.running = True
+        if tracer.always:
+            tracer.enable()
+        if self.historian:
+            self.historian.start()
+        if self.exporter:
+            self.exporter.start()
+        if self.shards:
+            self.shards.start(self)
+        else:
+            asyncio.create_task(self.poll_all())
+            asyncio.create_task(self.pool.health_loop())
+
     async def start_server(self):
         try:
-            self.running = True
-            asyncio.create_task(self.poll_all())
-            await StartAsyncTcpServer(context=self.context, address=("0.0.0.0", 502))
+            if self.server is None:
+                await self.listen()
+            if not self.running:
+                self.start_polling()
+            await self.server.serving
         except Exception as e:
             logger.error(f"Server start error: {e}")
             raise
@@ -0,0 +1,59 @@
+import time
+import logging
+from app.core import config
+
+logger = logging.getLogger(__name__)
+
+ONLINE = "online"
+DEGRADED = "degraded"
+OFFLINE = "offline"
+PROBING = "probing"
+
+class DeviceHealth:
+    """Circuit breaker for one device: online -> degraded -> offline -> probing -> online/offline.
+
+    A device goes offline after `threshold` consecutive failures and is then only
+    probed once per backoff period, which doubles after every failed probe.
+    """
+
+    def __init__(self, name, threshold=config.HEALTH_FAIL_THRESHOLD,
+                 backoff_min=config.HEALTH_BACKOFF_MIN_SEC, backoff_max=config.HEALTH_BACKOFF_MAX_SEC):
+        self.name = name
+        self.threshold = threshold
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.state = PROBING
+        self.failures = 0
+        self.backoff = 0.0
+        self.retry_at = 0.0
+
+    def success(self):
+        if self.state != ONLINE:
+            logger.info(f"Device {self.name} {self.state} -> online")
+        self.state = ONLINE
+        self.failures = 0
+        self.backoff = 0.0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == PROBING or self.failures >= self.threshold:
+            self.backoff = min(self.backoff_max, self.backoff * 2 if self.backoff else self.backoff_min)
+            self.retry_at = time.monotonic() + self.backoff
+            if self.state != OFFLINE:
+                logger.warning(f"Device {self.name} {self.state} -> offline, probing every {self.backoff:.0f}s")
+            self.state = OFFLINE
+        else:
+            self.state = DEGRADED
+
+    def hold(self):
+        """Seconds the device must still be left alone; switches to probing once the backoff ran out"""
+        if self.state != OFFLINE:
+            return 0.0
+        remaining = self.retry_at - time.monotonic()
+        if remaining > 0:
+            return remaining
+        self.state = PROBING
+        return 0.0
+
+    def retry_in(self):
+        return max(0.0, self.retry_at - time.monotonic()) if self.state == OFFLINE else 0.0
@@ -0,0 +1,189 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import logging
+from app.core import config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signals (
+    id INTEGER PRIMARY KEY,
+    device TEXT NOT NULL,
+    signal TEXT NOT NULL,
+    UNIQUE (device, signal)
+);
+CREATE TABLE IF NOT EXISTS samples (
+    signal_id INTEGER NOT NULL,
+    t REAL NOT NULL,
+    v REAL NOT NULL,
+    PRIMARY KEY (signal_id, t)
+) WITHOUT ROWID;
+"""
+
+class Historian:
+    """Durable sample store: SQLite in WAL mode, written in batches off the event loop.
+
+    `record` only enqueues, so polling never waits on disk. A single writer task drains
+    the queue into transactions of up to `batch_size` samples, each committed in a
+    worker thread. When the queue is full new entries are dropped and counted. On stop
+    the writer finishes the batch it holds, then whatever is still queued is written.
+    """
+
+    def __init__(self, path=config.HISTORIAN_PATH, batch_size=config.HISTORIAN_BATCH_SIZE,
+                 flush_interval=config.HISTORIAN_FLUSH_SEC, retention_days=config.HISTORIAN_RETENTION_DAYS,
+                 queue_size=config.HISTORIAN_QUEUE_SIZE, stop_timeout=10.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention_days * 86400
+        self.stop_timeout = stop_timeout
+        self.queue = asyncio.Queue(queue_size)
+        self.signal_ids = {}
+        self.written = 0
+        self.dropped = 0
+        self.last_batch_sec = 0.0
+        self.busy_sec = 0.0
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._task = None
+        self._stopping = None
+
+    def open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self.signal_ids = {(d, s): i for i, d, s in self._db.execute("SELECT id, device, signal FROM signals")}
+        logger.info(f"Historian open at {self.path} with {len(self.signal_ids)} signals")
+
+    def start(self):
+        if self._task is None:
+            self.open()
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        # Not cancelled: the writer must not lose the batch it already took off the queue
+        self._stopping.set()
+        done, _ = await asyncio.wait({task}, timeout=self.stop_timeout)
+        if not done:
+            logger.warning(f"Historian writer did not finish within {self.stop_timeout}s")
+            task.cancel()
+        batch = []
+        while not self.queue.empty():
+            batch.extend(self.queue.get_nowait())
+        if batch:
+            await asyncio.to_thread(self._write, batch)
+        with self._db_lock:
+            self._db.close()
+            self._db = None
+
+    def record(self, name, entry):
+        values = entry.get("values")
+        if not values or "error" in entry:
+            return
+        t = entry.get("timestamp") or time.time()
+        rows = [(name, signal, t, val) for signal, val in values.items()
+                if isinstance(val, (int, float)) and not isinstance(val, bool)]
+        if not rows:
+            return
+        try:
+            self.queue.put_nowait(rows)
+        except asyncio.QueueFull:
+            self.dropped += len(rows)
+
+    async def _next(self, timeout=None):
+        """Next queued rows, or None after `timeout` seconds or once stopping"""
+        if not self.queue.empty():
+            return self.queue.get_nowait()
+        getter = asyncio.ensure_future(self.queue.get())
+        stopping = asyncio.ensure_future(self._stopping.wait())
+        await asyncio.wait({getter, stopping}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        if getter.done():
+            return getter.result()
+        getter.cancel()  # an item it was woken for stays queued
+        return None
+
+    async def _writer(self):
+        next_compact = time.monotonic() + 60
+        while not self._stopping.is_set():
+            rows = await self._next()
+            if rows is None:
+                break
+            batch = list(rows)
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                rows = await self._next(timeout) if timeout > 0 else None
+                if rows is None:
+                    break
+                batch.extend(rows)
+            try:
+                await asyncio.to_thread(self._write, batch)
+                if time.monotonic() >= next_compact:
+                    await asyncio.to_thread(self.compact)
+                    next_compact = time.monotonic() + 3600
+            except Exception as e:
+                logger.error(f"Historian write error: {e}")
+
+    def _signal_id(self, device, signal):
+        key = (device, signal)
+        sid = self.signal_ids.get(key)
+        if sid is None:
+            # The cache is loaded from the table on open and only the writer inserts, so this is new
+            sid = self.signal_ids[key] = self._db.execute(
+                "INSERT INTO signals (device, signal) VALUES (?, ?)", key).lastrowid
+        return sid
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        with self._db_lock:
+            try:
+                with self._db:
+                    self._db.executemany("INSERT OR REPLACE INTO samples (signal_id, t, v) VALUES (?, ?, ?)",
+                                         [(self._signal_id(d, s), t, v) for d, s, t, v in batch])
+            except Exception:
+                # Signal ids cached during the rolled-back transaction no longer exist
+                self.signal_ids = {(d, s): i for i, d, s in self._db.execute("SELECT id, device, signal FROM signals")}
+                raise
+        self.written += len(batch)
+        self.last_batch_sec = time.perf_counter() - start
+        self.busy_sec += self.last_batch_sec
+
+    def compact(self):
+        """Deletes samples past retention and returns their pages to the OS"""
+        cutoff = time.time() - self.retention
+        with self._db_lock:
+            with self._db:
+                deleted = self._db.execute("DELETE FROM samples WHERE t < ?", (cutoff,)).rowcount
+            self._db.execute("PRAGMA incremental_vacuum")
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if deleted:
+            logger.info(f"Historian removed {deleted} samples older than {self.retention / 86400:g} days")
+
+    def query(self, device, signal, start, end, points):
+        """Reads a range through its own connection, bucketed into at most `points` slices"""
+        width = (end - start) / points if end > start else 1.0
+        db = sqlite3.connect(self.path)
+        try:
+            rows = db.execute(
+                "SELECT MIN(CAST((s.t - ?) / ? AS INTEGER), ?) AS b, MIN(s.v), MAX(s.v), AVG(s.v), COUNT(*) "
+                "FROM samples s JOIN signals g ON g.id = s.signal_id "
+                "WHERE g.device = ? AND g.signal = ? AND s.t BETWEEN ? AND ? GROUP BY b ORDER BY b",
+                (start, width, points - 1, device, signal, start, end)).fetchall()
+        finally:
+            db.close()
+        return {"t": [start + b * width for b, *_ in rows], "min": [r[1] for r in rows],
+                "max": [r[2] for r in rows], "avg": [r[3] for r in rows], "count": [r[4] for r in rows]}
+
+    def stats(self):
+        return {"path": self.path, "signals": len(self.signal_ids), "written": self.written,
+                "dropped": self.dropped, "queued": self.queue.qsize(), "last_batch_sec": self.last_batch_sec,
+                "busy_sec": self.busy_sec}
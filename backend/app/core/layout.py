@@ -0,0 +1,53 @@
+from app.core.planner import MAX_READ_REGISTERS, plan_reads
+
+TYPE_ORDER = ("pm", "oee", "scale")
+
+def layout_stats(devices, block=MAX_READ_REGISTERS):
+    """How expensive a layout is for an upstream SCADA reading the image in `block`-register requests"""
+    ranges = sorted((dev.offset, dev.register_count()) for dev in devices)
+    used = sum(count for _, count in ranges)
+    end = max((start + count for start, count in ranges), default=0)
+    straddling = sum(1 for start, count in ranges
+                     if count <= block and start // block != (start + count - 1) // block)
+    # Reads a SCADA needs when every device comes back whole in a single request
+    reads = plan_reads([(i, start, 0, count) for i, (start, count) in enumerate(ranges)],
+                       max_gap=block, max_count=block)
+    return {"devices": len(ranges), "registers": used, "span": end, "holes": end - used,
+            "straddling": straddling, "scada_reads": len(reads)}
+
+def plan_layout(devices, block=MAX_READ_REGISTERS, group_by_type=False, base=0):
+    """Returns [(device, new offset)] packing the devices from `base` without holes.
+
+    Devices keep their current order (by offset), or are grouped pm, oee, scale with
+    each group starting on a block boundary. A device that fits in one block never
+    straddles a boundary: it starts the next block instead. `block=0` packs tightly.
+    """
+    order = sorted(devices, key=lambda dev: dev.offset)
+    if group_by_type:
+        order.sort(key=lambda dev: TYPE_ORDER.index(dev.type))
+    plan = []
+    cursor = base
+    group = None
+    for dev in order:
+        count = dev.register_count()
+        if block:
+            if group_by_type and dev.type != group and plan:
+                cursor = _align(cursor, block)
+            elif cursor % block + count > block and count <= block:
+                cursor = _align(cursor, block)
+        group = dev.type
+        plan.append((dev, cursor))
+        cursor += count
+    return plan
+
+def _align(offset, block):
+    return -(-offset // block) * block
+
+def mapping_report(plan):
+    """Old and new image address of every signal, for updating SCADA tag databases"""
+    rows = []
+    for dev, offset in plan:
+        for signal, rel, data_type in dev.image_signals():
+            rows.append({"device": dev.name, "type": dev.type, "signal": signal, "data_type": data_type,
+                         "old_offset": dev.offset + rel, "new_offset": offset + rel})
+    return rows
@@ -0,0 +1,98 @@
+from bisect import bisect_left
+
+# Recording happens on the event loop thread only, so plain int/float updates need no locks.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+def _escape(val):
+    return str(val).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, val in self.values.items():
+            yield self.name, _labels(self.labels, labels), val
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in self.series.items():
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                total += count
+                yield f"{self.name}_bucket", _labels(self.labels + ("le",), labels + (bound,)), total
+            yield f"{self.name}_sum", _labels(self.labels, labels), series[-1]
+            yield f"{self.name}_count", _labels(self.labels, labels), total
+
+class Gauge:
+    """Read at scrape time from a callback returning {labels tuple: value}"""
+    kind = "gauge"
+
+    def __init__(self, name, doc, collect, labels=(), kind="gauge"):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self):
+        for labels, val in self.collect().items():
+            yield self.name, _labels(self.labels, labels), val
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, doc, labels=()):
+        return self.register(Counter(name, doc, labels))
+
+    def histogram(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, doc, labels, buckets))
+
+    def gauge(self, name, doc, collect, labels=(), kind="gauge"):
+        return self.register(Gauge(name, doc, collect, labels, kind))
+
+    def render(self):
+        """Prometheus text exposition format 0.0.4"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.doc}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, val in metric.samples():
+                lines.append(f"{name}{labels} {val}")
+        return "\n".join(lines) + "\n"
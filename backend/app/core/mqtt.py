@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PINGREQ, PINGRESP, DISCONNECT = 1, 2, 3, 4, 12, 13, 14
+
+def _string(text):
+    data = text.encode()
+    return struct.pack(">H", len(data)) + data
+
+def _packet(kind, flags, body):
+    header = bytearray([kind << 4 | flags])
+    length = len(body)
+    while True:
+        byte, length = length % 128, length // 128
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(header) + body
+
+class MqttClient:
+    """Minimal MQTT 3.1.1 publisher: QoS 1 only, with up to `window` messages awaiting PUBACK.
+
+    Enough to push batches to a broker without a client library. Subscriptions,
+    QoS 2 and retained messages are not supported.
+    """
+
+    def __init__(self, host, port=1883, client_id="modbus-gateway", username=None, password=None,
+                 keepalive=30, timeout=10, window=4):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(window)
+        self._ids = itertools.cycle(range(1, 0x10000))
+        self._pending = {}
+        self._reader = None
+        self._writer = None
+        self._tasks = []
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        flags = 0x02  # clean session
+        payload = _string(self.client_id)
+        if self.username is not None:
+            flags |= 0x80
+            payload += _string(self.username)
+            if self.password is not None:
+                flags |= 0x40
+                payload += _string(self.password)
+        self._writer.write(_packet(CONNECT, 0, _string("MQTT") + bytes([4, flags]) +
+                                   struct.pack(">H", self.keepalive) + payload))
+        kind, body = await asyncio.wait_for(self._read_packet(), self.timeout)
+        if kind != CONNACK or len(body) < 2 or body[1] != 0:
+            self.close()
+            raise ConnectionError(f"MQTT broker {self.host}:{self.port} refused connection: {body.hex()}")
+        self._tasks = [asyncio.create_task(self._read_loop()), asyncio.create_task(self._ping_loop())]
+
+    async def publish(self, topic, payload):
+        """Sends one QoS 1 message and returns once the broker acknowledged it"""
+        async with self._slots:
+            if not self.connected:
+                raise ConnectionError(f"MQTT broker {self.host}:{self.port} not connected")
+            pid = next(self._ids)
+            fut = asyncio.get_running_loop().create_future()
+            self._pending[pid] = fut
+            self._writer.write(_packet(PUBLISH, 0x02, _string(topic) + struct.pack(">H", pid) + payload))
+            try:
+                await asyncio.wait_for(fut, self.timeout)
+            finally:
+                self._pending.pop(pid, None)
+
+    async def _read_packet(self):
+        first = (await self._reader.readexactly(1))[0]
+        length, shift = 0, 0
+        while True:
+            byte = (await self._reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        return first >> 4, await self._reader.readexactly(length)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                kind, body = await self._read_packet()
+                if kind == PUBACK:
+                    fut = self._pending.get(struct.unpack(">H", body[:2])[0])
+                    if fut is not None and not fut.done():
+                        fut.set_result(None)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            logger.warning(f"MQTT connection to {self.host}:{self.port} lost: {e}")
+        finally:
+            self.close()
+
+    async def _ping_loop(self):
+        while self.connected:
+            await asyncio.sleep(self.keepalive / 2)
+            if self.connected:
+                self._writer.write(_packet(PINGREQ, 0, b""))
+
+    def close(self):
+        current = asyncio.current_task()
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()
+        self._tasks = []
+        if self._writer is not None:
+            if not self._writer.is_closing():
+                self._writer.write(_packet(DISCONNECT, 0, b""))
+            self._writer.close()
+            self._writer = None
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError("MQTT connection closed"))
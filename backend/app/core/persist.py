@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import os
+from app.models.device import Device
+from app.core.registry import validate_devices
+from app.core import config
+
+logger = logging.getLogger(__name__)
+
+RETRY_SEC = 5.0
+
+def parse_devices(text, image_size=config.UNIFIED_REG_COUNT):
+    """Devices from a configuration file's text; raises ValueError unless it is a valid device list"""
+    data = json.loads(text)
+    if not isinstance(data, list):
+        raise ValueError("not a list")
+    try:
+        devices = [Device(**d) for d in data]
+    except TypeError as e:
+        raise ValueError(e)
+    errors = validate_devices(devices, image_size)
+    if errors:
+        raise ValueError("; ".join(errors))
+    return devices
+
+class DeviceStore:
+    """Persists the device list to a JSON file without blocking the event loop.
+
+    `save` only marks the configuration dirty. A writer task waits `delay` seconds,
+    so a burst of edits becomes one write of the latest list, then serializes and
+    writes it in a worker thread: temp file, fsync, rename. The previous file is kept
+    as `<name>.1` ... `<name>.<backups>`, newest first, and `load` falls back to the
+    newest valid one when the file itself is missing, corrupt or fails validation.
+    """
+
+    def __init__(self, path, devices, on_saved=None, delay=config.CONFIG_SAVE_DELAY_SEC,
+                 backups=config.CONFIG_BACKUPS):
+        self.path = path
+        self.devices = devices  # callable returning the device list to save
+        self.on_saved = on_saved
+        self.delay = delay
+        self.backups = backups
+        self.dirty = False
+        self.saves = 0
+        self._task = None
+        self._now = asyncio.Event()
+
+    def backup(self, n):
+        return self.path.with_name(f"{self.path.name}.{n}")
+
+    def load(self):
+        """Devices from the file, or from the newest valid backup; None when there is none"""
+        for path in [self.path] + [self.backup(n) for n in range(1, self.backups + 1)]:
+            try:
+                devices = parse_devices(path.read_text())
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                logger.error(f"Invalid device configuration {path}: {e}")
+                continue
+            if path != self.path:
+                logger.warning(f"Loaded device configuration from backup {path}")
+            return devices
+        return None
+
+    def save(self):
+        self.dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self):
+        """Writes pending changes now, e.g. at shutdown"""
+        if not self.dirty and (self._task is None or self._task.done()):
+            return
+        self._now.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        await self._task
+        self._now.clear()
+
+    async def _run(self):
+        while self.dirty:
+            try:
+                await asyncio.wait_for(self._now.wait(), self.delay)
+            except asyncio.TimeoutError:
+                pass
+            if not await self._write():
+                if self._now.is_set():
+                    return
+                await asyncio.sleep(RETRY_SEC)
+
+    async def _write(self):
+        # Dumped on the loop so the list cannot change underneath; the JSON encoding and I/O run in a thread
+        self.dirty = False
+        data = [d.model_dump(exclude={"status", "last_error"}) for d in self.devices()]
+        try:
+            await asyncio.to_thread(self._write_file, data)
+        except Exception as e:
+            self.dirty = True
+            logger.error(f"Error saving devices to {self.path}: {e}")
+            return False
+        self.saves += 1
+        if self.on_saved:
+            self.on_saved(self.path)
+        logger.info(f"Saved {len(data)} devices")
+        return True
+
+    def _write_file(self, data):
+        text = json.dumps(data, indent=2)
+        self._rotate()
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        if os.name != "nt":
+            # Make the rename itself durable; Windows cannot open a directory for fsync
+            fd = os.open(self.path.parent, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _rotate(self):
+        """Shifts the backups by one and copies the current file to `.1`, unless it is invalid"""
+        if not self.backups or not self.path.exists():
+            return
+        try:
+            current = self.path.read_bytes()
+            parse_devices(current)
+        except (OSError, ValueError):
+            return  # keep the good backups rather than a corrupt file
+        for n in range(self.backups - 1, 0, -1):
+            if self.backup(n).exists():
+                os.replace(self.backup(n), self.backup(n + 1))
+        tmp = self.backup(1).with_name(self.backup(1).name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(current)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.backup(1))
@@ -0,0 +1,133 @@
+import asyncio
+import struct
+import logging
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+
+logger = logging.getLogger(__name__)
+
+MBAP = struct.Struct(">HHHB")
+
+class PipelineResponse:
+    """Mirrors the parts of pymodbus' register responses the gateway uses"""
+    __slots__ = ("function_code", "registers", "exception_code", "slave_id", "transaction_id")
+
+    def __init__(self, function_code, registers=(), exception_code=0, slave_id=0, transaction_id=0):
+        self.function_code = function_code
+        self.registers = registers
+        self.exception_code = exception_code
+        self.slave_id = slave_id
+        self.transaction_id = transaction_id
+
+    def isError(self):
+        return self.function_code > 0x80
+
+    def __str__(self):
+        if self.isError():
+            return f"Exception Response({self.function_code}, {self.function_code & 0x7F}, {self.exception_code})"
+        return f"Response(fc={self.function_code}, slave={self.slave_id}, count={len(self.registers)})"
+
+class PipelinedClient:
+    """Modbus TCP client that keeps up to `window` transactions in flight on one socket.
+
+    pymodbus 3.6 decodes one frame per socket read, so responses that arrive coalesced
+    stall until the next read. This client frames the stream itself and matches every
+    response to its request by transaction ID, in whatever order the server answers.
+    """
+
+    def __init__(self, host, port=502, timeout=5, retries=1, window=4):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.window = window
+        self._slots = asyncio.Semaphore(window)
+        self._pending = {}
+        self._tid = 0
+        self._reader = None
+        self._writer = None
+        self._task = None
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.warning(f"Failed to connect {self.host}:{self.port}: {e}")
+            return False
+        self._task = asyncio.create_task(self._read_loop())
+        return True
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending(ConnectionException("Connection closed"))
+
+    async def read_holding_registers(self, address, count=1, slave=1):
+        return await self.execute(slave, struct.pack(">BHH", 3, address, count))
+
+    async def write_registers(self, address, values, slave=1):
+        return await self.execute(slave, struct.pack(f">BHHB{len(values)}H", 16, address, len(values),
+                                                     2 * len(values), *values))
+
+    async def execute(self, slave, pdu):
+        async with self._slots:
+            for attempt in range(self.retries + 1):
+                if not self.connected:
+                    raise ConnectionException(f"{self.host}:{self.port} not connected")
+                tid = self._next_tid()
+                fut = asyncio.get_running_loop().create_future()
+                self._pending[tid] = fut
+                self._writer.write(MBAP.pack(tid, 0, len(pdu) + 1, slave) + pdu)
+                try:
+                    # A late answer to a timed-out TID is simply dropped, the socket stays usable
+                    return await asyncio.wait_for(fut, self.timeout)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._pending.pop(tid, None)
+            raise ModbusIOException(f"No response from {self.host}:{self.port} slave {slave} "
+                                    f"after {self.retries} retries")
+
+    def _next_tid(self):
+        while True:
+            self._tid = self._tid % 0xFFFF + 1
+            if self._tid not in self._pending:
+                return self._tid
+
+    async def _read_loop(self):
+        try:
+            while True:
+                tid, _, length, unit = MBAP.unpack(await self._reader.readexactly(MBAP.size))
+                body = await self._reader.readexactly(length - 1)
+                fut = self._pending.get(tid)
+                if fut is None or fut.done():
+                    continue
+                fc = body[0]
+                if fc > 0x80:
+                    fut.set_result(PipelineResponse(fc, exception_code=body[1], slave_id=unit, transaction_id=tid))
+                elif fc in (3, 4):
+                    regs = struct.unpack(f">{body[1] // 2}H", body[2:2 + body[1]])
+                    fut.set_result(PipelineResponse(fc, list(regs), slave_id=unit, transaction_id=tid))
+                else:
+                    fut.set_result(PipelineResponse(fc, slave_id=unit, transaction_id=tid))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._fail_pending(ConnectionException(f"Connection lost: {e}"))
+
+    def _fail_pending(self, exc):
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(exc)
+        self._pending.clear()
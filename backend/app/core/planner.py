@@ -0,0 +1,36 @@
+from typing import List, NamedTuple, Tuple
+
+# Modbus limits a single holding-register read (FC3) to 125 registers
+MAX_READ_REGISTERS = 125
+
+class ReadBlock(NamedTuple):
+    start: int
+    count: int
+    params: List[Tuple[str, int, int, int]]  # (name, index in block, width, relative image offset)
+
+def plan_reads(params, max_gap=0, max_count=MAX_READ_REGISTERS, width=2):
+    """Merges (name, addr, rel[, width]) parameters into as few contiguous reads as possible.
+
+    Two parameters share a block when the hole between them is at most `max_gap`
+    registers and the merged block stays within `max_count` registers. Parameters
+    without their own width span `width` registers.
+    """
+    blocks = []
+    start = end = None
+    members = []
+    for param in sorted(params, key=lambda p: p[1]):
+        name, addr, rel = param[:3]
+        w = param[3] if len(param) > 3 else width
+        if start is not None and addr - end <= max_gap and max(end, addr + w) - start <= max_count:
+            members.append((name, addr, w, rel))
+            end = max(end, addr + w)
+            continue
+        if start is not None:
+            blocks.append(_block(start, end, members))
+        start, end, members = addr, addr + w, [(name, addr, w, rel)]
+    if start is not None:
+        blocks.append(_block(start, end, members))
+    return blocks
+
+def _block(start, end, members):
+    return ReadBlock(start, end - start, [(name, addr - start, w, rel) for name, addr, w, rel in members])
@@ -0,0 +1,198 @@
+import asyncio
+import time
+import logging
+from contextlib import asynccontextmanager
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.exceptions import ConnectionException
+from app.core import config
+from app.core.pipeline import PipelinedClient
+from app.core.trace import tracer
+
+logger = logging.getLogger(__name__)
+
+class Endpoint:
+    """One persistent Modbus TCP connection, shared by every unit ID behind (ip, port)"""
+
+    def __init__(self, ip, port, pool):
+        self.ip = ip
+        self.port = port
+        self.pool = pool
+        self.client = None
+        self.lock = asyncio.Lock()
+        self.window = pool.window
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_used = time.monotonic()
+        self.connects = 0
+        self.requests = 0
+        self.inflight = 0
+
+    @property
+    def connected(self):
+        return self.client is not None and self.client.connected
+
+    @property
+    def pipelined(self):
+        return self.window > 1
+
+    async def connect(self):
+        if self.connected and isinstance(self.client, PipelinedClient) == self.pipelined:
+            return self.client
+        now = time.monotonic()
+        if now < self.retry_at:
+            raise ConnectionException(f"{self.ip}:{self.port} backing off for {self.retry_at - now:.1f}s")
+        self.close()
+        if self.pipelined:
+            self.client = PipelinedClient(self.ip, port=self.port, timeout=self.pool.timeout,
+                                          retries=self.pool.retries, window=self.window)
+        else:
+            # reconnect_delay=0 disables pymodbus' own reconnect loop, the pool owns retries
+            self.client = AsyncModbusTcpClient(self.ip, port=self.port, timeout=self.pool.timeout,
+                                               retries=self.pool.retries, reconnect_delay=0)
+        if await self.client.connect():
+            self.connects += 1
+            logger.info(f"Connected to {self.ip}:{self.port}")
+            return self.client
+        self.failed()
+        raise ConnectionException(f"Unable to connect to {self.ip}:{self.port}")
+
+    def failed(self):
+        self.failures += 1
+        delay = min(self.pool.backoff_max, self.pool.backoff_min * 2 ** (self.failures - 1))
+        self.retry_at = time.monotonic() + delay
+        self.close()
+        logger.warning(f"Endpoint {self.ip}:{self.port} failed {self.failures}x, retry in {delay:.1f}s")
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+class ConnectionPool:
+    def __init__(self, timeout=config.MODBUS_TIMEOUT_SEC, retries=config.MODBUS_RETRIES,
+                 backoff_min=config.POOL_BACKOFF_MIN_SEC, backoff_max=config.POOL_BACKOFF_MAX_SEC,
+                 idle_timeout=config.POOL_IDLE_TIMEOUT_SEC, window=config.PIPELINE_WINDOW):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.idle_timeout = idle_timeout
+        self.window = window
+        self.endpoints = {}
+
+    def endpoint(self, ip, port):
+        key = (ip, port)
+        ep = self.endpoints.get(key)
+        if ep is None:
+            ep = self.endpoints[key] = Endpoint(ip, port, self)
+        return ep
+
+    @asynccontextmanager
+    async def connection(self, ip, port, window=None):
+        """Yields the endpoint's connected client, reconnecting with backoff when needed.
+
+        With an in-flight window of 1 the exchange holds the endpoint lock, so requests
+        go out strictly one after another. A larger window only serializes connecting
+        and lets callers for different unit IDs overlap on the shared socket.
+        """
+        ep = self.endpoint(ip, port)
+        if window and window != ep.window:
+            ep.window = window  # takes effect on the next connect
+        connects = ep.connects
+        if ep.pipelined:
+            with tracer.span("connect", endpoint=f"{ip}:{port}") as span:
+                async with ep.lock:
+                    client = await ep.connect()
+                span.set(new=ep.connects != connects)
+            async with self._exchange(ep, client):
+                yield client
+        else:
+            # The lock is held through the exchange; the span covers waiting for it and connecting
+            with tracer.span("connect", endpoint=f"{ip}:{port}") as span:
+                await ep.lock.acquire()
+                try:
+                    client = await ep.connect()
+                except BaseException:
+                    ep.lock.release()
+                    raise
+                span.set(new=ep.connects != connects)
+            try:
+                async with self._exchange(ep, client):
+                    yield client
+            finally:
+                ep.lock.release()
+
+    @asynccontextmanager
+    async def _exchange(self, ep, client):
+        ep.last_used = time.monotonic()
+        ep.requests += 1
+        ep.inflight += 1
+        try:
+            yield
+        except Exception:
+            # pymodbus drops the transport on timeouts; only then is the socket suspect
+            if not client.connected and ep.client is client:
+                ep.failed()
+            raise
+        finally:
+            ep.inflight -= 1
+        # Only a completed exchange proves the endpoint healthy, a bare TCP accept does not
+        ep.failures = 0
+
+    async def warm(self, endpoints, limit=config.STARTUP_CONNECT_CONCURRENCY):
+        """Connects to `endpoints` [(ip, port, window)], at most `limit` at a time; returns how many connected"""
+        slots = asyncio.Semaphore(limit)
+
+        async def connect(ip, port, window):
+            async with slots:
+                ep = self.endpoint(ip, port)
+                if window:
+                    ep.window = window
+                async with ep.lock:
+                    await ep.connect()
+
+        results = await asyncio.gather(*(connect(*e) for e in endpoints), return_exceptions=True)
+        return sum(1 for r in results if not isinstance(r, BaseException))
+
+    def check(self):
+        """Closes idle connections and forgets endpoints nobody polls any more"""
+        now = time.monotonic()
+        for key, ep in list(self.endpoints.items()):
+            if ep.lock.locked() or ep.inflight:
+                continue
+            if now - ep.last_used > self.idle_timeout:
+                if ep.client is not None:
+                    logger.info(f"Closing idle connection {ep.ip}:{ep.port}")
+                ep.close()
+                del self.endpoints[key]
+            elif ep.client is not None and not ep.client.connected:
+                ep.close()
+
+    def release(self, ip, port):
+        """Closes an endpoint no device uses any more; a busy one is left to the idle check"""
+        ep = self.endpoints.get((ip, port))
+        if ep is None or ep.lock.locked() or ep.inflight:
+            return
+        if ep.client is not None:
+            logger.info(f"Closing unused connection {ip}:{port}")
+        ep.close()
+        del self.endpoints[(ip, port)]
+
+    async def health_loop(self, interval=config.POOL_HEALTH_INTERVAL_SEC):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Pool health check error: {e}")
+
+    def close_all(self):
+        for ep in self.endpoints.values():
+            ep.close()
+        self.endpoints.clear()
+
+    def stats(self):
+        return {f"{ip}:{port}": {"connected": ep.connected, "window": ep.window, "inflight": ep.inflight,
+                                 "failures": ep.failures,
+                                 "connects": ep.connects, "requests": ep.requests}
+                for (ip, port), ep in self.endpoints.items()}
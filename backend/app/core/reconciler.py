@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+from app.core import config
+
+logger = logging.getLogger(__name__)
+
+# Fields that move a device's registers in the image, and fields that point it at other hardware
+LAYOUT_FIELDS = {"type", "offset", "pm_params", "data_type", "byte_order"}
+ENDPOINT_FIELDS = {"ip", "port", "slave_id"}
+
+def device_config(dev):
+    return dev.model_dump(exclude={"status", "last_error"})
+
+def relocated(old, new):
+    """True when `old`'s register range no longer holds `new`'s values: removed, re-laid out or resized"""
+    if new is None:
+        return True
+    before, after = device_config(old), device_config(new)
+    return (any(before.get(key) != after.get(key) for key in LAYOUT_FIELDS)
+            or new.derived_registers() != old.derived_registers())
+
+class Reconciler:
+    """Applies a new device list to a running gateway by diffing it against the current one.
+
+    Unchanged devices keep their Device objects, so their schedule, read plan, connection
+    and state are untouched. Removed and edited devices are retired: their in-flight poll
+    is allowed to finish (its result is dropped), then their state, register range and
+    connection are cleaned up. Added and edited devices start polling once that is done.
+    """
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.lock = asyncio.Lock()
+        self.mtime = None
+        # Poll shards leave clearing to the main process, which owns the shared image
+        self.clears = True
+
+    def diff(self, old, new):
+        """Returns (devices to run, retired old devices, {name: changed fields})"""
+        current = {dev.name: dev for dev in old}
+        names = set()
+        merged, retired, changes = [], [], {}
+        for dev in new:
+            if dev.name in names:
+                raise ValueError(f"Duplicate device name: {dev.name}")
+            names.add(dev.name)
+            prev = current.get(dev.name)
+            if prev is None:
+                changes[dev.name] = {"added"}
+                merged.append(dev)
+                continue
+            before, after = device_config(prev), device_config(dev)
+            fields = {key for key in after if before.get(key) != after[key]}
+            if fields:
+                changes[dev.name] = fields
+                retired.append(prev)
+                merged.append(dev)
+            else:
+                merged.append(prev)
+        for dev in old:
+            if dev.name not in names:
+                changes[dev.name] = {"removed"}
+                retired.append(dev)
+        return merged, retired, changes
+
+    async def apply(self, devices):
+        """Switches the gateway to `devices`; returns {name: changed fields}"""
+        async with self.lock:
+            gw = self.gateway
+            merged, retired, changes = self.diff(gw.devices, devices)
+            if not changes:
+                return changes
+            for dev in retired:
+                dev._retired = True
+            # Let polls already running against the old configuration finish before cleaning up
+            tasks = [entry.task for entry in (gw.scheduler.entries.get(dev.name) for dev in retired)
+                     if entry is not None and entry.task is not None and not entry.task.done()]
+            gw.devices = merged
+            if gw.shards:
+                # Workers share the image and run this same reconciliation on their own devices
+                gw.shards.sync(merged)
+                tasks = []
+            else:
+                # Hold back added and edited devices until the old registers are cleared, so a
+                # device moved onto another's old range is not wiped after its first poll
+                gw.paused = set(changes)
+                if gw.running:
+                    gw.scheduler.sync(gw.schedulable())
+            clear = self.clears and not gw.shards
+            if tasks:
+                await asyncio.wait(tasks, timeout=config.MODBUS_TIMEOUT_SEC * (config.MODBUS_RETRIES + 1) + 1)
+
+            by_name = {dev.name: dev for dev in merged}
+            for old in retired:
+                fields = changes[old.name]
+                new = by_name.get(old.name)
+                if relocated(old, new):
+                    if clear:
+                        gw.image.clear(old.offset, old.register_count())
+                    gw.buffers.pop(old.name, None)
+                if new is None:
+                    self.forget(old.name)
+                elif fields & (LAYOUT_FIELDS | ENDPOINT_FIELDS):
+                    # Different registers or hardware: start over as if the device were new
+                    gw.health.pop(old.name, None)
+                    gw.rtt.pop(old.name, None)
+                    gw.filters.pop(old.name, None)
+                    gw.derived.pop(old.name, None)
+            in_use = {(dev.ip, dev.port) for dev in merged}
+            for dev in retired:
+                if (dev.ip, dev.port) not in in_use:
+                    gw.pool.release(dev.ip, dev.port)
+            gw.paused = set()
+            if gw.running and not gw.shards:
+                gw.scheduler.sync(gw.devices)
+            logger.info("Reconciled devices: " + ", ".join(f"{name} ({'/'.join(sorted(fields))})"
+                                                          for name, fields in changes.items()))
+            return changes
+
+    def forget(self, name):
+        gw = self.gateway
+        gw.device_data.pop(name, None)
+        gw.data_snapshot.touch()
+        gw.health.pop(name, None)
+        gw.rtt.pop(name, None)
+        gw.filters.pop(name, None)
+        gw.derived.pop(name, None)
+        gw.writer.forget(name)
+        gw.hub.forget(name)
+        gw.history.forget(name)
+
+    async def watch(self, path, interval=config.CONFIG_WATCH_SEC):
+        """Applies external edits of the devices file, checking its mtime every `interval` seconds"""
+        from app.models.device import Device
+        self.mtime = self._stat(path)
+        while interval > 0:
+            await asyncio.sleep(interval)
+            mtime = self._stat(path)
+            if mtime is None or mtime == self.mtime:
+                continue
+            self.mtime = mtime
+            try:
+                devices = [Device(**d) for d in json.loads(path.read_text())]
+                changes = await self.apply(devices)
+                if changes:
+                    logger.info(f"Applied {len(changes)} device changes from {path}")
+            except Exception as e:
+                logger.error(f"Ignoring {path} edit: {e}")
+
+    def seen(self, path):
+        """Records a write of our own so the watcher does not reload it"""
+        self.mtime = self._stat(path)
+
+    def _stat(self, path):
+        try:
+            st = path.stat()
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
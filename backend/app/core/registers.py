@@ -0,0 +1,84 @@
+from array import array
+from pymodbus.datastore import ModbusSlaveContext
+from pymodbus.datastore.store import BaseModbusDataBlock
+from pymodbus.pdu import ExceptionResponse
+
+class RegisterImage(BaseModbusDataBlock):
+    """Holding-register image served on port 502, stored as one unsigned 16-bit array.
+
+    Pollers assemble a device's registers in their own buffer and `commit` them with a
+    single slice assignment. The server reads on the same event loop, so a SCADA
+    request sees either the whole previous update of a device or the whole new one.
+    `buffer` lets the image live in memory shared with other processes. With `on_write`
+    set, SCADA writes go to that handler instead, which may refuse them with an exception code.
+    """
+
+    def __init__(self, size, buffer=None):
+        self.address = 0
+        self.default_value = 0
+        self.regs = memoryview(buffer).cast("H") if buffer is not None else array("H", bytes(2 * size))
+        self.size = len(self.regs)
+        # Port-502 traffic counters, read by the /metrics endpoint
+        self.reads = 0
+        self.registers_read = 0
+        self.writes = 0
+        self.registers_written = 0
+        self.on_write = None
+
+    @property
+    def values(self):
+        return self.regs
+
+    def reset(self):
+        self.regs[:] = array("H", bytes(2 * self.size))
+
+    def validate(self, address, count=1):
+        return 0 <= address and address + count <= self.size
+
+    def getValues(self, address, count=1):
+        self.reads += 1
+        self.registers_read += count
+        return self.regs[address:address + count].tolist()
+
+    def setValues(self, address, values):
+        if not isinstance(values, (list, tuple, array)):
+            values = [values]
+        self.writes += 1
+        self.registers_written += len(values)
+        if self.on_write is not None:
+            return self.on_write(address, values)
+        self.regs[address:address + len(values)] = array("H", values)
+
+    def commit(self, offset, regs):
+        """Replaces a device's register range in one step"""
+        if not isinstance(regs, array):
+            regs = array("H", regs)
+        self.regs[offset:offset + len(regs)] = regs
+
+    def clear(self, offset, count):
+        self.regs[offset:offset + count] = array("H", bytes(2 * count))
+
+class ImageContext(ModbusSlaveContext):
+    """Slave context that turns an exception code returned by a datablock write into a Modbus exception.
+
+    A forwarded write is not in the image yet, so the FC6 echo, which pymodbus reads back
+    right after the write, repeats the written value instead.
+    """
+
+    echo = None
+
+    def setValues(self, fc_as_hex, address, values):
+        if not self.zero_mode:
+            address += 1
+        code = self.store[self.decode(fc_as_hex)].setValues(address, values)
+        if code:
+            return ExceptionResponse(fc_as_hex, code)
+        if fc_as_hex == 6:
+            self.echo = list(values)
+        return None
+
+    def getValues(self, fc_as_hex, address, count=1):
+        if fc_as_hex == 6 and self.echo is not None:
+            values, self.echo = self.echo, None
+            return values
+        return super().getValues(fc_as_hex, address, count)
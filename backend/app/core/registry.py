@@ -0,0 +1,58 @@
+from bisect import bisect_right
+
+class DeviceRegistry:
+    """The configured devices in order, indexed by name, by endpoint and by register range.
+
+    Registries are rebuilt rather than edited: the gateway swaps in a new one whenever
+    its device list changes, so readers never see a half-updated index.
+    """
+
+    def __init__(self, devices=()):
+        self.devices = list(devices)
+        self.by_name = {}
+        self.by_endpoint = {}
+        for dev in self.devices:
+            self.by_name[dev.name] = dev
+            self.by_endpoint.setdefault((dev.ip, dev.port), []).append(dev)
+        self.ranges = sorted((dev.offset, dev.offset + dev.register_count(), dev.name) for dev in self.devices)
+        self.starts = [start for start, _, _ in self.ranges]
+        self.end = max((end for _, end, _ in self.ranges), default=0)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def on_endpoint(self, ip, port):
+        return self.by_endpoint.get((ip, port), [])
+
+    def at(self, address):
+        """The device whose register range holds `address`, if any"""
+        i = bisect_right(self.starts, address) - 1
+        if i >= 0 and address < self.ranges[i][1]:
+            return self.by_name[self.ranges[i][2]]
+        return None
+
+    def next_offset(self):
+        """First register after every configured device"""
+        return self.end
+
+def validate_devices(devices, image_size):
+    """Returns a list of problems (duplicate names, overlapping or out-of-range registers), empty if none"""
+    errors = []
+    seen = set()
+    for dev in devices:
+        if dev.name in seen:
+            errors.append(f"Duplicate device name: {dev.name}")
+        seen.add(dev.name)
+    ranges = sorted((dev.offset, dev.offset + dev.register_count(), dev.name) for dev in devices)
+    prev_end, prev_name = 0, None
+    for start, end, name in ranges:
+        if start < 0 or end > image_size:
+            errors.append(f"{name}: registers {start}-{end - 1} outside the image (0-{image_size - 1})")
+        if prev_name is not None and start < prev_end:
+            errors.append(f"{name}: registers {start}-{end - 1} overlap {prev_name}")
+        if end > prev_end:
+            prev_end, prev_name = end, name
+    return errors
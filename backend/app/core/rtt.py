@@ -0,0 +1,77 @@
+import asyncio
+import time
+from pymodbus.exceptions import ModbusIOException
+from app.core import config
+
+# RFC 6298 gains for the smoothed RTT and its mean deviation
+ALPHA = 1 / 8
+BETA = 1 / 4
+MAX_BACKOFF = 64
+
+class RttEstimator:
+    """Round-trip time estimate for one device, derived the way TCP derives its RTO.
+
+    The timeout is the smoothed RTT plus four mean deviations, kept within
+    [`min_timeout`, `max_timeout`] and doubled after every timeout until a response
+    arrives again. Retries spend the worst-case time the fixed settings allow
+    (`budget`) on more, shorter attempts, up to `max_retries`. Until the first
+    response the fixed timeout applies.
+    """
+
+    def __init__(self, min_timeout=config.RTT_MIN_TIMEOUT_SEC, max_timeout=config.MODBUS_TIMEOUT_SEC,
+                 max_retries=config.RTT_MAX_RETRIES,
+                 budget=config.MODBUS_TIMEOUT_SEC * (config.MODBUS_RETRIES + 1)):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.max_retries = max_retries
+        self.budget = budget
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1
+        self.samples = 0
+        self.timeouts = 0
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar += BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += ALPHA * (rtt - self.srtt)
+        self.backoff = 1
+        self.samples += 1
+
+    def timed_out(self):
+        self.timeouts += 1
+        self.backoff = min(MAX_BACKOFF, self.backoff * 2)
+
+    @property
+    def timeout(self):
+        if self.srtt is None:
+            return self.max_timeout
+        rto = (self.srtt + 4 * self.rttvar) * self.backoff
+        return min(self.max_timeout, max(self.min_timeout, rto))
+
+    @property
+    def retries(self):
+        return max(0, min(self.max_retries, int(self.budget / self.timeout) - 1))
+
+    async def call(self, method, *args, **kwargs):
+        """Runs one Modbus request under the adaptive timeout, retrying as the estimate allows"""
+        retries = self.retries
+        for _ in range(retries + 1):
+            timeout = self.timeout
+            start = time.monotonic()
+            try:
+                response = await asyncio.wait_for(method(*args, **kwargs), timeout)
+            except asyncio.TimeoutError:
+                self.timed_out()
+                continue
+            # Responses are matched by transaction ID, so even a retry's round trip is unambiguous
+            self.sample(time.monotonic() - start)
+            return response
+        raise ModbusIOException(f"No response after {retries + 1} attempts, last timeout {timeout * 1000:.0f} ms")
+
+    def stats(self):
+        ms = lambda s: None if s is None else round(s * 1000, 1)
+        return {"srtt_ms": ms(self.srtt), "rttvar_ms": ms(self.rttvar), "timeout_ms": ms(self.timeout),
+                "retries": self.retries, "samples": self.samples, "timeouts": self.timeouts}
@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from app.core.trace import tracer
+from app.core import config
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL_SEC = 0.05
+
+class ScheduleEntry:
+    def __init__(self, dev, interval, due, seq):
+        self.dev = dev
+        self.interval = interval
+        self.due = due
+        self.seq = seq
+        self.task = None
+        self.polls = 0
+        self.missed = 0
+        self.last_duration = None
+        self.max_lag = 0.0
+
+class PollScheduler:
+    """Drives every device on its own fixed-rate timer.
+
+    Deadlines advance by whole intervals from the previous deadline rather than from
+    when a poll finished, so the period does not drift. A slot whose previous poll is
+    still running, or that the loop wakes up too late for, is counted as missed.
+    `hold(dev)` may return a number of seconds to park a device, e.g. while it is offline.
+    """
+
+    def __init__(self, poll, default_interval=config.SCAN_INTERVAL_SEC, hold=None):
+        self.poll = poll
+        self.hold = hold
+        self.default_interval = default_interval
+        self.entries = {}
+        self.heap = []
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+
+    def interval_for(self, dev):
+        return max(MIN_INTERVAL_SEC, dev.poll_interval or self.default_interval)
+
+    def sync(self, devices):
+        """Adds, removes and retunes entries so the schedule matches `devices`"""
+        now = asyncio.get_running_loop().time()
+        seen = set()
+        for dev in devices:
+            seen.add(dev.name)
+            entry = self.entries.get(dev.name)
+            if entry is None:
+                self._push(dev.name, ScheduleEntry(dev, self.interval_for(dev), now, None))
+            elif entry.dev is not dev:
+                interval = self.interval_for(dev)
+                entry.dev = dev
+                if interval != entry.interval:
+                    entry.interval = interval
+                    self._push(dev.name, entry, min(entry.due, now + interval))
+        for name in [n for n in self.entries if n not in seen]:
+            del self.entries[name]
+
+    def expedite(self, name):
+        """Polls `name` as soon as possible instead of waiting for its next period"""
+        entry = self.entries.get(name)
+        if entry is not None:
+            self._push(name, entry, min(entry.due, asyncio.get_running_loop().time()))
+
+    def _push(self, name, entry, due=None):
+        if due is not None:
+            entry.due = due
+        entry.seq = next(self._seq)
+        self.entries[name] = entry
+        heapq.heappush(self.heap, (entry.due, -entry.dev.priority, entry.seq, name))
+        self._wake.set()
+
+    async def run(self, devices, running):
+        """Runs until `running()` is false, resyncing with `devices()` once per default interval"""
+        loop = asyncio.get_running_loop()
+        next_sync = 0.0
+        while running():
+            now = loop.time()
+            if now >= next_sync:
+                self.sync(devices())
+                next_sync = now + self.default_interval
+            wait = next_sync - now
+            if self.heap:
+                wait = min(wait, self.heap[0][0] - now)
+            if wait > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due, _, seq, name = heapq.heappop(self.heap)
+            entry = self.entries.get(name)
+            if entry is None or entry.seq != seq:
+                continue  # removed or rescheduled since it was pushed
+            held = self.hold(entry.dev) if self.hold else 0
+            if held > 0:
+                # Device is backing off: park it outside the cycle until its next probe
+                self._push(name, entry, now + held)
+                continue
+            self._fire(entry, due, now)
+            # Skip whole periods we are already too late for instead of bursting to catch up
+            behind = int((now - due) // entry.interval)
+            if behind:
+                entry.missed += behind
+            self._push(name, entry, due + (behind + 1) * entry.interval)
+
+    def _fire(self, entry, due, now):
+        if entry.task is not None and not entry.task.done():
+            entry.missed += 1
+            tracer.instant("overrun", entry.dev.name)
+            return
+        entry.max_lag = max(entry.max_lag, now - due)
+        entry.task = asyncio.create_task(self._poll(entry, now - due))
+
+    async def _poll(self, entry, lag=0.0):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            with tracer.span("poll", entry.dev.name, lag_ms=round(lag * 1000, 1)):
+                await self.poll(entry.dev)
+        except Exception as e:
+            logger.error(f"Poll {entry.dev.name} error: {e}")
+        finally:
+            entry.polls += 1
+            entry.last_duration = loop.time() - start
+
+    def stats(self):
+        return {name: {"interval": e.interval, "priority": e.dev.priority, "polls": e.polls,
+                       "missed": e.missed, "last_duration": e.last_duration, "max_lag": e.max_lag}
+                for name, e in self.entries.items()}
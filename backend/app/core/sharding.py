@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import zlib
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from app.core.reconciler import relocated
+from app.core.registers import RegisterImage
+from app.core import config
+
+logger = logging.getLogger(__name__)
+
+SEQ_BYTES = 4
+
+def shard_of(dev, workers):
+    """Stable endpoint -> worker assignment, so one endpoint's connection lives in one process"""
+    return zlib.crc32(f"{dev.ip}:{dev.port}".encode()) % workers
+
+def block_size(workers, size):
+    return SEQ_BYTES * (workers + 1) + 2 * size
+
+class SharedRegisterImage(RegisterImage):
+    """Register image in shared memory, written by poll workers and served by the main process.
+
+    The block starts with one sequence counter per worker and a last one for the main
+    process, which clears retired ranges. A writer makes its counter odd while it commits
+    or clears a device and even again afterwards; a reader retries until no counter moved
+    during its copy, so SCADA still never sees a half-written device.
+    """
+
+    def __init__(self, size, shm, workers, index=None):
+        header = SEQ_BYTES * (workers + 1)
+        super().__init__(size, buffer=shm.buf[header:header + 2 * size])
+        self.seqs = shm.buf[:header].cast("I")
+        self.index = workers if index is None else index
+
+    def getValues(self, address, count=1):
+        self.reads += 1
+        self.registers_read += count
+        for _ in range(100):
+            before = self.seqs.tolist()
+            values = self.regs[address:address + count].tolist()
+            if before == self.seqs.tolist() and not any(seq & 1 for seq in before):
+                break
+        return values
+
+    @contextmanager
+    def writing(self):
+        seq = self.seqs[self.index]
+        self.seqs[self.index] = (seq + 1) & 0xFFFFFFFF
+        try:
+            yield
+        finally:
+            self.seqs[self.index] = (seq + 2) & 0xFFFFFFFF
+
+    def commit(self, offset, regs):
+        with self.writing():
+            super().commit(offset, regs)
+
+    def clear(self, offset, count):
+        with self.writing():
+            super().clear(offset, count)
+
+    def release(self):
+        self.regs.release()
+        self.seqs.release()
+
+class ShardManager:
+    """Runs polling in `workers` processes, each with its own event loop and connection pool.
+
+    Devices are split by endpoint. Workers commit straight into the shared register
+    image and send their poll results back in batches, which the main process
+    publishes to the same listeners as in single-process mode. Each worker confirms
+    every device list it applied; until then its old devices count as still polled.
+    """
+
+    def __init__(self, workers, size=config.UNIFIED_REG_COUNT):
+        self.workers = workers
+        self.size = size
+        self.shm = shared_memory.SharedMemory(create=True, size=block_size(workers, size))
+        self.shm.buf[:block_size(workers, size)] = bytes(block_size(workers, size))
+        self.image = SharedRegisterImage(size, self.shm, workers)
+        self.ctx = multiprocessing.get_context("spawn")
+        self.results = self.ctx.Queue()
+        self.procs = [None] * workers
+        self.commands = [None] * workers
+        self.held = [{} for _ in range(workers)]  # id -> Device each worker may be polling
+        self.pending = [None] * workers  # (generation, devices) sent but not yet confirmed
+        self.generation = 0
+        self.worker_stats = [{} for _ in range(workers)]
+        self.gateway = None
+        self.loop = None
+        self._reader = None
+
+    def start(self, gateway):
+        self.gateway = gateway
+        self.loop = asyncio.get_running_loop()
+        self._reader = threading.Thread(target=self._read_results, name="shard-results", daemon=True)
+        self._reader.start()
+        for index in range(self.workers):
+            self._spawn(index)
+        asyncio.create_task(self.sync_loop())
+        logger.info(f"Polling sharded across {self.workers} worker processes")
+
+    def _spawn(self, index):
+        self.commands[index] = self.ctx.Queue()
+        # A dead worker polls nothing, so its devices are retired as if it had confirmed
+        retired, self.held[index], self.pending[index] = self.held[index].values(), {}, None
+        if self.gateway is not None:
+            self._clear(retired)
+        proc = self.ctx.Process(target=worker_main, name=f"poll-shard-{index}", daemon=True,
+                                args=(index, self.workers, self.shm.name, self.size,
+                                      self.commands[index], self.results))
+        proc.start()
+        self.procs[index] = proc
+
+    async def sync_loop(self):
+        """Pushes device list changes to the workers and restarts any that died"""
+        while self.gateway.running:
+            try:
+                for index, proc in enumerate(self.procs):
+                    if not proc.is_alive():
+                        logger.error(f"Poll shard {index} exited with {proc.exitcode}, restarting")
+                        self._spawn(index)
+                self.sync(self.gateway.devices)
+            except Exception as e:
+                logger.error(f"Shard sync error: {e}")
+            await asyncio.sleep(config.SCAN_INTERVAL_SEC)
+
+    def sync(self, devices):
+        """Sends each worker its devices, holding back those it cannot safely poll yet.
+
+        A device that changes shard waits until its old worker confirmed it let go, and a
+        device landing on registers that still need clearing waits until they are cleared.
+        """
+        wanted = {dev.name: dev for dev in devices}
+        kept = {id(dev) for dev in devices}
+        stale = [dev for held in self.held for dev in held.values()
+                 if id(dev) not in kept and relocated(dev, wanted.get(dev.name))]
+        shards = [[] for _ in range(self.workers)]
+        for dev in devices:
+            shards[shard_of(dev, self.workers)].append(dev)
+        for index, devs in enumerate(shards):
+            if self.pending[index] is not None:
+                continue  # synced again once the worker confirms its last list
+            held = self.held[index]
+            ready = {id(dev): dev for dev in devs if id(dev) in held or not self._blocked(dev, index, stale)}
+            if ready.keys() != held.keys():
+                self.generation += 1
+                self.pending[index] = (self.generation, ready)
+                held.update(ready)
+                self.commands[index].put(("devices", (self.generation, [
+                    dev.model_dump(exclude={"status", "last_error"}) for dev in ready.values()])))
+
+    def _blocked(self, dev, index, stale):
+        if any(held.name == dev.name for other, devs in enumerate(self.held) if other != index
+               for held in devs.values()):
+            return True
+        end = dev.offset + dev.register_count()
+        return any(old.offset < end and dev.offset < old.offset + old.register_count() for old in stale)
+
+    def _confirmed(self, index, generation):
+        pending = self.pending[index]
+        if pending is None or pending[0] != generation:
+            return  # from before the worker was restarted
+        retired = [dev for key, dev in self.held[index].items() if key not in pending[1]]
+        self.held[index], self.pending[index] = pending[1], None
+        self._clear(retired)
+        self.sync(self.gateway.devices)
+
+    def _clear(self, retired):
+        """Zeroes the ranges of devices no worker polls any more, unless they kept their layout"""
+        wanted = {dev.name: dev for dev in self.gateway.devices}
+        for dev in retired:
+            if relocated(dev, wanted.get(dev.name)):
+                self.image.clear(dev.offset, dev.register_count())
+
+    def write(self, dev, id, regs):
+        """Hands a SCADA write to the worker that owns the device's connection"""
+        index = next((index for index, held in enumerate(self.held)
+                      if any(d.name == dev.name for d in held.values())), shard_of(dev, self.workers))
+        self.commands[index].put(("write", (dev.name, id, regs)))
+
+    def _read_results(self):
+        while True:
+            msg = self.results.get()
+            if msg is None:
+                return
+            self.loop.call_soon_threadsafe(self._apply, msg)
+
+    def _apply(self, msg):
+        kind, index, payload = msg
+        if kind == "data":
+            names = self.gateway.registry.by_name
+            for name, entry, report in payload:
+                if name in names:  # results still in flight for a removed device are dropped
+                    self.gateway.publish(name, entry, report)
+        elif kind == "applied":
+            self._confirmed(index, payload)
+        elif kind == "writes":
+            for id, status, error in payload:
+                self.gateway.writer.resolve(id, status, error)
+        elif kind == "stats":
+            self.worker_stats[index] = payload
+            # Devices are disjoint between workers, so their metric series merge without clashing
+            self.gateway.poll_latency.series.update(payload["poll_latency"])
+            self.gateway.poll_requests.series.update(payload["poll_requests"])
+            self.gateway.poll_errors.values.update(payload["poll_errors"])
+            self.gateway.writes_total.values.update(payload["writes_total"])
+
+    def scheduler_stats(self):
+        return {name: s for stats in self.worker_stats for name, s in stats.get("scheduler", {}).items()}
+
+    def rtt_stats(self):
+        return {name: s for stats in self.worker_stats for name, s in stats.get("rtt", {}).items()}
+
+    def write_stats(self):
+        return {name: n for stats in self.worker_stats for name, n in stats.get("write_queues", {}).items()}
+
+    def pool_stats(self):
+        return {ep: s for stats in self.worker_stats for ep, s in stats.get("pool", {}).items()}
+
+    def stop(self):
+        for index, proc in enumerate(self.procs):
+            if proc is not None and proc.is_alive():
+                self.commands[index].put(("stop", None))
+        for proc in self.procs:
+            if proc is not None:
+                proc.join(timeout=5)
+                if proc.is_alive():
+                    proc.terminate()
+        self.results.put(None)
+        self.image.release()
+        self.shm.close()
+        self.shm.unlink()
+
+def copy_series(series):
+    return {labels: list(values) for labels, values in series.items()}
+
+def worker_main(index, workers, shm_name, size, commands, results):
+    # The worker reuses the gateway's poll code but must not start shards of its own
+    config.SHARD_WORKERS = 0
+    config.HISTORIAN_ENABLED = False
+    config.EXPORT_URL = ""
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s - shard{index} - %(name)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(_worker(index, workers, shm_name, size, commands, results))
+    except KeyboardInterrupt:
+        pass
+
+async def _worker(index, workers, shm_name, size, commands, results):
+    from app.core.gateway import gateway as gw
+    from app.models.device import Device
+    from app.core.writes import WriteRecord
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    gw.image = SharedRegisterImage(size, shm, workers, index)
+    gw.reconciler.clears = False
+    pending = []
+    written = []
+    gw.writer.on_done = lambda record: written.append((record.id, record.status, record.error))
+    # Results go back to the main process, which publishes them to the real listeners
+    gw.publish = lambda name, entry, report=None: pending.append((name, entry, report))
+    gw.running = True
+    loop = asyncio.get_running_loop()
+    tasks = [asyncio.create_task(gw.poll_all()), asyncio.create_task(gw.pool.health_loop())]
+    logger.info(f"Poll shard {index} started (pid {os.getpid()})")
+
+    async def read_commands():
+        while gw.running:
+            try:
+                kind, payload = await loop.run_in_executor(None, commands.get, True, 1.0)
+            except queue.Empty:
+                continue
+            if kind == "devices":
+                generation, devices = payload
+                first = not gw.devices
+                await gw.reconciler.apply([Device(**d) for d in devices])
+                # Retired devices are flagged and commit nothing more, so their ranges are free to clear
+                results.put(("applied", index, generation))
+                if first:
+                    await gw.warm_connect()
+            elif kind == "write":
+                name, id, regs = payload
+                dev = gw.registry.get(name)
+                if dev is None:
+                    written.append((id, "error", "Device removed"))
+                else:
+                    gw.writer.submit(dev, regs, WriteRecord(id, name, dev.offset, len(regs),
+                                                            len({addr for addr, _ in regs})))
+            elif kind == "stop":
+                gw.running = False
+
+    reader = asyncio.create_task(read_commands())
+    next_stats = 0.0
+    while gw.running:
+        await asyncio.sleep(config.SHARD_FLUSH_SEC)
+        if pending:
+            # Queue.put pickles on a feeder thread, so hand over copies rather than live objects
+            results.put(("data", index, pending.copy()))
+            pending.clear()
+        if written:
+            results.put(("writes", index, written.copy()))
+            written.clear()
+        if loop.time() >= next_stats:
+            next_stats = loop.time() + config.SHARD_STATS_SEC
+            results.put(("stats", index, {"scheduler": gw.scheduler.stats(), "pool": gw.pool.stats(),
+                                          "poll_latency": copy_series(gw.poll_latency.series),
+                                          "poll_requests": copy_series(gw.poll_requests.series),
+                                          "poll_errors": dict(gw.poll_errors.values),
+                                          "writes_total": dict(gw.writes_total.values),
+                                          "write_queues": gw.writer.stats(), "rtt": gw.rtt_stats()}))
+    await reader
+    for task in tasks:
+        task.cancel()
+    gw.pool.close_all()
+    gw.image.release()
+    shm.close()
@@ -0,0 +1,87 @@
+import gzip
+import json
+import os
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from app.core import config
+
+try:
+    import orjson
+except ImportError:  # optional, only faster
+    orjson = None
+
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+
+def dumps(obj):
+    """JSON-encodes `obj` to bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+class Snapshot:
+    """A JSON document serialized once and served from cache to every client.
+
+    Writers call `touch` when the data changes; the body is rebuilt on the next request,
+    at most once per `min_interval` seconds, so any number of pollers cost one
+    serialization per interval. The ETag names the build, not the data's current version.
+    """
+
+    # Distinguishes builds across restarts, which start counting versions at 0 again
+    generation = os.urandom(4).hex()
+
+    def __init__(self, build, min_interval=config.SNAPSHOT_INTERVAL_SEC):
+        self.build = build
+        self.min_interval = min_interval
+        self.version = 0
+        self.modified = time.time()
+        self.built_version = -1
+        self.built_at = 0.0
+        self.body = b""
+        self.etag = None
+        self.built_modified = 0.0
+        self.last_modified = None
+        self._gzipped = None
+        self.builds = 0
+
+    def touch(self):
+        self.version += 1
+        self.modified = time.time()
+
+    def current(self):
+        now = time.monotonic()
+        if self.version != self.built_version and (self.built_version < 0 or now - self.built_at >= self.min_interval):
+            self.built_version = self.version
+            self.built_at = now
+            self.body = dumps(self.build())
+            self.etag = f'"{self.generation}-{self.version}"'
+            self.built_modified = self.modified
+            self.last_modified = formatdate(self.modified, usegmt=True)
+            self._gzipped = None
+            self.builds += 1
+        return self
+
+    @property
+    def gzip_etag(self):
+        # A different encoding is a different representation and needs its own strong ETag
+        return self.etag[:-1] + '-gzip"'
+
+    def gzipped(self):
+        """The body gzip-compressed, or None when it is too small to bother"""
+        if len(self.body) < GZIP_MIN_BYTES:
+            return None
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=5)
+        return self._gzipped
+
+    def not_modified(self, if_none_match=None, if_modified_since=None):
+        """Whether a conditional request already has the current body"""
+        if if_none_match is not None:
+            tags = {tag.strip() for tag in if_none_match.split(",")}
+            return "*" in tags or self.etag in tags or self.gzip_etag in tags
+        if if_modified_since is not None:
+            try:
+                return int(self.built_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
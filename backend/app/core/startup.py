@@ -0,0 +1,137 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from array import array
+from pathlib import Path
+from app.core.gateway import gateway
+from app.core.persist import DeviceStore
+from app.core import config
+
+logger = logging.getLogger(__name__)
+
+DEVICES_FILE = Path("devices.json")
+store = DeviceStore(DEVICES_FILE, lambda: gateway.devices, on_saved=gateway.reconciler.seen)
+
+class StartupTimer:
+    """Seconds spent in each startup phase, measured from process start"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.last = self.started
+        self.phases = {}
+
+    def begin(self, started):
+        self.started = self.last = started
+
+    def mark(self, phase):
+        now = time.monotonic()
+        self.phases[phase] = round(now - self.last, 3)
+        self.last = now
+
+    def stats(self):
+        return {"phases": self.phases, "total": round(self.last - self.started, 3)}
+
+    def summary(self):
+        return ", ".join(f"{phase} {sec:.2f}s" for phase, sec in self.phases.items()) + \
+            f" (total {self.last - self.started:.2f}s)"
+
+timer = StartupTimer()
+
+def load_devices(gw=gateway, store=store):
+    try:
+        devices = store.load()
+        if devices is not None:
+            gw.devices = devices
+            logger.info(f"Loaded {len(gw.devices)} devices from {store.path}")
+        else:
+            logger.warning(f"No devices file found at {store.path}")
+    except Exception as e:
+        logger.error(f"Error loading devices: {e}", exc_info=True)
+        gw.devices = []
+
+def layout_key(dev):
+    return [dev.offset, dev.type, dev.image_signals()]
+
+def save_image(gw=gateway, path=config.IMAGE_SNAPSHOT_PATH):
+    """Writes every device's image registers, with the layout they were written in, for the next start"""
+    if not path:
+        return
+    devices = [{"name": dev.name, "layout": layout_key(dev), "count": dev.register_count()} for dev in gw.devices]
+    regs = array("H")
+    for dev in gw.devices:
+        regs.extend(gw.image.regs[dev.offset:dev.offset + dev.register_count()])
+    if sys.byteorder == "little":
+        regs.byteswap()
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(json.dumps({"saved_at": time.time(), "devices": devices}).encode() + b"\n")
+            f.write(regs.tobytes())
+        os.replace(tmp, path)
+        logger.info(f"Saved register image of {len(devices)} devices to {path}")
+    except OSError as e:
+        logger.error(f"Error saving register image: {e}")
+
+def seed_image(gw=gateway, path=config.IMAGE_SNAPSHOT_PATH, max_age=config.IMAGE_SNAPSHOT_MAX_AGE_SEC):
+    """Restores the last saved registers of devices whose layout has not changed since; returns how many"""
+    if not path or not os.path.exists(path):
+        return 0
+    try:
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            regs = array("H", f.read())
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring register image {path}: {e}")
+        return 0
+    age = time.time() - header["saved_at"]
+    if age > max_age:
+        logger.info(f"Ignoring register image {path}, saved {age:.0f}s ago")
+        return 0
+    if sys.byteorder == "little":
+        regs.byteswap()
+    current = {dev.name: dev for dev in gw.devices}
+    seeded = pos = 0
+    for saved in header["devices"]:
+        dev = current.get(saved["name"])
+        if dev is not None and saved["layout"] == json.loads(json.dumps(layout_key(dev))):
+            # Straight into the array: nothing polls yet, and shard workers do not exist yet
+            gw.image.regs[dev.offset:dev.offset + saved["count"]] = regs[pos:pos + saved["count"]]
+            seeded += 1
+        pos += saved["count"]
+    logger.info(f"Seeded register image of {seeded}/{len(gw.devices)} devices from {path} ({age:.0f}s old)")
+    return seeded
+
+async def wait_first_poll(gw, started, timeout=60.0):
+    """Marks the `first_poll` phase once every device has answered or failed once"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(gw.device_data.get(dev.name, {}).get("timestamp", 0) >= started for dev in gw.devices):
+            break
+        await asyncio.sleep(0.05)
+    timer.mark("first_poll")
+    logger.info(f"Startup: {timer.summary()}")
+
+async def boot(gw=gateway):
+    """Brings the gateway up in the order that gets valid data on port 502 soonest.
+
+    The saved image is served as soon as the socket is bound. Endpoints are then
+    connected concurrently, so the first poll cycle does not connect from cold.
+    """
+    timer.mark("imports")
+    load_devices(gw)
+    timer.mark("devices")
+    seed_image(gw)
+    timer.mark("seed_image")
+    await gw.listen()
+    timer.mark("listen")
+    if not gw.shards:
+        # Shard workers hold their own connections and warm them as they receive their devices
+        connected = await gw.warm_connect()
+        logger.info(f"Warm connect: {connected if connected is not None else 'some'} of "
+                    f"{len({(dev.ip, dev.port) for dev in gw.devices})} endpoints connected")
+        timer.mark("connect")
+    gw.start_polling()
+    asyncio.create_task(wait_first_poll(gw, time.time()))
@@ -0,0 +1,122 @@
+import time
+from array import array
+from app.core import config
+
+class RingBuffer:
+    """Fixed-capacity (timestamp, value) series: float64 timestamps, float32 values, 12 bytes a sample.
+
+    float32 is what the register image publishes, so history keeps the precision SCADA sees.
+    """
+    __slots__ = ("times", "values", "capacity", "head", "size")
+
+    def __init__(self, capacity):
+        self.times = array("d", bytes(8 * capacity))
+        self.values = array("f", bytes(4 * capacity))
+        self.capacity = capacity
+        self.head = 0  # next slot to write
+        self.size = 0
+
+    def append(self, t, v):
+        self.times[self.head] = t
+        self.values[self.head] = v
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def _slot(self, i):
+        """Physical slot of the i-th oldest sample"""
+        return (self.head - self.size + i) % self.capacity
+
+    def _bisect(self, t):
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[self._slot(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start, end):
+        """Yields (t, v) with start <= t <= end, oldest first"""
+        for i in range(self._bisect(start), self.size):
+            slot = self._slot(i)
+            t = self.times[slot]
+            if t > end:
+                break
+            yield t, self.values[slot]
+
+    def nbytes(self):
+        return (self.times.itemsize + self.values.itemsize) * self.capacity
+
+def downsample(samples, start, end, points):
+    """Buckets samples into at most `points` equal time slices with min/max/avg per slice"""
+    width = (end - start) / points if end > start else 1.0
+    out = {"t": [], "min": [], "max": [], "avg": [], "count": []}
+    bucket = None
+    lo = hi = total = 0.0
+    n = 0
+    for t, v in samples:
+        b = min(int((t - start) / width), points - 1)
+        if b != bucket:
+            if n:
+                _emit(out, start + bucket * width, lo, hi, total, n)
+            bucket, lo, hi, total, n = b, v, v, 0.0, 0
+        lo = min(lo, v)
+        hi = max(hi, v)
+        total += v
+        n += 1
+    if n:
+        _emit(out, start + bucket * width, lo, hi, total, n)
+    return out
+
+def _emit(out, t, lo, hi, total, n):
+    out["t"].append(t)
+    out["min"].append(lo)
+    out["max"].append(hi)
+    out["avg"].append(total / n)
+    out["count"].append(n)
+
+class TimeSeriesStore:
+    """Per-signal ring buffers fed from poll results; memory is capacity x 12 bytes per signal"""
+
+    def __init__(self, capacity=config.TS_CAPACITY, retention=config.TS_RETENTION_SEC):
+        self.capacity = capacity
+        self.retention = retention
+        self.series = {}
+
+    def record(self, name, entry):
+        values = entry.get("values")
+        if not values or "error" in entry:
+            return  # failed polls carry no new samples, only stale values
+        t = entry.get("timestamp") or time.time()
+        signals = self.series.get(name)
+        if signals is None:
+            signals = self.series[name] = {}
+        for signal, val in values.items():
+            if isinstance(val, bool) or not isinstance(val, (int, float)):
+                continue
+            buf = signals.get(signal)
+            if buf is None:
+                buf = signals[signal] = RingBuffer(self.capacity)
+            buf.append(t, val)
+
+    def forget(self, name):
+        self.series.pop(name, None)
+
+    def signals(self):
+        return {name: sorted(signals) for name, signals in self.series.items()}
+
+    def query(self, name, signal, start=None, end=None, points=500):
+        buf = self.series.get(name, {}).get(signal)
+        if buf is None:
+            return None
+        now = time.time()
+        end = end if end is not None else now
+        start = max(start if start is not None else end - self.retention, now - self.retention)
+        return downsample(buf.range(start, end), start, end, max(1, points))
+
+    def stats(self):
+        buffers = [buf for signals in self.series.values() for buf in signals.values()]
+        return {"signals": len(buffers), "capacity": self.capacity,
+                "samples": sum(buf.size for buf in buffers), "bytes": sum(buf.nbytes() for buf in buffers)}
@@ -0,0 +1,163 @@
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from app.core import config
+
+# Track (Chrome trace thread row) that spans without an explicit one are drawn on
+_track = contextvars.ContextVar("trace_track", default="gateway")
+
+class Span:
+    __slots__ = ("tracer", "name", "track", "args", "start", "token")
+
+    def __init__(self, tracer, name, track, args):
+        self.tracer = tracer
+        self.name = name
+        self.track = track
+        self.args = args
+
+    def __enter__(self):
+        self.token = _track.set(self.track)
+        self.start = time.perf_counter()
+        return self
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _track.reset(self.token)
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.spans.append((self.name, self.track, self.start, end, self.args))
+        return False
+
+class _NullSpan:
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class Tracer:
+    """Opt-in span recorder for the poll path, exported as Chrome/Perfetto trace JSON.
+
+    Spans are only recorded while tracing is on: always with TRACE_ENABLED, otherwise
+    for the few seconds a /api/debug/trace request asks for. Each device is its own
+    track; nested spans inherit the track of the span around them. A watcher task
+    records event-loop stalls longer than `stall_ms` on an "event loop" track. The
+    buffer keeps the last `capacity` spans.
+    """
+
+    def __init__(self, capacity=config.TRACE_BUFFER_SPANS, always=config.TRACE_ENABLED,
+                 stall_ms=config.TRACE_STALL_MS):
+        self.spans = deque(maxlen=capacity)
+        self.always = always
+        self.stall_ms = stall_ms
+        self.until = 0.0
+        self._watcher = None
+
+    @property
+    def active(self):
+        return self.always or time.perf_counter() < self.until
+
+    def span(self, name, track=None, **args):
+        if not self.active:
+            return NULL_SPAN
+        return Span(self, name, track or _track.get(), args)
+
+    def instant(self, name, track=None, **args):
+        if self.active:
+            now = time.perf_counter()
+            self.spans.append((name, track or _track.get(), now, None, args))
+
+    def enable(self, seconds=None):
+        """Records for `seconds` more (or for good with None) and starts the stall watcher"""
+        if seconds is None:
+            self.always = True
+        else:
+            self.until = max(self.until, time.perf_counter() + seconds)
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch_loop())
+
+    async def _watch_loop(self, interval=0.01):
+        while self.active:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            end = time.perf_counter()
+            late = end - start - interval
+            if late * 1000 >= self.stall_ms:
+                self.spans.append(("stall", "event loop", start + interval, end, {"late_ms": round(late * 1000, 1)}))
+
+    def export(self, since, until=None):
+        """Spans that started in [since, until] as a Chrome trace document"""
+        until = until if until is not None else time.perf_counter()
+        tids = {}
+        events = []
+        for name, track, start, end, args in list(self.spans):
+            if not since <= start <= until:
+                continue
+            tid = tids.get(track)
+            if tid is None:
+                tid = tids[track] = len(tids) + 1
+            event = {"name": name, "cat": "poll", "pid": os.getpid(), "tid": tid,
+                     "ts": round(start * 1e6, 1), "args": args}
+            if end is None:
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=round((end - start) * 1e6, 1))
+            events.append(event)
+        names = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": track}}
+                 for track, tid in tids.items()]
+        return {"traceEvents": names + events, "displayTimeUnit": "ms"}
+
+tracer = Tracer()
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample_stacks(thread_id, seconds, interval=0.005):
+    """Samples the stack of `thread_id` every `interval` seconds; returns Counter of root-first stacks.
+
+    Runs in its own thread, so it sees the event loop thread wherever it is, stalls included.
+    """
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(frame_name(frame))
+            frame = frame.f_back
+        if stack:
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+class Profiler:
+    """On-demand sampling profiler for the event loop thread, one run at a time"""
+
+    def __init__(self):
+        self.running = False
+
+    async def profile(self, seconds, interval=0.005):
+        """Folded stacks ("root;...;leaf count" lines, the flame graph input format), most frequent first"""
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        self.running = True
+        try:
+            stacks = await asyncio.to_thread(sample_stacks, threading.get_ident(), seconds, interval)
+        finally:
+            self.running = False
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+profiler = Profiler()
@@ -0,0 +1,191 @@
+import asyncio
+import itertools
+import logging
+import struct
+import time
+from collections import deque
+from pymodbus.pdu import ModbusExceptions
+from app.core.decode import encode_value
+from app.core.planner import plan_reads
+from app.core import config
+
+logger = logging.getLogger(__name__)
+
+# Modbus limits a single FC16 write to 123 registers
+MAX_WRITE_REGISTERS = 123
+
+F32 = struct.Struct(">f")
+HH = struct.Struct(">HH")
+
+def source_writes(dev, address, values):
+    """Maps image registers written by SCADA to (device register, value) pairs.
+
+    OEE and scale registers pass through unchanged. PM values are float32 in the image
+    and are re-encoded in the meter's own type and byte order, so a write must cover both
+    halves of each; pairing one half with the image's other half could send a torn value.
+    Raises ValueError for a partial float or a value that cannot be encoded.
+    """
+    written = {address + i - dev.offset: val for i, val in enumerate(values)}
+    if dev.type != "pm":
+        return [(1 + rel, val) for rel, val in sorted(written.items())]
+    out = []
+    for name, addr, rel, data_type in dev.get_pm_specs():
+        if rel not in written and rel + 1 not in written:
+            continue
+        if rel not in written or rel + 1 not in written:
+            raise ValueError(f"{name}: float32 needs both registers in one write")
+        try:
+            regs = encode_value(F32.unpack(HH.pack(written[rel], written[rel + 1]))[0], data_type, dev.byte_order)
+        except (struct.error, ValueError, OverflowError) as e:
+            raise ValueError(f"{name}: {e}")
+        out.extend((addr + i, reg) for i, reg in enumerate(regs))
+    return out
+
+class WriteRecord:
+    """One SCADA write request and what became of it"""
+
+    __slots__ = ("id", "device", "address", "count", "status", "error", "queued_at", "done_at", "remaining")
+
+    def __init__(self, id, device, address, count, remaining):
+        self.id = id
+        self.device = device
+        self.address = address
+        self.count = count
+        self.status = "queued"
+        self.error = None
+        self.queued_at = time.time()
+        self.done_at = None
+        self.remaining = remaining
+
+    def finish(self, error=None):
+        """Records one register written (or failed); returns True once the whole request is done"""
+        if self.status != "queued":
+            return False
+        if error is not None:
+            self.status, self.error = "error", error
+        else:
+            self.remaining -= 1
+            if self.remaining > 0:
+                return False
+            self.status = "ok"
+        self.done_at = time.time()
+        return True
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__ if key != "remaining"}
+
+class WriteThrough:
+    """Forwards SCADA writes in device register ranges to the devices behind them.
+
+    Each device has a queue holding the latest value per device register, so repeated
+    writes coalesce. One task per device drains it in FC16 requests over contiguous
+    registers, on the pooled connection the polls use, and then asks for an early poll
+    to read the result back. Writes never touch the image; the poll does.
+    """
+
+    def __init__(self, gateway, log_size=config.WRITE_LOG_SIZE):
+        self.gateway = gateway
+        self.queues = {}  # device name -> {device register: (value, [records])}
+        self.tasks = {}
+        self.log = deque(maxlen=log_size)
+        self.pending = {}  # record id -> record, until it finishes
+        self.ids = itertools.count(1)
+        self.on_done = None
+
+    def writable(self, dev):
+        return config.WRITE_THROUGH if dev.writable is None else dev.writable
+
+    def handle(self, address, values):
+        """Called by the image for every SCADA write; returns a Modbus exception code to refuse it"""
+        gw = self.gateway
+        spans = []
+        free = []
+        i = 0
+        while i < len(values):
+            dev = gw.registry.at(address + i)
+            # Derived registers have no source register to forward to
+            if dev is None or not self.writable(dev) or address + i >= dev.offset + dev.source_register_count():
+                free.append((address + i, values[i]))
+                i += 1
+                continue
+            end = min(len(values), dev.offset + dev.source_register_count() - address)
+            spans.append((dev, address + i, values[i:end]))
+            i = end
+        try:
+            writes = [(dev, start, source_writes(dev, start, vals)) for dev, start, vals in spans]
+        except ValueError as e:
+            logger.warning(f"Refusing SCADA write at {address}: {e}")
+            return ModbusExceptions.IllegalValue
+        for dev, _, regs in writes:
+            if len(self.queues.get(dev.name, ())) + len(regs) > config.WRITE_QUEUE_MAX:
+                return ModbusExceptions.SlaveBusy
+        # Registers of read-only devices and outside every device stay plain memory, as before
+        for addr, val in free:
+            gw.image.regs[addr] = val
+        for dev, start, regs in writes:
+            record = WriteRecord(next(self.ids), dev.name, start, len(regs), len({addr for addr, _ in regs}))
+            self.log.append(record)
+            self.pending[record.id] = record
+            if gw.shards:
+                gw.shards.write(dev, record.id, regs)
+            else:
+                self.submit(dev, regs, record)
+        return None
+
+    def submit(self, dev, regs, record):
+        queue = self.queues.setdefault(dev.name, {})
+        for addr, val in regs:
+            prev = queue.get(addr)
+            queue[addr] = (val, (prev[1] if prev else []) + [record])
+        task = self.tasks.get(dev.name)
+        if task is None or task.done():
+            self.tasks[dev.name] = asyncio.create_task(self.drain(dev.name))
+
+    async def drain(self, name):
+        gw = self.gateway
+        while self.queues.get(name):
+            batch = self.queues.pop(name)
+            dev = gw.registry.get(name)
+            for block in plan_reads([(addr, addr, 0, 1) for addr in batch], max_count=MAX_WRITE_REGISTERS):
+                addrs = range(block.start, block.start + block.count)
+                error = None
+                try:
+                    if dev is None:
+                        raise Exception("Device removed")
+                    async with gw.pool.connection(dev.ip, dev.port, dev.pipeline_window) as client:
+                        rr = await gw.request(dev, client.write_registers, block.start,
+                                              [batch[a][0] for a in addrs])
+                    if rr.isError():
+                        raise Exception(f"Write error: {rr}")
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                    logger.warning(f"Write to {name} registers {block.start}-{addrs[-1]} failed: {error}")
+                gw.writes_total.inc(name, "error" if error else "ok")
+                for addr in addrs:
+                    for record in batch[addr][1]:
+                        if record.finish(error):
+                            self.done(record)
+            if dev is not None:
+                gw.scheduler.expedite(name)
+        self.tasks.pop(name, None)
+
+    def done(self, record):
+        self.pending.pop(record.id, None)
+        if self.on_done is not None:
+            self.on_done(record)
+
+    def resolve(self, id, status, error):
+        """Applies a result reported by the shard worker that performed the write"""
+        record = self.pending.pop(id, None)
+        if record is not None:
+            record.status, record.error, record.done_at = status, error, time.time()
+
+    def forget(self, name):
+        queue = self.queues.pop(name, {})
+        for _, records in queue.values():
+            for record in records:
+                if record.finish("Device removed"):
+                    self.done(record)
+
+    def stats(self):
+        return {name: len(queue) for name, queue in self.queues.items() if queue}
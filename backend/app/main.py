@@ -1,10 +1,12 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import asyncio
 import logging
-from app.api.routes import router, load_devices
+from app.api.routes import router
 from app.core.gateway import gateway
+from app.core.startup import DEVICES_FILE, boot, save_image, store, timer
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +15,11 @@ app = FastAPI(title="Modbus Gateway")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 app.include_router(router, prefix="/api")
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Registered ahead of the static mount, which would otherwise claim every path under "/"
+    return PlainTextResponse(gateway.metrics.render(), media_type="text/plain; version=0.0.4")
+
 try:
     app.mount("/", StaticFiles(directory="frontend/build", html=True), name="static")
     logger.info("Frontend mounted successfully")
@@ -23,10 +30,12 @@ except Exception as e:
 async def startup():
     try:
         logger.info("Application startup...")
-        load_devices()
-        logger.info(f"Loaded {len(gateway.devices)} devices")
-        asyncio.create_task(gateway.start_server())
-        logger.info("Gateway server task started")
+        if gateway.server is None:
+            # Not booted ahead of the API by run.py
+            await boot()
+        asyncio.create_task(gateway.reconciler.watch(DEVICES_FILE))
+        timer.mark("api")
+        logger.info(f"API ready, {len(gateway.devices)} devices")
     except Exception as e:
         logger.error(f"Startup error: {e}", exc_info=True)
         raise
@@ -35,3 +44,13 @@ async def startup():
 async def shutdown():
     logger.info("Application shutdown...")
     gateway.running = False
+    # Before the shards stop: their shared memory holds the image
+    save_image()
+    await store.flush()
+    gateway.pool.close_all()
+    if gateway.shards:
+        gateway.shards.stop()
+    if gateway.historian:
+        await gateway.historian.stop()
+    if gateway.exporter:
+        await gateway.exporter.stop()
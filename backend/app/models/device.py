@@ -1,5 +1,9 @@
-from pydantic import BaseModel
-from typing import Literal, Optional, List, Tuple
+from pydantic import BaseModel, PrivateAttr
+from typing import Dict, Literal, Optional, List, Tuple, Union
+from app.core.decode import build_decode_plan
+from app.core import config
+
+DataType = Literal["int16", "uint16", "int32", "uint32", "float32", "float64"]
 
 DEFAULT_PM_PARAMS = [
     ("kwh", 2699), ("v1", 3027), ("v2", 3029), ("v3", 3031),
@@ -8,6 +12,34 @@ DEFAULT_PM_PARAMS = [
     ("p_total_kw", 3059)
 ]
 
+class DerivedSignal(BaseModel):
+    """A signal computed from another one on every poll"""
+    name: str
+    kind: Literal["delta", "rate", "total", "duration"]
+    source: str
+    wrap: Optional[int] = None  # counter modulus, e.g. 65536 for a 16-bit counter
+    per: float = 1.0  # rate unit in seconds: 60 gives per minute, 3600 turns kWh into kW
+    window: float = 0  # seconds a rate is averaged over, 0 for every poll
+    state: Optional[Union[str, float]] = None  # duration: source value being timed
+    reset: Optional[Literal["shift"]] = None  # totals and durations restart at every SHIFT_STARTS
+    image: bool = False  # also publish as float32 registers after the device's own
+
+DEFAULT_DERIVED = {
+    "pm": [
+        DerivedSignal(name="kw_from_kwh", kind="rate", source="kwh", per=3600, window=60),
+        DerivedSignal(name="kwh_shift", kind="total", source="kwh", reset="shift"),
+    ],
+    "oee": [
+        DerivedSignal(name="output_per_min", kind="rate", source="meters_hsc", wrap=65536, per=60, window=60),
+        DerivedSignal(name="output_shift", kind="total", source="meters_hsc", wrap=65536, reset="shift"),
+        DerivedSignal(name="running_sec_shift", kind="duration", source="available_status", state="Start",
+                      reset="shift"),
+        DerivedSignal(name="stopped_sec_shift", kind="duration", source="available_status", state="Stop",
+                      reset="shift"),
+    ],
+    "scale": [],
+}
+
 class Device(BaseModel):
     name: str
     ip: str
@@ -15,11 +47,64 @@ class Device(BaseModel):
     slave_id: int = 1
     type: Literal["oee", "pm", "scale"]
     offset: int
-    pm_params: Optional[List[Tuple[str, int]]] = None
+    pm_params: Optional[List[Union[Tuple[str, int], Tuple[str, int, DataType]]]] = None
+    data_type: DataType = "float32"  # default for pm_params entries without their own type
+    byte_order: Literal["ABCD", "CDAB", "BADC", "DCBA"] = "ABCD"
+    max_read_gap: int = 50
+    poll_interval: Optional[float] = None  # seconds, defaults to SCAN_INTERVAL_SEC
+    priority: int = 0  # higher polls first when deadlines coincide
+    pipeline_window: Optional[int] = None  # in-flight requests on this device's endpoint, defaults to PIPELINE_WINDOW
+    deadband: Union[float, str] = 0  # absolute, or "2%" of the last reported value
+    deadbands: Optional[Dict[str, Union[float, str]]] = None  # per-signal overrides
+    heartbeat: Optional[float] = None  # seconds, defaults to RBE_HEARTBEAT_SEC
+    writable: Optional[bool] = None  # forward SCADA writes to the device, defaults to WRITE_THROUGH
+    derived: Optional[List[DerivedSignal]] = None  # defaults to DEFAULT_DERIVED when DERIVED_DEFAULTS is on
     status: Optional[str] = None
     last_error: Optional[str] = None
-    
+    _read_plan: Optional[list] = PrivateAttr(default=None)
+    _retired: bool = PrivateAttr(default=False)  # replaced or removed; late poll results are dropped
+
     def get_pm_params(self):
         """Returns PM parameters with calculated relative offsets"""
         params = self.pm_params if self.pm_params else DEFAULT_PM_PARAMS
-        return [(name, addr, i*2) for i, (name, addr) in enumerate(params)]
+        return [(p[0], p[1], i*2) for i, p in enumerate(params)]
+
+    def get_pm_specs(self):
+        """Returns PM parameters as (name, addr, rel, data_type)"""
+        params = self.pm_params if self.pm_params else DEFAULT_PM_PARAMS
+        return [(p[0], p[1], i*2, p[2] if len(p) > 2 else self.data_type) for i, p in enumerate(params)]
+
+    def get_derived(self):
+        if self.derived is not None:
+            return self.derived
+        return DEFAULT_DERIVED[self.type] if config.DERIVED_DEFAULTS else []
+
+    def source_register_count(self):
+        """Registers mirrored from the device itself, before any derived signals"""
+        return 2 * len(self.get_pm_params()) if self.type == "pm" else {"oee": 4, "scale": 1}[self.type]
+
+    def derived_registers(self):
+        """Returns (name, relative offset) of derived signals published as float32 registers"""
+        base = self.source_register_count()
+        return [(spec.name, base + 2 * i) for i, spec in enumerate(s for s in self.get_derived() if s.image)]
+
+    def register_count(self):
+        """Registers the device occupies in the unified image"""
+        return self.source_register_count() + 2 * sum(1 for spec in self.get_derived() if spec.image)
+
+    def image_signals(self):
+        """Returns (name, relative offset, image data type) for every signal in the unified image"""
+        if self.type == "pm":
+            signals = [(name, rel, "float32") for name, _, rel in self.get_pm_params()]
+        elif self.type == "oee":
+            signals = [(name, i, "uint16") for i, name in
+                       enumerate(("available_status", "meters_hsc", "new_output_flag", "start_of_production"))]
+        else:
+            signals = [("weight", 0, "uint16")]
+        return signals + [(name, rel, "float32") for name, rel in self.derived_registers()]
+
+    def get_read_plan(self):
+        """Returns PM parameters merged into compiled block reads, built once per device"""
+        if self._read_plan is None:
+            self._read_plan = build_decode_plan(self.get_pm_specs(), self.byte_order, self.max_read_gap)
+        return self._read_plan
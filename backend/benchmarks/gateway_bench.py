@@ -0,0 +1,211 @@
+"""Gateway polling benchmark.
+
+Runs the gateway's poll scheduler against simulated field devices on localhost,
+one fresh process per fleet size, and reports how often each device is actually
+polled, how stale the published values get, and the gateway's CPU and memory.
+
+    cd backend
+    python benchmarks/gateway_bench.py --sizes 100,500,2000 --seconds 20
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from simulator_production import build_devices, build_layout, parse_mix
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+def cpu_seconds(pids):
+    """User+system CPU of other processes (shard workers), from /proc"""
+    total = 0.0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, IndexError):
+            pass
+    return total
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"simulator did not open port {port}")
+
+def fleet(args):
+    endpoints = math.ceil(args.devices / args.units)
+    layout = build_layout(endpoints, args.units, parse_mix(args.mix), args.base_port)
+    return endpoints, build_devices(layout)[:args.devices]
+
+def start_simulators(args, endpoints):
+    """Simulator processes, each serving every `sim_procs`-th endpoint, so the field side is not the bottleneck"""
+    cmd = [sys.executable, os.path.join(BACKEND, "simulator_production.py"), "--endpoints", str(endpoints),
+           "--units", str(args.units), "--mix", args.mix, "--base-port", str(args.base_port),
+           "--latency", str(args.latency), "--jitter", str(args.jitter), "--drop-rate", str(args.drop_rate),
+           "--timeout-rate", str(args.timeout_rate), "--update-hz", str(args.update_hz)]
+    procs = min(args.sim_procs, endpoints)
+    sims = [subprocess.Popen(cmd + ["--partition", f"{i}/{procs}"], stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL) for i in range(procs)]
+    for port in range(args.base_port + endpoints - procs, args.base_port + endpoints):
+        wait_for_port(port)
+    return sims
+
+async def measure(args, devices):
+    # Config is read at import time, so size the image and interval before importing the gateway
+    os.environ["UNIFIED_REG_COUNT"] = str(max(30000, devices[-1]["offset"] + 32))
+    os.environ["SCAN_INTERVAL_SEC"] = str(args.interval)
+    os.environ["HISTORIAN_ENABLED"] = "0"
+    os.environ["SHARD_WORKERS"] = str(args.shards)
+    from app.core.gateway import ModbusGateway
+    from app.models.device import Device
+
+    gw = ModbusGateway()
+    gw.devices = [Device(**d) for d in devices]
+    loop = asyncio.get_running_loop()
+    last_good, intervals = {}, []
+    counts = {"errors": 0}
+    measuring = [False]
+
+    def on_poll(name, entry):
+        now = loop.time()
+        if "error" in entry:
+            counts["errors"] += measuring[0]
+            return
+        if measuring[0] and name in last_good:
+            intervals.append(now - last_good[name])
+        last_good[name] = now
+
+    gw.listeners.append(on_poll)
+    gw.running = True
+    if gw.shards:
+        gw.shards.start(gw)
+        poller = None
+    else:
+        poller = asyncio.create_task(gw.poll_all())
+    await asyncio.sleep(args.warmup)
+
+    measuring[0] = True
+    pids = [proc.pid for proc in gw.shards.procs] if gw.shards else []
+    missed_before = sum(s["missed"] for s in gw.scheduler_stats().values())
+    started, cpu_before, workers_before = loop.time(), os.times(), cpu_seconds(pids)
+    staleness, rss = [], []
+    while loop.time() - started < args.seconds:
+        await asyncio.sleep(0.1)
+        now = loop.time()
+        staleness.extend(now - last_good.get(d.name, started - args.warmup) for d in gw.devices)
+        rss.append(rss_mb())
+    wall = loop.time() - started
+    cpu_after, workers_after = os.times(), cpu_seconds(pids)
+    missed = sum(s["missed"] for s in gw.scheduler_stats().values()) - missed_before
+
+    gw.running = False
+    if gw.shards:
+        gw.shards.stop()
+    else:
+        poller.cancel()
+        gw.pool.close_all()
+    cpu = (cpu_after.user - cpu_before.user + cpu_after.system - cpu_before.system
+           + workers_after - workers_before) / wall
+    return {
+        "devices": len(devices), "interval": args.interval, "shards": args.shards,
+        # From the mean poll interval; counting polls in the window would depend on where its edges fall
+        "polls_per_sec": len(last_good) * len(intervals) / sum(intervals) if intervals else 0.0,
+        "cycle_p50": percentile(intervals, 50), "cycle_p99": percentile(intervals, 99),
+        "stale_p50": percentile(staleness, 50), "stale_p95": percentile(staleness, 95),
+        "stale_p99": percentile(staleness, 99), "stale_max": max(staleness) if staleness else None,
+        "never_polled": len(devices) - len(last_good), "errors": counts["errors"], "missed": missed,
+        "cpu_pct": 100 * cpu, "rss_mb": max(rss) if rss else rss_mb(),
+    }
+
+def child(args):
+    import logging
+    logging.basicConfig(level=logging.CRITICAL if not args.verbose else logging.INFO)
+    endpoints, devices = fleet(args)
+    sims = start_simulators(args, endpoints)
+    try:
+        print(json.dumps(asyncio.run(measure(args, devices))), flush=True)
+    finally:
+        for sim in sims:
+            sim.terminate()
+            sim.wait()
+
+def fmt(val, scale=1000):
+    return "-" if val is None else f"{val * scale:.0f}"
+
+def main(args):
+    rows = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", "--devices", str(size)]
+        for key, val in vars(args).items():
+            if key not in ("child", "devices", "sizes", "verbose"):
+                cmd += [f"--{key.replace('_', '-')}", str(val)]
+        if args.verbose:
+            cmd.append("--verbose")
+        print(f"benchmarking {size} devices for {args.seconds}s ...", flush=True)
+        out = subprocess.run(cmd, cwd=BACKEND, capture_output=not args.verbose, text=True)
+        lines = (out.stdout or "").strip().splitlines()
+        if out.returncode != 0 or not lines:
+            print(f"  failed: {(out.stderr or '').strip()[-500:]}")
+            continue
+        rows.append(json.loads(lines[-1]))
+
+    print(f"\ninterval {args.interval}s, {args.units} units/endpoint, mix {args.mix}, latency {args.latency}s, "
+          f"{args.shards or 'no'} shard workers")
+    print(f"{'devices':>8} {'polls/s':>8} {'cycle p50':>10} {'cycle p99':>10} {'stale p50':>10} "
+          f"{'stale p95':>10} {'stale p99':>10} {'missed':>7} {'errors':>7} {'cpu %':>6} {'rss MB':>7}")
+    for r in rows:
+        print(f"{r['devices']:>8} {r['polls_per_sec']:>8.0f} {fmt(r['cycle_p50']):>8}ms {fmt(r['cycle_p99']):>8}ms "
+              f"{fmt(r['stale_p50']):>8}ms {fmt(r['stale_p95']):>8}ms {fmt(r['stale_p99']):>8}ms "
+              f"{r['missed']:>7} {r['errors']:>7} {r['cpu_pct']:>6.1f} {r['rss_mb']:>7.1f}")
+    return 0 if rows else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,500,2000", help="comma-separated fleet sizes")
+    parser.add_argument("--seconds", type=float, default=20, help="measurement window per size")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds to connect before measuring")
+    parser.add_argument("--interval", type=float, default=1.0, help="poll interval per device")
+    parser.add_argument("--units", type=int, default=10, help="unit ids per simulated endpoint")
+    parser.add_argument("--mix", default="pm=1,scale=1,oee=1")
+    parser.add_argument("--base-port", type=int, default=15001)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--update-hz", type=float, default=1.0)
+    parser.add_argument("--shards", type=int, default=0, help="poll worker processes (SHARD_WORKERS)")
+    parser.add_argument("--sim-procs", type=int, default=1, help="simulator processes")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--devices", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+    else:
+        sys.exit(main(args))
@@ -0,0 +1,129 @@
+"""Local stand-in for the MES side of the export pipeline.
+
+Accepts batches over HTTP (any POST path) and MQTT (a minimal QoS 1 broker that
+acknowledges and discards publishes), decodes them and prints what arrived:
+
+    python export_standin.py --http 8081 --mqtt 1883
+    EXPORT_URL=http://127.0.0.1:8081/ingest python run.py
+
+`--fail-rate` rejects a fraction of batches and `--down` refuses every batch for the
+first N seconds, to exercise spooling and replay.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import struct
+import time
+
+class Receiver:
+    def __init__(self, fail_rate=0.0, down=0.0, quiet=False):
+        self.fail_rate = fail_rate
+        self.down_until = time.monotonic() + down
+        self.quiet = quiet
+        self.batches = 0
+        self.samples = 0
+        self.bytes = 0
+        self.seqs = set()
+        self.repeats = 0
+
+    def accept(self):
+        """Whether to acknowledge the next batch"""
+        return time.monotonic() >= self.down_until and random.random() >= self.fail_rate
+
+    def receive(self, source, payload):
+        self.bytes += len(payload)
+        if payload[:2] == b"\x1f\x8b":
+            payload = gzip.decompress(payload)
+        batch = json.loads(payload)
+        self.batches += 1
+        self.samples += len(batch["samples"])
+        if batch["seq"] in self.seqs:
+            self.repeats += 1
+        self.seqs.add(batch["seq"])
+        if not self.quiet:
+            print(f"[{source}] seq={batch['seq']} samples={len(batch['samples'])} "
+                  f"age={time.time() - batch['sent_at']:.1f}s total={self.batches} batches/{self.samples} samples")
+
+    async def http(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b"\r\n\r\n")
+                headers = dict(line.split(": ", 1) for line in request.decode().split("\r\n")[1:] if ": " in line)
+                length = int({k.lower(): v for k, v in headers.items()}.get("content-length", 0))
+                body = await reader.readexactly(length)
+                if self.accept():
+                    self.receive("http", body)
+                    writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
+                else:
+                    writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def mqtt(self, reader, writer):
+        try:
+            while True:
+                first = (await reader.readexactly(1))[0]
+                length, shift = 0, 0
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                kind = first >> 4
+                if kind == 1:  # CONNECT
+                    writer.write(b"\x20\x02\x00\x00")
+                elif kind == 3:  # PUBLISH
+                    topic_len = struct.unpack(">H", body[:2])[0]
+                    pos = 2 + topic_len
+                    qos = (first >> 1) & 3
+                    pid = body[pos:pos + 2] if qos else b""
+                    if not self.accept():
+                        return  # drop the connection unacknowledged, like a failing broker
+                    self.receive("mqtt", body[pos + len(pid):])
+                    if qos:
+                        writer.write(b"\x40\x02" + pid)
+                elif kind == 12:  # PINGREQ
+                    writer.write(b"\xd0\x00")
+                elif kind == 14:  # DISCONNECT
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/MQTT stand-in for the export pipeline")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--http", type=int, default=8081, help="HTTP port (0 disables)")
+    parser.add_argument("--mqtt", type=int, default=1883, help="MQTT port (0 disables)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of batches rejected")
+    parser.add_argument("--down", type=float, default=0.0, help="reject everything for the first N seconds")
+    parser.add_argument("--quiet", action="store_true", help="only print totals every 10 s")
+    return parser.parse_args(argv)
+
+async def main(args):
+    receiver = Receiver(args.fail_rate, args.down, args.quiet)
+    servers = []
+    if args.http:
+        servers.append(await asyncio.start_server(receiver.http, args.host, args.http))
+        print(f"[STANDIN] HTTP on {args.host}:{args.http}")
+    if args.mqtt:
+        servers.append(await asyncio.start_server(receiver.mqtt, args.host, args.mqtt))
+        print(f"[STANDIN] MQTT on {args.host}:{args.mqtt}")
+    while True:
+        await asyncio.sleep(10)
+        print(f"[STANDIN] {receiver.batches} batches, {receiver.samples} samples, {receiver.bytes} bytes, "
+              f"{receiver.repeats} repeats")
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        print("\n[STANDIN] Stopped")
@@ -1,7 +1,11 @@
-import uvicorn
+import time
+STARTED = time.monotonic()
+import asyncio
+import importlib
 import sys
 import os
 import logging
+import multiprocessing
 from datetime import datetime
 
 # Setup logging
@@ -20,18 +24,33 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-try:
-    logger.info("Starting Modbus Gateway...")
-    logger.info(f"Python version: {sys.version}")
-    logger.info(f"Working directory: {os.getcwd()}")
+async def serve():
+    # Only the gateway core is imported before port 502 is up; FastAPI and uvicorn are not needed for that
+    from app.core.startup import boot, timer
+    timer.begin(STARTED)
+    await boot()
+    # The API stack is most of the import time: load it in a thread while the loop already serves SCADA
+    await asyncio.to_thread(importlib.import_module, "app.main")
+    uvicorn = await asyncio.to_thread(importlib.import_module, "uvicorn")
+    server = uvicorn.Server(uvicorn.Config("app.main:app", host="0.0.0.0", port=8000, reload=False, log_level="info"))
+    await server.serve()
+
+if __name__ == "__main__":
+    # Sharded polling spawns worker processes, which re-import this module
+    multiprocessing.freeze_support()
+    try:
+        logger.info("Starting Modbus Gateway...")
+        logger.info(f"Python version: {sys.version}")
+        logger.info(f"Working directory: {os.getcwd()}")
     
-    if getattr(sys, 'frozen', False):
-        logger.info("Running as frozen executable")
-        os.chdir(sys._MEIPASS)
-        logger.info(f"Changed to: {os.getcwd()}")
+        if getattr(sys, 'frozen', False):
+            logger.info("Running as frozen executable")
+            os.chdir(sys._MEIPASS)
+            logger.info(f"Changed to: {os.getcwd()}")
     
-    logger.info("Starting uvicorn server...")
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=False, log_level="info")
-except Exception as e:
-    logger.error(f"Fatal error: {e}", exc_info=True)
-    raise
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.error(f"Fatal error: {e}", exc_info=True)
+        raise
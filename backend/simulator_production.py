@@ -1,91 +1,242 @@
+"""Modbus TCP field simulator.
+
+With no arguments it serves the 33-device production layout on ports 5001-5018.
+Every part of the load is parameterized for benchmarks:
+
+    python simulator_production.py --endpoints 200 --units 10 --mix pm=3,scale=1,oee=1 \\
+        --latency 0.005 --jitter 0.002 --drop-rate 0.001 --timeout-rate 0.001 \\
+        --update-hz 1 --devices-out devices.json
+"""
+import argparse
 import asyncio
-import struct
+import json
 import random
-from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
-from pymodbus.server import StartAsyncTcpServer
+import struct
+import sys
+from array import array
+
+MBAP = struct.Struct(">HHHB")
+ADDR_COUNT = struct.Struct(">HH")
+
+DATA_TYPES = {"int16": "h", "uint16": "H", "int32": "i", "uint32": "I", "float32": "f", "float64": "d"}
 
-def float_to_regs(val):
-    return list(struct.unpack(">HH", struct.pack(">f", float(val))))
+# type -> [(name, address, data type, min, max)]; the gateway reads oee at 1-4 and scale at 1
+DEFAULT_REGISTER_MAP = {
+    "oee": [("available_status", 1, "uint16", 0, 1), ("meters_hsc", 2, "uint16", 0, 65535),
+            ("new_output_flag", 3, "uint16", 0, 1), ("start_of_production", 4, "uint16", 0, 1)],
+    "scale": [("weight", 1, "uint16", 0, 50000)],
+    "pm": [("kwh", 2699, "float32", 0, 10000), ("v1", 3027, "float32", 220, 240),
+           ("v2", 3029, "float32", 220, 240), ("v3", 3031, "float32", 220, 240),
+           ("v12", 3019, "float32", 380, 400), ("v23", 3021, "float32", 380, 400),
+           ("v13", 3023, "float32", 380, 400), ("a1", 2999, "float32", 0, 100),
+           ("a2", 3001, "float32", 0, 100), ("a3", 3003, "float32", 0, 100),
+           ("a_avg", 3009, "float32", 0, 100), ("freq_hz", 3109, "float32", 49.5, 50.5),
+           ("p_total_kw", 3059, "float32", 0, 50)],
+}
+
+LEGACY_LAYOUT = [
+    (5001, {1: "oee"}), (5002, {1: "oee"}), (5003, {1: "oee"}),  # Edge 1-3
+    (5004, {1: "oee"}), (5005, {1: "oee"}), (5006, {1: "oee"}),  # Edge 4-6
+    (5007, {1: "oee"}), (5008, {1: "oee"}), (5009, {1: "oee"}),  # Edge 7-9
+    (5010, {1: "pm", 2: "pm", 3: "scale"}),  # ETH1
+    (5011, {1: "pm", 2: "pm", 3: "scale"}),  # ETH2
+    (5012, {1: "pm", 2: "pm", 3: "pm"}),     # ETH3
+    (5013, {1: "pm", 2: "scale"}), (5014, {1: "pm", 2: "scale"}), (5015, {1: "pm", 2: "scale"}),  # ETH4-6
+    (5016, {1: "pm", 2: "scale"}), (5017, {1: "pm", 2: "scale"}), (5018, {1: "pm", 2: "scale"}),  # ETH7-9
+]
+
+class Unit:
+    """Registers of one slave id plus the compiled generators that refresh them"""
+
+    def __init__(self, device_type, register_map):
+        self.type = device_type
+        self.fields = []
+        size = 0
+        for _, addr, dtype, lo, hi in register_map[device_type]:
+            st = struct.Struct(">" + DATA_TYPES[dtype])
+            width = st.size // 2
+            self.fields.append((addr, width, st, lo, hi, dtype.startswith("float")))
+            size = max(size, addr + width)
+        self.regs = array("H", bytes(2 * (size + 1)))
+        self.words = {w: struct.Struct(f">{w}H") for w in (1, 2, 4)}
+
+    def update(self):
+        for addr, width, st, lo, hi, is_float in self.fields:
+            val = random.uniform(lo, hi) if is_float else random.randint(int(lo), int(hi))
+            self.regs[addr:addr + width] = array("H", self.words[width].unpack(st.pack(val)))
 
 class MultiSlaveSimulator:
-    def __init__(self, port, slaves):
+    """One Modbus TCP endpoint serving several unit ids, with injectable faults.
+
+    `latency`/`jitter` delay each response, `drop_rate` aborts the connection on a
+    request and `timeout_rate` leaves a request unanswered. Responses are sent as
+    they become ready, so pipelined requests may be answered out of order.
+    """
+
+    def __init__(self, port, slaves, host="127.0.0.1", register_map=None, latency=0.0, jitter=0.0,
+                 drop_rate=0.0, timeout_rate=0.0, update_interval=2.0):
+        self.host = host
         self.port = port
         self.slaves = slaves
-        self.context = None
-        
+        register_map = register_map or DEFAULT_REGISTER_MAP
+        self.units = {sid: Unit(device_type, register_map) for sid, device_type in slaves.items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.timeout_rate = timeout_rate
+        self.update_interval = update_interval
+        self.requests = 0
+
     async def update_loop(self):
-        await asyncio.sleep(2)
         print(f"[SIM] Port {self.port} updater started")
         while True:
             try:
-                for slave_id, device_type in self.slaves.items():
-                    if device_type == "oee":
-                        # OEE: Available flag (0/1), Meters HSC, New Output flag (0/1), Start of production (0/1)
-                        vals = [
-                            random.choice([0, 1]),      # available_flag (0=Stop, 1=Start)
-                            random.randint(0, 65535),   # meters_hsc (High Speed Counter)
-                            random.choice([0, 1]),      # new_output_flag
-                            random.choice([0, 1])       # start_of_production
-                        ]
-                        self.context[slave_id].setValues(3, 1, vals)
-                    elif device_type == "scale":
-                        weight = random.randint(0, 50000)
-                        self.context[slave_id].setValues(3, 1, [weight])
-                    else:  # pm
-                        pm = {2699: random.uniform(0, 10000), 3027: random.uniform(220, 240),
-                              3029: random.uniform(220, 240), 3031: random.uniform(220, 240),
-                              3019: random.uniform(380, 400), 3021: random.uniform(380, 400),
-                              3023: random.uniform(380, 400), 2999: random.uniform(0, 100),
-                              3001: random.uniform(0, 100), 3003: random.uniform(0, 100),
-                              3009: random.uniform(0, 100), 3109: random.uniform(49.5, 50.5),
-                              3059: random.uniform(0, 50)}
-                        for addr, val in pm.items():
-                            self.context[slave_id].setValues(3, addr, float_to_regs(val))
+                for unit in self.units.values():
+                    unit.update()
             except Exception as e:
                 print(f"[SIM] Port {self.port} error: {e}")
-            await asyncio.sleep(2)
-    
+            await asyncio.sleep(self.update_interval)
+
+    def execute(self, slave_id, pdu):
+        unit = self.units.get(slave_id)
+        fc = pdu[0]
+        if unit is None:
+            return bytes((fc | 0x80, 0x0B))  # gateway target device failed to respond
+        if fc in (3, 4) and len(pdu) == 5:
+            addr, count = ADDR_COUNT.unpack_from(pdu, 1)
+            if not 1 <= count <= 125 or addr + count > len(unit.regs):
+                return bytes((fc | 0x80, 0x02))
+            chunk = unit.regs[addr:addr + count]
+            if sys.byteorder == "little":
+                chunk.byteswap()
+            return bytes((fc, 2 * count)) + chunk.tobytes()
+        if fc == 6 and len(pdu) == 5:
+            addr, val = ADDR_COUNT.unpack_from(pdu, 1)
+            if addr >= len(unit.regs):
+                return bytes((fc | 0x80, 0x02))
+            unit.regs[addr] = val
+            return pdu
+        if fc == 16 and len(pdu) >= 6:
+            addr, count = ADDR_COUNT.unpack_from(pdu, 1)
+            if not 1 <= count <= 123 or addr + count > len(unit.regs) or len(pdu) < 6 + 2 * count:
+                return bytes((fc | 0x80, 0x02))
+            unit.regs[addr:addr + count] = array("H", struct.unpack_from(f">{count}H", pdu, 6))
+            return pdu[:5]
+        return bytes((fc | 0x80, 0x01))
+
+    def send(self, writer, tid, slave_id, response):
+        if not writer.is_closing():
+            writer.write(MBAP.pack(tid, 0, len(response) + 1, slave_id) + response)
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                tid, _, length, slave_id = MBAP.unpack(await reader.readexactly(MBAP.size))
+                pdu = await reader.readexactly(length - 1)
+                self.requests += 1
+                if self.drop_rate and random.random() < self.drop_rate:
+                    writer.transport.abort()
+                    return
+                if self.timeout_rate and random.random() < self.timeout_rate:
+                    continue
+                response = self.execute(slave_id, pdu)
+                delay = self.latency + (random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+                if delay > 0:
+                    loop.call_later(delay, self.send, writer, tid, slave_id, response)
+                else:
+                    self.send(writer, tid, slave_id, response)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
     async def run(self):
-        stores = {sid: ModbusSlaveContext(hr=ModbusSequentialDataBlock(0, [0]*50000)) 
-                  for sid in self.slaves.keys()}
-        self.context = ModbusServerContext(slaves=stores, single=False)
+        for unit in self.units.values():
+            unit.update()
         asyncio.create_task(self.update_loop())
-        print(f"[SIM] Starting 127.0.0.1:{self.port} slaves={list(self.slaves.keys())}")
-        await StartAsyncTcpServer(context=self.context, address=("127.0.0.1", self.port))
-
-async def main():
-    print("="*60)
-    print("Production Simulator - 33 Devices on localhost")
-    print("="*60)
-    
-    servers = [
-        MultiSlaveSimulator(5001, {1: "oee"}),  # Edge 1
-        MultiSlaveSimulator(5002, {1: "oee"}),  # Edge 2
-        MultiSlaveSimulator(5003, {1: "oee"}),  # Edge 3
-        MultiSlaveSimulator(5004, {1: "oee"}),  # Edge 4
-        MultiSlaveSimulator(5005, {1: "oee"}),  # Edge 5
-        MultiSlaveSimulator(5006, {1: "oee"}),  # Edge 6
-        MultiSlaveSimulator(5007, {1: "oee"}),  # Edge 7
-        MultiSlaveSimulator(5008, {1: "oee"}),  # Edge 8
-        MultiSlaveSimulator(5009, {1: "oee"}),  # Edge 9
-        MultiSlaveSimulator(5010, {1: "pm", 2: "pm", 3: "scale"}),  # ETH1
-        MultiSlaveSimulator(5011, {1: "pm", 2: "pm", 3: "scale"}),  # ETH2
-        MultiSlaveSimulator(5012, {1: "pm", 2: "pm", 3: "pm"}),      # ETH3
-        MultiSlaveSimulator(5013, {1: "pm", 2: "scale"}),           # ETH4
-        MultiSlaveSimulator(5014, {1: "pm", 2: "scale"}),           # ETH5
-        MultiSlaveSimulator(5015, {1: "pm", 2: "scale"}),           # ETH6
-        MultiSlaveSimulator(5016, {1: "pm", 2: "scale"}),           # ETH7
-        MultiSlaveSimulator(5017, {1: "pm", 2: "scale"}),           # ETH8
-        MultiSlaveSimulator(5018, {1: "pm", 2: "scale"}),           # ETH9
-    ]
-    
-    print(f"18 servers (ports 5001-5018), 33 devices total")
-    print("="*60)
-    
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        print(f"[SIM] Starting {self.host}:{self.port} slaves={list(self.slaves.keys())}")
+        async with server:
+            await server.serve_forever()
+
+def build_layout(endpoints, units, mix, base_port=5001):
+    """[(port, {slave_id: type})] with device types assigned round-robin from `mix`"""
+    types = [t for t, n in mix.items() for _ in range(n)]
+    layout, i = [], 0
+    for e in range(endpoints):
+        slaves = {}
+        for sid in range(1, units + 1):
+            slaves[sid] = types[i % len(types)]
+            i += 1
+        layout.append((base_port + e, slaves))
+    return layout
+
+def build_devices(layout, register_map=None, host="127.0.0.1", max_read_gap=50):
+    """Gateway devices.json entries for a layout, packed back to back in the register image"""
+    sizes = {"oee": 4, "scale": 1, "pm": 2 * len((register_map or DEFAULT_REGISTER_MAP)["pm"])}
+    devices, offset = [], 0
+    for port, slaves in layout:
+        for sid, device_type in slaves.items():
+            dev = {"name": f"{port} {device_type.upper()} {sid}", "ip": host, "port": port, "slave_id": sid,
+                   "type": device_type, "offset": offset, "max_read_gap": max_read_gap}
+            if register_map and device_type == "pm" and register_map["pm"] != DEFAULT_REGISTER_MAP["pm"]:
+                dev["pm_params"] = [[name, addr, dtype] for name, addr, dtype, _, _ in register_map["pm"]]
+            devices.append(dev)
+            offset += sizes[device_type]
+    return devices
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, count = part.partition("=")
+        mix[name.strip()] = int(count or 1)
+    return mix
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Modbus TCP field simulator")
+    parser.add_argument("--endpoints", type=int, help="number of TCP endpoints (default: production layout)")
+    parser.add_argument("--units", type=int, default=1, help="unit ids per endpoint")
+    parser.add_argument("--mix", default="pm=1,scale=1,oee=1", help="device type ratio, e.g. pm=3,scale=1")
+    parser.add_argument("--base-port", type=int, default=5001)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--register-map", help="JSON file: {type: [[name, addr, data_type, min, max], ...]}")
+    parser.add_argument("--latency", type=float, default=0.0, help="response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- random response delay in seconds")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of requests that reset the connection")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of requests never answered")
+    parser.add_argument("--update-hz", type=float, default=0.5, help="register value refreshes per second")
+    parser.add_argument("--devices-out", help="write the matching gateway devices.json here")
+    parser.add_argument("--partition", default="0/1", help="serve only endpoint i of every k, as i/k")
+    return parser.parse_args(argv)
+
+async def main(args):
+    register_map = None
+    if args.register_map:
+        with open(args.register_map) as f:
+            custom = {t: [tuple(field) for field in fields] for t, fields in json.load(f).items()}
+        register_map = {**DEFAULT_REGISTER_MAP, **custom}
+    if args.endpoints:
+        layout = build_layout(args.endpoints, args.units, parse_mix(args.mix), args.base_port)
+    else:
+        layout = LEGACY_LAYOUT
+    if args.devices_out:
+        with open(args.devices_out, "w") as f:
+            json.dump(build_devices(layout, register_map, args.host), f, indent=2)
+
+    part, parts = (int(x) for x in args.partition.split("/"))
+    layout = layout[part::parts]
+    servers = [MultiSlaveSimulator(port, slaves, args.host, register_map, args.latency, args.jitter,
+                                   args.drop_rate, args.timeout_rate, 1 / args.update_hz)
+               for port, slaves in layout]
+    total = sum(len(s.slaves) for s in servers)
+    print("=" * 60)
+    print(f"Simulator - {len(servers)} servers (ports {layout[0][0]}-{layout[-1][0]}), {total} devices on {args.host}")
+    print("=" * 60)
     await asyncio.gather(*[s.run() for s in servers])
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        asyncio.run(main(parse_args()))
     except KeyboardInterrupt:
         print("\n[SIM] Stopped")
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Tests import the application as `app`, the way run.py does from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("HISTORIAN_ENABLED", "0")
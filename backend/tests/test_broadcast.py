@@ -0,0 +1,42 @@
+import json
+from app.core.broadcast import BroadcastHub, Subscriber
+
+def entry(kwh, t):
+    return {"values": {"kwh": kwh, "v1": 230.0}, "timestamp": t, "status": "online"}
+
+def sent_after_flush(hub, sub):
+    hub._flush()
+    return [json.loads(sub.queue.get_nowait()) for _ in range(sub.queue.qsize())]
+
+def connect(hub, data):
+    sub = Subscriber(ws=None)
+    hub.clients.add(sub)
+    assert json.loads(hub.snapshot(sub))["data"] == data
+    return sub
+
+def test_first_delta_after_snapshot_skips_what_it_carried():
+    data = {"pm1": entry(1.0, 1), "pm2": entry(5.0, 1)}
+    hub = BroadcastHub(lambda: data)
+    hub.pending.update(pm1=True, pm2=True)  # published before any client connected
+    sub = connect(hub, data)
+    data["pm2"] = entry(6.0, 2)
+    hub.pending["pm2"] = True
+    assert sent_after_flush(hub, sub) == [{"type": "delta", "data": {"pm2": {"values": {"kwh": 6.0},
+                                                                             "timestamp": 2}}}]
+    # Later flushes go back to the shared deltas
+    data["pm1"] = entry(2.0, 3)
+    hub.pending["pm1"] = True
+    assert sent_after_flush(hub, sub) == [{"type": "delta", "data": {"pm1": {"values": {"kwh": 2.0},
+                                                                             "timestamp": 3}}}]
+
+def test_value_that_changed_and_came_back_since_the_snapshot_is_resent():
+    data = {"pm1": entry(1.0, 1)}
+    hub = BroadcastHub(lambda: data)
+    hub.pending["pm1"] = True
+    hub._flush()
+    data["pm1"] = entry(2.0, 2)
+    hub.pending["pm1"] = True
+    sub = connect(hub, data)
+    data["pm1"] = entry(1.0, 3)
+    assert sent_after_flush(hub, sub) == [{"type": "delta", "data": {"pm1": {"values": {"kwh": 1.0},
+                                                                             "timestamp": 3}}}]
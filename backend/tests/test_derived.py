@@ -0,0 +1,26 @@
+from datetime import datetime
+from app.core.derived import DerivedEngine, ShiftClock, increase
+from app.models.device import DerivedSignal
+
+def test_increase_counts_rollover_of_wrapping_counter():
+    assert increase(65500, 20, 65536) == 56
+
+def test_increase_treats_small_step_back_as_reset():
+    assert increase(930, 222, 65536) is None
+    assert increase(930, 222, None) is None
+
+def test_total_skips_reset_and_counts_rollover():
+    spec = DerivedSignal(name="out", kind="total", source="c", wrap=65536)
+    engine = DerivedEngine([spec], clock=ShiftClock(""))
+    for t, c in enumerate([900, 930, 222, 232, 65500, 20]):
+        out = engine.update({"c": c}, float(t))
+    # 30 before the reset, 10 + 65268 after it, then 56 across the rollover
+    assert out == {"out": 30 + 10 + 65268 + 56}
+
+def test_shift_total_restarts_at_shift_start():
+    spec = DerivedSignal(name="out", kind="total", source="c", reset="shift")
+    engine = DerivedEngine([spec], clock=ShiftClock("06:00,14:00,22:00"))
+    start = datetime(2026, 10, 18, 13, 59, 30).timestamp()
+    engine.update({"c": 0}, start)
+    assert engine.update({"c": 10}, start + 20) == {"out": 10}
+    assert engine.update({"c": 15}, start + 40) == {"out": 5}
@@ -0,0 +1,55 @@
+import asyncio
+import json
+import os
+from app.core.export import Exporter, Spool
+
+class Sink:
+    def __init__(self, fail=False, hang=False):
+        self.fail = fail
+        self.hang = hang
+        self.payloads = []
+        self.closed = False
+
+    async def send(self, payload, compressed):
+        if self.hang:
+            await asyncio.Event().wait()
+        if self.fail:
+            raise OSError("down")
+        self.payloads.append(payload)
+
+    def close(self):
+        self.closed = True
+
+def exporter(sink, tmp_path):
+    return Exporter(sink, compress=False, spool=Spool(str(tmp_path)), stop_timeout=0.1)
+
+def spooled(tmp_path):
+    return [json.loads((tmp_path / name).read_bytes())["seq"] for name in sorted(os.listdir(tmp_path))]
+
+def test_batch_in_flight_at_stop_is_spooled(tmp_path):
+    async def run():
+        export = exporter(Sink(hang=True), tmp_path)
+        export.start()
+        export.record("pm1", {"values": {"kwh": 1.0}})
+        export._close_batch()
+        export._pump()
+        await asyncio.sleep(0)
+        assert export.inflight == 1
+        await export.stop()
+        assert export.sink.closed
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+    assert spooled(tmp_path) == [1]
+
+def test_failed_spooled_batches_go_back_in_order(tmp_path):
+    async def run():
+        export = exporter(Sink(fail=True), tmp_path)
+        export.start()
+        for seq in (1, 2, 3):
+            await export.spool.put(seq, b'{"seq": %d}' % seq, False)
+        export._pump()
+        await asyncio.sleep(0.1)
+        assert list(export.spool.files) == ["000000000001.json", "000000000002.json", "000000000003.json"]
+        await export.stop()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
@@ -0,0 +1,33 @@
+import asyncio
+import contextlib
+from types import SimpleNamespace
+from app.core.gateway import gateway
+from app.models.device import Device
+
+class Client:
+    def __init__(self):
+        self.registers = [1, 100, 0, 0]
+
+    async def read_holding_registers(self, address, count, slave=1):
+        return SimpleNamespace(registers=list(self.registers[:count]), isError=lambda: False)
+
+async def _yield(value):
+    yield value
+
+def test_image_keeps_values_held_back_by_the_deadband(monkeypatch):
+    client = Client()
+    monkeypatch.setattr(gateway, "pool", SimpleNamespace(
+        connection=contextlib.asynccontextmanager(lambda *args: _yield(client))))
+    dev = Device(name="oee1", ip="10.0.0.1", type="oee", offset=10, derived=[], deadbands={"meters_hsc": 5})
+    monkeypatch.setattr(gateway, "devices", [dev])
+    for state in ("filters", "derived", "health", "rtt", "buffers", "device_data"):
+        monkeypatch.setattr(gateway, state, {})
+
+    async def polls():
+        await gateway.poll_oee(dev)
+        client.registers = [1, 103, 1, 0]  # counter inside its deadband, flag changed
+        return await gateway.poll_oee(dev)
+
+    assert asyncio.run(polls()) == {"new_output_flag": 1}
+    assert gateway.image.regs[10:14].tolist() == [1, 100, 1, 0]
+    assert gateway.filter_for(dev).values["meters_hsc"] == 100
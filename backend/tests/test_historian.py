@@ -0,0 +1,35 @@
+import asyncio
+import sqlite3
+from app.core.historian import Historian
+
+def samples(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT t, v FROM samples ORDER BY t").fetchall()
+
+def test_stop_writes_the_batch_the_writer_holds(tmp_path):
+    path = tmp_path / "history.db"
+
+    async def run():
+        # A long flush interval keeps the first samples in the writer's batch, off the queue
+        historian = Historian(path=str(path), batch_size=100, flush_interval=60)
+        historian.start()
+        historian.record("pm1", {"values": {"kwh": 1.0}, "timestamp": 1.0})
+        await asyncio.sleep(0.05)
+        historian.record("pm1", {"values": {"kwh": 2.0}, "timestamp": 2.0})
+        await historian.stop()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+    assert samples(path) == [(1.0, 1.0), (2.0, 2.0)]
+
+def test_stop_returns_when_a_sample_arrives_in_the_same_tick(tmp_path):
+    path = tmp_path / "history.db"
+
+    async def run():
+        historian = Historian(path=str(path), flush_interval=60)
+        historian.start()
+        await asyncio.sleep(0.05)  # writer waiting on an empty queue
+        historian.record("pm1", {"values": {"kwh": 1.0}, "timestamp": 1.0})
+        await historian.stop()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+    assert samples(path) == [(1.0, 1.0)]
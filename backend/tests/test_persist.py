@@ -0,0 +1,32 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from app.core.persist import DeviceStore
+from app.core.startup import load_devices
+
+SCALE = {"name": "scale1", "ip": "10.0.0.1", "type": "scale", "offset": 0}
+
+def test_schema_invalid_file_falls_back_to_valid_backup(tmp_path):
+    path = tmp_path / "devices.json"
+    path.write_text(json.dumps([{**SCALE, "type": "robot"}]))  # valid JSON, invalid device
+    (tmp_path / "devices.json.1").write_text(json.dumps([SCALE]))
+    gw = SimpleNamespace(devices=None)
+    store = DeviceStore(path, lambda: gw.devices, delay=0, backups=2)
+    load_devices(gw, store)
+    assert [dev.name for dev in gw.devices] == ["scale1"]
+
+    # Saving must not rotate the invalid file over the good backup
+    async def save():
+        store.save()
+        await store.flush()
+
+    asyncio.run(save())
+    assert json.loads(path.read_text())[0]["type"] == "scale"
+    assert json.loads((tmp_path / "devices.json.1").read_text()) == [SCALE]
+    assert not (tmp_path / "devices.json.2").exists()
+
+def test_overlapping_registers_fall_back_to_backup(tmp_path):
+    path = tmp_path / "devices.json"
+    path.write_text(json.dumps([SCALE, {**SCALE, "name": "scale2"}]))
+    (tmp_path / "devices.json.1").write_text(json.dumps([SCALE]))
+    assert [dev.name for dev in DeviceStore(path, list).load()] == ["scale1"]
@@ -0,0 +1,20 @@
+import asyncio
+import json
+from starlette.requests import Request
+from app.api import routes
+from app.core.gateway import gateway
+from app.models.device import Device
+
+def get(path):
+    return Request({"type": "http", "method": "GET", "path": path, "headers": []})
+
+def test_device_list_shows_a_device_right_after_it_was_added(monkeypatch):
+    monkeypatch.setattr(routes.store, "save", lambda: None)
+    monkeypatch.setattr(gateway, "devices", [])
+
+    async def add_then_get():
+        assert json.loads((await routes.get_devices(get("/api/devices"))).body) == []
+        await routes.add_device(Device(name="scale1", ip="10.0.0.1", type="scale", offset=0))
+        return json.loads((await routes.get_devices(get("/api/devices"))).body)
+
+    assert [d["name"] for d in asyncio.run(add_then_get())] == ["scale1"]
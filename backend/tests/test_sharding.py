@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+import pytest
+from app.core.sharding import ShardManager, SharedRegisterImage, shard_of
+from app.models.device import Device
+
+class Commands(list):
+    put = list.append
+
+@pytest.fixture
+def shards():
+    manager = ShardManager(2, size=1000)
+    manager.commands = [Commands(), Commands()]
+    manager.gateway = SimpleNamespace(devices=[])
+    yield manager
+    manager.image.release()
+    manager.shm.close()
+    manager.shm.unlink()
+
+def scale(ip, offset, name="scale1"):
+    return Device(name=name, ip=ip, type="scale", offset=offset, derived=[])
+
+def ip_in_shard(index):
+    return next(f"10.0.0.{n}" for n in range(1, 50) if shard_of(scale(f"10.0.0.{n}", 0), 2) == index)
+
+def sync(shards, devices):
+    shards.gateway.devices = devices
+    shards.sync(devices)
+
+def confirm(shards, index):
+    kind, (generation, devices) = shards.commands[index][-1]
+    shards._apply(("applied", index, generation))
+    return [d["name"] for d in devices]
+
+def test_device_moves_to_new_shard_only_after_old_one_retired_it(shards):
+    old = scale(ip_in_shard(0), 100)
+    sync(shards, [old])
+    assert confirm(shards, 0) == ["scale1"]
+    SharedRegisterImage(1000, shards.shm, 2, 0).commit(100, [7])
+
+    # New endpoint and offset: the device moves from shard 0 to shard 1
+    new = scale(ip_in_shard(1), 200)
+    sync(shards, [new])
+    assert shards.commands[0][-1][1][1] == []
+    assert shards.commands[1] == []
+    assert shards.image.getValues(100) == [7]  # shard 0 may still be committing it
+
+    seq = shards.image.seqs[2]
+    assert confirm(shards, 0) == []
+    assert shards.image.getValues(100) == [0]
+    assert shards.image.seqs[2] == seq + 2  # cleared under the main process's sequence counter
+    assert confirm(shards, 1) == ["scale1"]
+
+def test_device_landing_on_a_retired_range_waits_for_the_clear(shards):
+    sync(shards, [scale(ip_in_shard(0), 100)])
+    confirm(shards, 0)
+    SharedRegisterImage(1000, shards.shm, 2, 0).commit(100, [7])
+
+    # scale1 removed, scale2 added on its registers in the same shard
+    sync(shards, [scale(ip_in_shard(0), 100, "scale2")])
+    assert shards.commands[0][-1][1][1] == []
+    confirm(shards, 0)
+    assert shards.image.getValues(100) == [0]
+    assert confirm(shards, 0) == ["scale2"]
@@ -0,0 +1,12 @@
+from app.core.timeseries import TimeSeriesStore
+
+def test_history_costs_12_bytes_per_sample():
+    store = TimeSeriesStore(capacity=3600, retention=1e9)
+    store.record("pm1", {"values": {"kwh": 1234.5, "v1": 230.25}, "timestamp": 100.0})
+    assert store.stats()["bytes"] == 2 * 3600 * 12
+
+def test_ring_keeps_the_latest_samples_in_order():
+    store = TimeSeriesStore(capacity=3, retention=1e9)
+    for t in range(5):
+        store.record("pm1", {"values": {"kwh": t + 0.5}, "timestamp": float(t)})
+    assert list(store.series["pm1"]["kwh"].range(0, 10)) == [(2.0, 2.5), (3.0, 3.5), (4.0, 4.5)]
@@ -0,0 +1,24 @@
+import pytest
+from pymodbus.pdu import ModbusExceptions
+from app.core.gateway import gateway
+from app.core.writes import HH, F32, source_writes
+from app.models.device import Device
+
+def meter(**kw):
+    return Device(name="pm1", ip="10.0.0.1", type="pm", offset=100, pm_params=[("kwh", 2699), ("v1", 3027)],
+                  writable=True, derived=[], **kw)
+
+def test_pm_float_written_in_one_request_is_forwarded():
+    hi, lo = HH.unpack(F32.pack(230.5))
+    assert source_writes(meter(), 102, [hi, lo]) == [(3027, hi), (3028, lo)]
+
+def test_single_half_of_a_pm_float_is_refused():
+    with pytest.raises(ValueError):
+        source_writes(meter(), 102, [0x4366])
+    with pytest.raises(ValueError):
+        source_writes(meter(), 101, [0, 0x4366])  # low half of kwh, high half of v1
+
+def test_scada_write_to_one_half_gets_illegal_value(monkeypatch):
+    monkeypatch.setattr(gateway, "devices", [meter()])
+    assert gateway.writer.handle(103, [0x8000]) == ModbusExceptions.IllegalValue
+    assert not gateway.writer.queues.get("pm1")
@@ -33,7 +33,7 @@ import {
   VisibilityOff
 } from '@mui/icons-material';
 import { styled } from '@mui/material/styles';
-import { apiCall } from '../config/api';
+import { apiCall, subscribeData } from '../config/api';
 
 const StyledCard = styled(Card)(({ theme }) => ({
   borderRadius: 16,
@@ -74,31 +74,9 @@ function Dashboard() {
   const [showAllDevices, setShowAllDevices] = useState(true);
 
   useEffect(() => {
-    const fetchData = async () => {
+    const fetchDevices = async () => {
       try {
-        const [dataRes, devicesRes] = await Promise.all([
-          apiCall('/data').catch(() => ({ ok: false })),
-          apiCall('/devices').catch(() => ({ ok: false }))
-        ]);
-        
-        if (dataRes.ok) {
-          const dataText = await dataRes.text();
-          try {
-            const dataJson = JSON.parse(dataText);
-            setData(dataJson);
-          } catch (e) {
-            console.warn('API not available, using mock data');
-            setData({
-              'Device-1': { status: 'online', values: { temperature: 25.5, pressure: 1.2, flow: 45.8, voltage: 220, current: 15.2 } },
-              'Device-2': { status: 'offline', error: 'Connection timeout' }
-            });
-          }
-        } else {
-          setData({
-            'Device-1': { status: 'online', values: { temperature: 25.5, pressure: 1.2, flow: 45.8, voltage: 220, current: 15.2 } },
-            'Device-2': { status: 'offline', error: 'Connection timeout' }
-          });
-        }
+        const devicesRes = await apiCall('/devices').catch(() => ({ ok: false }));
         
         if (devicesRes.ok) {
           const devicesText = await devicesRes.text();
@@ -118,14 +96,8 @@ function Dashboard() {
             { name: 'Device-2', type: 'pm', ip: '192.168.1.101', port: 502, slave_id: 2, offset: '0x0010' }
           ]);
         }
-        
-        setLastUpdate(new Date());
       } catch (error) {
-        console.error('Error fetching data:', error);
-        setData({
-          'Device-1': { status: 'online', values: { temperature: 25.5, pressure: 1.2, flow: 45.8, voltage: 220, current: 15.2 } },
-          'Device-2': { status: 'offline', error: 'Connection timeout' }
-        });
+        console.error('Error fetching devices:', error);
         setDevices([
           { name: 'Device-1', type: 'oee', ip: '192.168.1.100', port: 502, slave_id: 1, offset: '0x0000' },
           { name: 'Device-2', type: 'pm', ip: '192.168.1.101', port: 502, slave_id: 2, offset: '0x0010' }
@@ -133,9 +105,16 @@ function Dashboard() {
       }
     };
 
-    fetchData();
-    const interval = setInterval(fetchData, 2000);
-    return () => clearInterval(interval);
+    fetchDevices();
+    const interval = setInterval(fetchDevices, 10000);
+    const unsubscribe = subscribeData((liveData) => {
+      setData(liveData);
+      setLastUpdate(new Date());
+    });
+    return () => {
+      clearInterval(interval);
+      unsubscribe();
+    };
   }, []);
 
   useEffect(() => {
@@ -35,7 +35,7 @@ import {
   Refresh
 } from '@mui/icons-material';
 import { styled } from '@mui/material/styles';
-import { apiCall } from '../config/api';
+import { apiCall, subscribeData } from '../config/api';
 
 const StyledTableContainer = styled(TableContainer)(({ theme }) => ({
   borderRadius: 16,
@@ -71,9 +71,7 @@ function DeviceManager() {
 
   useEffect(() => {
     fetchDevices();
-    fetchData();
-    const interval = setInterval(fetchData, 3000);
-    return () => clearInterval(interval);
+    return subscribeData(setData);
   }, []);
 
   const fetchDevices = async () => {
@@ -106,36 +104,6 @@ function DeviceManager() {
     }
   };
 
-  const fetchData = async () => {
-    try {
-      const response = await apiCall('/data').catch(() => ({ ok: false }));
-      if (response.ok) {
-        const text = await response.text();
-        try {
-          const data = JSON.parse(text);
-          setData(data);
-        } catch (e) {
-          console.warn('Data API not available, using mock data');
-          setData({
-            'Device-1': { status: 'online', values: { temperature: 25.5, pressure: 1.2, flow: 45.8 } },
-            'Device-2': { status: 'offline', error: 'Connection timeout' }
-          });
-        }
-      } else {
-        setData({
-          'Device-1': { status: 'online', values: { temperature: 25.5, pressure: 1.2, flow: 45.8 } },
-          'Device-2': { status: 'offline', error: 'Connection timeout' }
-        });
-      }
-    } catch (error) {
-      console.error('Error fetching data:', error);
-      setData({
-        'Device-1': { status: 'online', values: { temperature: 25.5, pressure: 1.2, flow: 45.8 } },
-        'Device-2': { status: 'offline', error: 'Connection timeout' }
-      });
-    }
-  };
-
   const handleSubmit = async () => {
     try {
       const url = editDevice ? `/devices/${editDevice.name}` : '/devices';
@@ -16,4 +16,53 @@ export const API_BASE_URL = getApiBaseUrl();
 export const apiCall = async (endpoint, options = {}) => {
   const url = `${API_BASE_URL}${endpoint}`;
   return fetch(url, options);
-};
\ No newline at end of file
+};
+export const WS_URL = `${API_BASE_URL.replace(/^http/, 'ws')}/ws`;
+
+const mergeDelta = (state, delta) => {
+  const next = { ...state };
+  Object.entries(delta).forEach(([name, change]) => {
+    if (change === null) {
+      delete next[name];
+      return;
+    }
+    const merged = { ...(next[name] || {}), ...change };
+    if (change.values && next[name] && next[name].values) {
+      merged.values = { ...next[name].values, ...change.values };
+    }
+    Object.keys(merged).forEach((key) => merged[key] === null && delete merged[key]);
+    next[name] = merged;
+  });
+  return next;
+};
+
+// Live device data over the broadcast WebSocket: one snapshot, then only changed values.
+// Pass a list of device names to receive a subset. Returns an unsubscribe function.
+export const subscribeData = (onData, devices = null) => {
+  let ws = null;
+  let state = {};
+  let closed = false;
+  let retry = null;
+
+  const connect = () => {
+    ws = new WebSocket(WS_URL);
+    ws.onopen = () => {
+      if (devices) ws.send(JSON.stringify({ subscribe: devices }));
+    };
+    ws.onmessage = (event) => {
+      const msg = JSON.parse(event.data);
+      state = msg.type === 'snapshot' ? msg.data : mergeDelta(state, msg.data);
+      onData(state);
+    };
+    ws.onclose = () => {
+      if (!closed) retry = setTimeout(connect, 2000);
+    };
+  };
+
+  connect();
+  return () => {
+    closed = true;
+    clearTimeout(retry);
+    if (ws) ws.close();
+  };
+};